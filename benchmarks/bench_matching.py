@@ -0,0 +1,152 @@
+"""Compare FuzzyMatcher with difflib on activity libraries of realistic size.
+
+Usage:
+    uv run python benchmarks/bench_matching.py [--sizes 5000 10000 20000]
+
+For every library size a synthetic activity library and a mix of queries
+(exact names, misspelled names and unrelated names) are generated from a
+fixed seed. Both implementations answer the same lookups as
+``search_frontend_activity`` and ``match_synonym_to_activity``; the script
+fails if any answer differs and prints the time per lookup otherwise.
+"""
+
+import argparse
+import os
+import random
+import string
+import time
+from difflib import get_close_matches
+
+# The package settings require a base URL even though nothing is requested
+os.environ.setdefault("OSB_BASE_URL", "http://fake-osb/api")
+
+from usdm_osb_uploader.osb.matching import FuzzyMatcher  # noqa: E402
+
+WORDS = (
+    "blood pressure heart rate body weight height temperature respiratory "
+    "serum plasma urine creatinine glucose sodium potassium chloride calcium "
+    "albumin bilirubin alanine aspartate aminotransferase alkaline phosphatase "
+    "hemoglobin hematocrit platelet leukocyte neutrophil lymphocyte count "
+    "electrocardiogram echocardiogram physical examination vital signs "
+    "informed consent pregnancy test medical history concomitant medication "
+    "adverse event questionnaire score assessment sample collection biopsy "
+    "copper ceruloplasmin urinalysis coagulation prothrombin time antibody"
+).split()
+
+
+def make_library(size: int, rng: random.Random) -> list[str]:
+    names = set()
+    while len(names) < size:
+        names.add(" ".join(rng.choices(WORDS, k=rng.randint(1, 4))))
+    return sorted(names, key=lambda _: rng.random())
+
+
+def misspell(name: str, rng: random.Random) -> str:
+    chars = list(name)
+    for _ in range(max(1, len(chars) // 8)):
+        position = rng.randrange(len(chars))
+        chars[position] = rng.choice(string.ascii_lowercase)
+    return "".join(chars)
+
+
+def make_queries(library: list[str], count: int, rng: random.Random) -> list[str]:
+    queries = []
+    for i in range(count):
+        name = rng.choice(library)
+        if i % 3 == 0:
+            queries.append(name)
+        elif i % 3 == 1:
+            queries.append(misspell(name, rng))
+        else:
+            queries.append(
+                "".join(rng.choices(string.ascii_lowercase + " ", k=len(name)))
+            )
+    return queries
+
+
+def difflib_best(library: list[str], query: str, cutoff: float) -> str | None:
+    match = get_close_matches(query, library, n=1, cutoff=cutoff)
+    return match[0] if match else None
+
+
+def difflib_first_match(
+    library: list[str], synonyms: set[str], cutoff: float
+) -> str | None:
+    for name in library:
+        if get_close_matches(name, synonyms, n=1, cutoff=cutoff):
+            return name
+    return None
+
+
+def timed(function, *args) -> tuple[object, float]:
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def run(size: int, queries: int, cutoff: float, seed: int):
+    rng = random.Random(seed)
+    library = make_library(size, rng)
+    lookups = make_queries(library, queries, rng)
+    synonym_sets = [
+        {lookups[i], lookups[(i + 1) % len(lookups)]} for i in range(len(lookups))
+    ]
+
+    matcher, build = timed(FuzzyMatcher, library)
+
+    def fuzzy_best():
+        results = []
+        for query in lookups:
+            position = matcher.best(query, cutoff)
+            results.append(None if position is None else library[position])
+        return results
+
+    def fuzzy_first():
+        results = []
+        for synonyms in synonym_sets:
+            position = matcher.first_match(synonyms, cutoff)
+            results.append(None if position is None else library[position])
+        return results
+
+    expected_best, difflib_best_time = timed(
+        lambda: [difflib_best(library, query, cutoff) for query in lookups]
+    )
+    actual_best, fuzzy_best_time = timed(fuzzy_best)
+    expected_first, difflib_first_time = timed(
+        lambda: [difflib_first_match(library, s, cutoff) for s in synonym_sets]
+    )
+    actual_first, fuzzy_first_time = timed(fuzzy_first)
+
+    if actual_best != expected_best or actual_first != expected_first:
+        raise SystemExit(f"FuzzyMatcher disagrees with difflib at size {size}")
+
+    for lookup, difflib_time, fuzzy_time in (
+        ("name", difflib_best_time, fuzzy_best_time),
+        ("synonyms", difflib_first_time, fuzzy_first_time),
+    ):
+        print(
+            f"{size:>7} {lookup:>9} "
+            f"{difflib_time / queries * 1000:>12.2f} "
+            f"{fuzzy_time / queries * 1000:>12.2f} "
+            f"{difflib_time / fuzzy_time:>8.1f}x"
+        )
+    print(f"{'':>7} {'index':>9} {'':>12} {build * 1000:>12.2f}  build (ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5000, 10000, 20000])
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--cutoff", type=float, default=0.6)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"{'size':>7} {'lookup':>9} {'difflib ms':>12} {'fuzzy ms':>12} {'speedup':>9}"
+    )
+    for size in args.sizes:
+        run(size, args.queries, args.cutoff, args.seed)
+
+
+if __name__ == "__main__":
+    main()
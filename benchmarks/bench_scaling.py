@@ -0,0 +1,166 @@
+"""Measure how each upload step scales with the size of the study.
+
+Usage:
+    uv run python benchmarks/bench_scaling.py [--scales 1 2 4 8]
+        [--vary encounters instances] [--latency 0]
+
+Synthetic studies (see ``synthetic_usdm.py``) are generated with every count
+of the default ``StudySize``, or only the ``--vary`` ones, multiplied by each
+scale, and uploaded against the fake OSB with the steps run one at a time.
+For every step the script reports the time and number of requests at each
+scale and their growth exponent between the smallest and largest scale: 1
+means the step grows linearly with the study, 2 quadratically. Without
+latency the times are the uploader's own CPU time plus the fake's. Results
+are written as JSON to ``benchmarks/results/`` (or ``--output``).
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from dataclasses import asdict, fields
+from datetime import datetime, timezone
+from pathlib import Path
+
+# The fake answers whatever base URL the settings point at
+os.environ.setdefault("OSB_BASE_URL", "http://fake-osb/api")
+os.environ.setdefault("OSB_CT_CACHE_ENABLED", "false")
+
+from synthetic_usdm import StudySize, generate_usdm  # noqa: E402
+
+from usdm_osb_uploader.fake_osb import FakeOsb  # noqa: E402
+from usdm_osb_uploader.osb.session import osb_session  # noqa: E402
+from usdm_osb_uploader.pipeline import run_steps, upload_steps  # noqa: E402
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def timed_step(step, durations: dict[str, float]):
+    run = step.run
+
+    async def timed(results):
+        start = time.perf_counter()
+        result = run(results)
+        if result is not None:
+            result = await result
+        durations[step.name] = time.perf_counter() - start
+        return result
+
+    step.run = timed
+    return step
+
+
+async def upload(usdm_data: dict, latency: float) -> dict[str, dict]:
+    """Time and requests of every step of uploading ``usdm_data``."""
+    durations: dict[str, float] = {}
+    steps = [timed_step(step, durations) for step in upload_steps(usdm_data)]
+    async with osb_session(ct_cache=False, transport=FakeOsb(latency=latency)) as (
+        session
+    ):
+        await run_steps(steps, max_concurrency=1)
+        requests = {
+            step: summary["requests"]
+            for step, summary in session.metrics.by_step().items()
+        }
+    return {
+        name: {"time": duration, "requests": requests.get(name, 0)}
+        for name, duration in durations.items()
+    }
+
+
+def exponent(first: float, last: float, scale: float) -> float | None:
+    """Growth exponent ``k`` of ``last = first * scale ** k``."""
+    if first <= 0 or last <= 0 or scale <= 1:
+        return None
+    return math.log(last / first) / math.log(scale)
+
+
+def format_exponent(value: float | None) -> str:
+    return "-" if value is None else f"{value:.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument(
+        "--vary",
+        nargs="+",
+        choices=[field.name for field in fields(StudySize)],
+        help="Counts to scale; all by default",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds per fake response"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Results file to write")
+    args = parser.parse_args()
+
+    scales = sorted(args.scales)
+    runs = []
+    # Uploads print their progress and download the study into the working
+    # directory, neither of which belongs in the benchmark output
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for scale in scales:
+                size = StudySize().scaled(scale, args.vary)
+                print(f"Uploading scale {scale:g}: {size}", file=sys.stderr)
+                usdm_data = generate_usdm(size, seed=args.seed)
+                with (
+                    open(os.devnull, "w") as devnull,
+                    contextlib.redirect_stdout(devnull),
+                ):
+                    steps = asyncio.run(upload(usdm_data, args.latency))
+                runs.append({"scale": scale, "size": asdict(size), "steps": steps})
+        finally:
+            os.chdir(cwd)
+
+    first, last = runs[0], runs[-1]
+    growth = last["scale"] / first["scale"]
+    labels = [f"x{run['scale']:g}" for run in runs]
+    print(
+        f"{'step':<22}"
+        + "".join(f" {label + ' s':>9}" for label in labels)
+        + f" {'k time':>7}"
+        + "".join(f" {label + ' req':>9}" for label in labels)
+        + f" {'k req':>6}"
+    )
+    exponents = {}
+    for name in first["steps"]:
+        times = [run["steps"][name]["time"] for run in runs]
+        requests = [run["steps"][name]["requests"] for run in runs]
+        exponents[name] = {
+            "time": exponent(times[0], times[-1], growth),
+            "requests": exponent(requests[0], requests[-1], growth),
+        }
+        print(
+            f"{name:<22}"
+            + "".join(f" {value:>9.3f}" for value in times)
+            + f" {format_exponent(exponents[name]['time']):>7}"
+            + "".join(f" {value:>9}" for value in requests)
+            + f" {format_exponent(exponents[name]['requests']):>6}"
+        )
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "latency": args.latency,
+        "vary": args.vary or [field.name for field in fields(StudySize)],
+        "runs": runs,
+        "exponents": exponents,
+    }
+    output = args.output or RESULTS_DIR / (
+        f"scaling-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
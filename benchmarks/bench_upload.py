@@ -0,0 +1,213 @@
+"""Upload the example studies against the fake OSB and record what they cost.
+
+Usage:
+    uv run python benchmarks/bench_upload.py [--latency 0.02] [--repeat 3]
+        [--baseline benchmarks/results/upload-20250101-120000.json]
+    uv run python benchmarks/bench_upload.py study.json --replay study.cassette.json
+
+Every file is uploaded in a fresh OSB session against a fresh ``FakeOsb``
+answering each request after ``--latency`` seconds, so files do not share
+lookups. For each file the script reports the median wall time over
+``--repeat`` runs, the number of requests in total and per step, the bytes
+sent and received, and the peak Python memory of one extra run traced with
+``tracemalloc``. The results are written as JSON to ``benchmarks/results/``
+(or ``--output``); ``--baseline`` prints the change against an earlier
+results file.
+
+With ``--replay`` the uploads are answered from a cassette recorded with
+``osb usdm-osb-uploader --record`` instead of the fake, with the recorded
+response times scaled by ``--replay-speed``.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+# The fake answers whatever base URL the settings point at
+os.environ.setdefault("OSB_BASE_URL", "http://fake-osb/api")
+os.environ.setdefault("OSB_CT_CACHE_ENABLED", "false")
+
+from usdm_osb_uploader.fake_osb import FakeOsb  # noqa: E402
+from usdm_osb_uploader.osb.cassette import Cassette, ReplayTransport  # noqa: E402
+from usdm_osb_uploader.osb.session import osb_session  # noqa: E402
+from usdm_osb_uploader.pipeline import upload_study  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+EXAMPLES = sorted((ROOT / "examples").glob("*.json"))
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+
+def make_transport(latency: float, cassette: Cassette | None, replay_speed: float):
+    if cassette is not None:
+        return ReplayTransport(cassette, replay_speed)
+    return FakeOsb(latency=latency)
+
+
+async def upload(path: Path, transport) -> dict:
+    """Upload ``path`` once in its own session and return its measurements."""
+    async with osb_session(ct_cache=False, transport=transport) as session:
+        start = time.perf_counter()
+        result = await upload_study(path)
+        wall_time = time.perf_counter() - start
+        total = session.metrics.report()["total"]
+        steps = {
+            step: {
+                "requests": summary["requests"],
+                "bytes": summary["bytes"],
+                "bytes_sent": summary["bytes_sent"],
+            }
+            for step, summary in session.metrics.by_step().items()
+        }
+    if not result.succeeded:
+        raise SystemExit(f"{path.name} failed: {result.error}")
+    return {
+        "wall_time": wall_time,
+        "requests": total["requests"],
+        "bytes": total["bytes"],
+        "bytes_sent": total["bytes_sent"],
+        "steps": steps,
+    }
+
+
+def measure(path: Path, repeat: int, make_transport) -> dict:
+    """Median wall time of ``repeat`` uploads and the peak memory of one more."""
+    runs = [asyncio.run(upload(path, make_transport())) for _ in range(repeat)]
+    tracemalloc.start()
+    try:
+        asyncio.run(upload(path, make_transport()))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    result = runs[-1]
+    result["wall_time"] = statistics.median(run["wall_time"] for run in runs)
+    result["wall_times"] = [run["wall_time"] for run in runs]
+    result["peak_memory"] = peak
+    return result
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def change(current: float, previous: float | None) -> str:
+    if not previous:
+        return ""
+    return f"{(current - previous) / previous * 100:+.0f}%"
+
+
+def print_results(results: dict, baseline: dict | None):
+    previous = (baseline or {}).get("files", {})
+    print(
+        f"{'file':<36} {'wall s':>8} {'':>5} {'requests':>9} {'':>5}"
+        f" {'KiB in':>8} {'KiB out':>8} {'peak MiB':>9}"
+    )
+    for name, result in results["files"].items():
+        before = previous.get(name, {})
+        print(
+            f"{name:<36} {result['wall_time']:>8.2f}"
+            f" {change(result['wall_time'], before.get('wall_time')):>5}"
+            f" {result['requests']:>9}"
+            f" {change(result['requests'], before.get('requests')):>5}"
+            f" {result['bytes'] / 1024:>8.1f} {result['bytes_sent'] / 1024:>8.1f}"
+            f" {result['peak_memory'] / 2**20:>9.1f}"
+        )
+    print()
+    print("Requests per step")
+    steps = list(
+        dict.fromkeys(
+            step for result in results["files"].values() for step in result["steps"]
+        )
+    )
+    print(f"{'file':<36}" + "".join(f" {step[:10]:>10}" for step in steps))
+    for name, result in results["files"].items():
+        print(
+            f"{name:<36}"
+            + "".join(
+                f" {result['steps'].get(step, {}).get('requests', 0):>10}"
+                for step in steps
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", type=Path, nargs="*", default=EXAMPLES)
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="Seconds per fake response"
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="Timed runs per file")
+    parser.add_argument("--output", type=Path, help="Results file to write")
+    parser.add_argument("--baseline", type=Path, help="Results file to compare with")
+    parser.add_argument("--replay", type=Path, help="Cassette to answer requests from")
+    parser.add_argument(
+        "--replay-speed", type=float, default=1.0, help="Scale of recorded timings"
+    )
+    args = parser.parse_args()
+    cassette = Cassette.load(args.replay) if args.replay else None
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "latency": args.latency,
+        "replay": str(args.replay) if args.replay else None,
+        "replay_speed": args.replay_speed if args.replay else None,
+        "repeat": args.repeat,
+        "files": {},
+    }
+    paths = [path.resolve() for path in args.paths]
+    # Uploads print their progress and download the study into the working
+    # directory, neither of which belongs in the benchmark output
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for path in paths:
+                print(f"Uploading {path.name}...", file=sys.stderr)
+                with (
+                    open(os.devnull, "w") as devnull,
+                    contextlib.redirect_stdout(devnull),
+                ):
+                    results["files"][path.name] = measure(
+                        path,
+                        args.repeat,
+                        lambda: make_transport(
+                            args.latency, cassette, args.replay_speed
+                        ),
+                    )
+        finally:
+            os.chdir(cwd)
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+    print_results(results, baseline)
+
+    output = args.output or RESULTS_DIR / (
+        f"upload-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
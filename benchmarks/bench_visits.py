@@ -0,0 +1,120 @@
+"""Compare sequential and pipelined study visit creation.
+
+Usage:
+    uv run python benchmarks/bench_visits.py [--encounters 64]
+        [--concurrency 0 2 4 8] [--latency 0.02] [--labels local]
+
+A synthetic study (see ``synthetic_usdm.py``) with ``--encounters``
+encounters is uploaded against the fake OSB up to its visits once for every
+``OSB_VISIT_PREVIEW_CONCURRENCY`` in ``--concurrency``; ``0`` previews each
+visit right before creating it. ``--labels`` sets ``OSB_VISIT_LABELS``, so
+``local`` measures the visits without preview requests. The script reports
+the time and requests of the visits step and its speedup over the first
+concurrency. Results are written as JSON to ``benchmarks/results/`` (or
+``--output``).
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import tempfile
+from dataclasses import asdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+# The fake answers whatever base URL the settings point at
+os.environ.setdefault("OSB_BASE_URL", "http://fake-osb/api")
+os.environ.setdefault("OSB_CT_CACHE_ENABLED", "false")
+
+from bench_scaling import timed_step  # noqa: E402
+from synthetic_usdm import StudySize, generate_usdm  # noqa: E402
+
+from usdm_osb_uploader.fake_osb import FakeOsb  # noqa: E402
+from usdm_osb_uploader.osb.session import osb_session  # noqa: E402
+from usdm_osb_uploader.pipeline import run_steps, upload_steps  # noqa: E402
+from usdm_osb_uploader.settings import settings  # noqa: E402
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+# The visits step and the steps it depends on
+STEPS = {"load", "study", "epochs", "visits"}
+
+
+async def upload_visits(usdm_data: dict, latency: float) -> dict:
+    """Time and requests of the visits step of uploading ``usdm_data``."""
+    durations: dict[str, float] = {}
+    steps = [
+        timed_step(step, durations)
+        for step in upload_steps(usdm_data)
+        if step.name in STEPS
+    ]
+    async with osb_session(ct_cache=False, transport=FakeOsb(latency=latency)) as (
+        session
+    ):
+        await run_steps(steps, max_concurrency=1)
+        summary = session.metrics.by_step().get("visits", {})
+    return {"time": durations["visits"], "requests": summary.get("requests", 0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--encounters", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[0, 2, 4, 8])
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="Seconds per fake response"
+    )
+    parser.add_argument(
+        "--labels", choices=["preview", "local", "verify"], default="preview"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Results file to write")
+    args = parser.parse_args()
+
+    size = StudySize(encounters=args.encounters, instances=args.encounters)
+    usdm_data = generate_usdm(size, seed=args.seed)
+    settings.osb_visit_labels = args.labels
+    runs = []
+    # Uploads print their progress, which does not belong in the output
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for concurrency in args.concurrency:
+                print(f"Preview concurrency {concurrency}...", file=sys.stderr)
+                settings.osb_visit_preview_concurrency = concurrency
+                with (
+                    open(os.devnull, "w") as devnull,
+                    contextlib.redirect_stdout(devnull),
+                ):
+                    result = asyncio.run(upload_visits(usdm_data, args.latency))
+                runs.append({"concurrency": concurrency} | result)
+        finally:
+            os.chdir(cwd)
+
+    print(f"{'concurrency':>11} {'visits s':>9} {'requests':>9} {'speedup':>8}")
+    for run in runs:
+        speedup = runs[0]["time"] / run["time"] if run["time"] else 0
+        print(
+            f"{run['concurrency']:>11} {run['time']:>9.2f} {run['requests']:>9}"
+            f" {speedup:>7.1f}x"
+        )
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "latency": args.latency,
+        "labels": args.labels,
+        "size": asdict(size),
+        "runs": runs,
+    }
+    output = args.output or RESULTS_DIR / (
+        f"visits-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Check that the request metrics record every retry the scheduler counted.
+
+Usage:
+    uv run python benchmarks/check_retry_metrics.py
+
+Retries happen below the terminology snapshot and the metrics, so their
+count has to be carried up through every transport of the session. The
+script counts them both ways in three situations and fails if the request
+metrics miss any:
+
+- the examples are uploaded through a fresh terminology snapshot while the
+  fake OSB fails 30% of the terminology requests,
+- a request is cancelled while it waits to be retried,
+- a request fails with a non-transient error after a retry.
+"""
+
+import asyncio
+import contextlib
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import httpx
+
+# The fake answers whatever base URL the settings point at
+os.environ.setdefault("OSB_BASE_URL", "http://fake-osb/api")
+
+from usdm_osb_uploader.fake_osb import FakeOsb  # noqa: E402
+from usdm_osb_uploader.osb.session import osb_client, osb_session  # noqa: E402
+from usdm_osb_uploader.pipeline import upload_studies  # noqa: E402
+from usdm_osb_uploader.settings import settings  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+EXAMPLES = sorted((ROOT / "examples").glob("*.json"))
+
+
+def retry_counts(session) -> tuple[int, int]:
+    """Retries in the request metrics and counted by the scheduler."""
+    recorded = sum(record.retries for record in session.metrics.records)
+    counted = sum(row["retries"] for row in session.scheduler.stats().values())
+    return recorded, counted
+
+
+async def upload_through_snapshot() -> tuple[int, int]:
+    fake = FakeOsb(error_rate={"ct-terms": 0.3, "ct-codelists": 0.3}, seed=1)
+    async with osb_session(ct_cache=True, transport=fake) as session:
+        await upload_studies(EXAMPLES)
+        return retry_counts(session)
+
+
+async def cancel_during_backoff() -> tuple[int, int]:
+    transport = httpx.MockTransport(lambda request: httpx.Response(503))
+    async with osb_session(ct_cache=False, transport=transport) as session:
+
+        async def get():
+            async with osb_client() as client:
+                await client.get(f"{settings.osb_base_url}/studies")
+
+        task = asyncio.create_task(get())
+        while not retry_counts(session)[1]:
+            await asyncio.sleep(0)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        return retry_counts(session)
+
+
+async def fail_after_retry() -> tuple[int, int]:
+    attempts = 0
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            return httpx.Response(503)
+        raise RuntimeError("not a transient failure")
+
+    transport = httpx.MockTransport(handler)
+    async with osb_session(ct_cache=False, transport=transport) as session:
+        async with osb_client() as client:
+            with contextlib.suppress(RuntimeError):
+                await client.get(f"{settings.osb_base_url}/studies")
+        return retry_counts(session)
+
+
+def main():
+    checks = {
+        "examples through the snapshot": upload_through_snapshot,
+        "cancelled during backoff": cancel_during_backoff,
+        "non-transient error after a retry": fail_after_retry,
+    }
+    settings.osb_retry_backoff = 0.01
+    failed = False
+    # Uploads print their progress and download the study into the working
+    # directory, neither of which belongs in the output
+    with tempfile.TemporaryDirectory() as workdir:
+        settings.osb_ct_cache_path = Path(workdir) / "ct.sqlite3"
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for name, check in checks.items():
+                with (
+                    open(os.devnull, "w") as devnull,
+                    contextlib.redirect_stdout(devnull),
+                ):
+                    recorded, counted = asyncio.run(check())
+                status = "" if recorded == counted else "MISSING"
+                failed = failed or recorded != counted or not counted
+                print(f"{name:<36} {recorded:>5} of {counted:>5} retries  {status}")
+        finally:
+            os.chdir(cwd)
+
+    if failed:
+        print(
+            "\nThe request metrics miss retries counted by the scheduler",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Check the OSB requests of every upload step against a recorded budget.
+
+Usage:
+    uv run python benchmarks/request_budgets.py [--update]
+
+Each file in ``examples/`` is uploaded against the fake OSB and the requests
+of every step are counted. The script fails if a step makes more requests
+than its budget in ``benchmarks/request_budgets.json``. After a change that
+intentionally alters the number of requests, ``--update`` records the
+current counts as the new budgets.
+
+Steps run one at a time, so a lookup shared by several steps is always
+counted for the same step and the counts are identical from run to run.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# The fake answers whatever base URL the settings point at
+os.environ.setdefault("OSB_BASE_URL", "http://fake-osb/api")
+os.environ.setdefault("OSB_CT_CACHE_ENABLED", "false")
+
+from usdm_osb_uploader.fake_osb import FakeOsb  # noqa: E402
+from usdm_osb_uploader.osb.session import osb_session  # noqa: E402
+from usdm_osb_uploader.pipeline import run_steps, upload_steps  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+EXAMPLES = sorted((ROOT / "examples").glob("*.json"))
+BUDGETS = ROOT / "benchmarks" / "request_budgets.json"
+
+
+async def count_step_requests(path: Path) -> dict[str, int]:
+    """Number of OSB requests per step of uploading ``path``."""
+    with open(path, "r", encoding="utf-8") as f:
+        usdm_data = json.load(f)
+    async with osb_session(ct_cache=False, transport=FakeOsb()) as session:
+        await run_steps(upload_steps(usdm_data), max_concurrency=1)
+        return {
+            step: summary["requests"]
+            for step, summary in session.metrics.by_step().items()
+        }
+
+
+def count_all(paths: list[Path]) -> dict[str, dict[str, int]]:
+    counts = {}
+    # Uploads print their progress and download the study into the working
+    # directory, neither of which belongs in the output
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for path in paths:
+                with (
+                    open(os.devnull, "w") as devnull,
+                    contextlib.redirect_stdout(devnull),
+                ):
+                    counts[path.name] = asyncio.run(count_step_requests(path))
+        finally:
+            os.chdir(cwd)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", type=Path, nargs="*", default=EXAMPLES)
+    parser.add_argument(
+        "--update", action="store_true", help="Record the current counts as budgets"
+    )
+    parser.add_argument("--budgets", type=Path, default=BUDGETS)
+    args = parser.parse_args()
+
+    counts = count_all([path.resolve() for path in args.paths])
+    budgets = json.loads(args.budgets.read_text()) if args.budgets.exists() else {}
+
+    if args.update:
+        budgets.update(counts)
+        args.budgets.write_text(json.dumps(budgets, indent=2, sort_keys=True) + "\n")
+        print(f"Budgets written to {args.budgets}")
+        return
+
+    over = []
+    print(f"{'file':<36} {'step':<22} {'requests':>9} {'budget':>7}")
+    for name, steps in counts.items():
+        file_budgets = budgets.get(name, {})
+        for step, requests in steps.items():
+            budget = file_budgets.get(step)
+            if budget is None:
+                status = "no budget"
+                over.append((name, step))
+            elif requests > budget:
+                status = "OVER"
+                over.append((name, step))
+            elif requests < budget:
+                status = "under, run with --update to tighten"
+            else:
+                status = ""
+            print(
+                f"{name:<36} {step:<22} {requests:>9}"
+                f" {'-' if budget is None else budget:>7}  {status}"
+            )
+
+    if over:
+        print(
+            f"\n{len(over)} step(s) over budget or without one; run with --update"
+            " if the change is intended",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,564 @@
+"""Generate synthetic USDM studies of a given size.
+
+Usage:
+    uv run python benchmarks/synthetic_usdm.py --encounters 200 --activities 500 \\
+        --output big_study.json
+
+The study follows the structure of the USDM 4 files in ``examples/``: one
+study design whose epochs, elements, arms, encounters, activities,
+biomedical concepts, schedule timeline and eligibility criteria reference
+each other by id, and whose codes are the ones the uploader looks up in OSB.
+The first epoch is screening, the last follow-up and the ones in between
+treatment; encounters are spread over the epochs in order, the first
+treatment encounter is the anchor and every encounter gets a unique day.
+Everything else is drawn from a seeded random generator, so the same
+arguments always give the same study.
+"""
+
+import argparse
+import json
+import random
+from dataclasses import asdict, dataclass
+from itertools import count
+from pathlib import Path
+
+ACTIVITY_WORDS = (
+    "blood pressure heart rate body weight height temperature respiratory "
+    "serum plasma urine creatinine glucose sodium potassium chloride calcium "
+    "albumin bilirubin alanine aspartate aminotransferase alkaline phosphatase "
+    "hemoglobin hematocrit platelet leukocyte neutrophil lymphocyte count "
+    "electrocardiogram echocardiogram physical examination vital signs "
+    "pregnancy test medical history concomitant medication adverse event "
+    "questionnaire score assessment sample collection biopsy urinalysis"
+).split()
+
+ARM_TYPES = (
+    ("C174268", "Placebo Control Arm"),
+    ("C174266", "Investigational Treatment Arm"),
+    ("C174267", "Active Comparator Arm"),
+)
+
+CONTACT_MODES = (("C175574", "In Person"), ("C171537", "Telephone Call"))
+
+
+@dataclass
+class StudySize:
+    """Number of each kind of USDM entity in a synthetic study."""
+
+    arms: int = 3
+    epochs: int = 4
+    elements: int = 4
+    encounters: int = 12
+    activities: int = 40
+    biomedical_concepts: int = 10
+    instances: int = 16
+    activities_per_instance: int = 10
+    criteria: int = 20
+    objectives: int = 3
+    endpoints_per_objective: int = 2
+
+    def scaled(self, factor: float, fields: list[str] | None = None) -> "StudySize":
+        """This size with ``fields`` (every count by default) times ``factor``."""
+        values = asdict(self)
+        for field in fields or values:
+            values[field] = max(1, round(values[field] * factor))
+        return StudySize(**values)
+
+
+class _Ids:
+    """Ids in the ``<Type>_<n>`` form of the example files."""
+
+    def __init__(self):
+        self._counters: dict[str, count] = {}
+
+    def __call__(self, kind: str) -> str:
+        counter = self._counters.setdefault(kind, count(1))
+        return f"{kind}_{next(counter)}"
+
+
+def generate_usdm(size: StudySize, seed: int = 0, name: str = "SYNTHETIC") -> dict:
+    """A USDM study with the number of entities given by ``size``."""
+    rng = random.Random(seed)
+    ids = _Ids()
+
+    def code(value: str, decode: str) -> dict:
+        return {
+            "id": ids("Code"),
+            "extensionAttributes": [],
+            "code": value,
+            "codeSystem": "http://www.cdisc.org",
+            "codeSystemVersion": "2024-09-27",
+            "decode": decode,
+            "instanceType": "Code",
+        }
+
+    def alias(value: str, decode: str) -> dict:
+        return {
+            "id": ids("AliasCode"),
+            "extensionAttributes": [],
+            "standardCode": code(value, decode),
+            "standardCodeAliases": [],
+            "instanceType": "AliasCode",
+        }
+
+    def rule(text: str) -> dict:
+        return {
+            "id": ids("TransitionRule"),
+            "extensionAttributes": [],
+            "name": text.upper().replace(" ", "_"),
+            "label": None,
+            "description": None,
+            "text": text,
+            "instanceType": "TransitionRule",
+        }
+
+    def quantity(value: float, unit: dict | None = None) -> dict:
+        return {
+            "id": ids("Quantity"),
+            "extensionAttributes": [],
+            "value": value,
+            "unit": unit,
+            "instanceType": "Quantity",
+        }
+
+    epochs = []
+    for i in range(size.epochs):
+        if i == 0:
+            epoch_code, epoch_name = ("C202487", "Screening")
+        elif i == size.epochs - 1 and size.epochs > 2:
+            epoch_code, epoch_name = ("C202578", "Follow-Up")
+        else:
+            epoch_code, epoch_name = ("C101526", f"Treatment {i}")
+        epochs.append({
+            "id": ids("StudyEpoch"),
+            "extensionAttributes": [],
+            "name": epoch_name,
+            "label": epoch_name,
+            "description": f"{epoch_name} Epoch",
+            "type": code(epoch_code, f"{epoch_name.split()[0]} Epoch"),
+            "previousId": None,
+            "nextId": None,
+            "notes": [],
+            "instanceType": "StudyEpoch",
+        })
+
+    elements = []
+    for i in range(size.elements):
+        label = epochs[i % len(epochs)]["name"].split()[0]
+        elements.append({
+            "id": ids("StudyElement"),
+            "extensionAttributes": [],
+            "name": f"EL{i + 1}",
+            "label": label,
+            "description": f"{label} Element",
+            "transitionStartRule": rule(f"Start of {label.lower()} element {i + 1}"),
+            "transitionEndRule": rule(f"End of {label.lower()} element {i + 1}"),
+            "studyInterventionIds": [],
+            "notes": [],
+            "instanceType": "StudyElement",
+        })
+
+    arms = []
+    for i in range(size.arms):
+        arm_code, arm_decode = ARM_TYPES[i % len(ARM_TYPES)]
+        arms.append({
+            "id": ids("StudyArm"),
+            "extensionAttributes": [],
+            "name": f"Arm {i + 1}",
+            "label": f"Arm {i + 1}",
+            "description": f"{arm_decode} {i + 1}",
+            "type": code(arm_code, arm_decode),
+            "dataOriginDescription": "Data collected from subjects",
+            "dataOriginType": code("C188866", "Data Generated Within Study"),
+            "populationIds": [],
+            "notes": [],
+            "instanceType": "StudyArm",
+        })
+
+    study_cells = [
+        {
+            "id": ids("StudyCell"),
+            "extensionAttributes": [],
+            "armId": arm["id"],
+            "epochId": epoch["id"],
+            "elementIds": [elements[i % len(elements)]["id"]],
+            "instanceType": "StudyCell",
+        }
+        for arm in arms
+        for i, epoch in enumerate(epochs)
+    ]
+
+    # A dict rather than a set, so the order does not depend on string hashing
+    activity_names: dict[str, None] = {}
+    while len(activity_names) < size.activities:
+        words = rng.sample(ACTIVITY_WORDS, rng.randint(1, 3))
+        activity_names[" ".join(words).capitalize()] = None
+    activities = [
+        {
+            "id": ids("Activity"),
+            "extensionAttributes": [],
+            "name": activity_name,
+            "label": activity_name,
+            "description": "",
+            "previousId": None,
+            "nextId": None,
+            "childIds": [],
+            "definedProcedures": [],
+            "biomedicalConceptIds": [],
+            "bcCategoryIds": [],
+            "bcSurrogateIds": [],
+            "timelineId": None,
+            "notes": [],
+            "instanceType": "Activity",
+        }
+        for activity_name in activity_names
+    ]
+    for previous, following in zip(activities, activities[1:]):
+        previous["nextId"] = following["id"]
+        following["previousId"] = previous["id"]
+
+    biomedical_concepts = []
+    for i in range(size.biomedical_concepts):
+        activity = activities[i % len(activities)]
+        concept_id = ids("BiomedicalConcept")
+        activity["biomedicalConceptIds"].append(concept_id)
+        biomedical_concepts.append({
+            "id": concept_id,
+            "extensionAttributes": [],
+            "name": f"{activity['name']} {i + 1}",
+            "label": f"{activity['name']} {i + 1}",
+            "synonyms": [activity["name"], activity["name"].lower()],
+            "reference": f"/mdr/bc/biomedicalconcepts/C{100000 + i}",
+            "properties": [],
+            "code": alias(f"C{100000 + i}", activity["name"]),
+            "notes": [],
+            "instanceType": "BiomedicalConcept",
+        })
+
+    # Encounters in epoch order, the first treatment encounter is the anchor
+    encounter_epochs = [
+        epochs[min(i * len(epochs) // size.encounters, len(epochs) - 1)]
+        for i in range(size.encounters)
+    ]
+    anchor = next(
+        (i for i, epoch in enumerate(encounter_epochs) if epoch is not epochs[0]),
+        0,
+    )
+    # Weekly visits from the anchor on, screening visits a day before a week
+    days = [(i - anchor) * 7 - (1 if i < anchor else 0) for i in range(size.encounters)]
+    encounters = []
+    for i, day in enumerate(days):
+        # Every fifth visit is a phone call
+        contact_code, contact_decode = CONTACT_MODES[1 if i % 5 == 4 else 0]
+        encounters.append({
+            "id": ids("Encounter"),
+            "extensionAttributes": [],
+            "name": f"E{i + 1}",
+            "label": f"Visit {i + 1}",
+            "description": f"Visit {i + 1} on day {day}",
+            "type": code("C25716", "Visit"),
+            "previousId": None,
+            "nextId": None,
+            "scheduledAtId": None,
+            "environmentalSettings": [code("C51282", "Clinic")],
+            "contactModes": [code(contact_code, contact_decode)],
+            "transitionStartRule": None,
+            "transitionEndRule": None,
+            "notes": [],
+            "instanceType": "Encounter",
+        })
+    for previous, following in zip(encounters, encounters[1:]):
+        previous["nextId"] = following["id"]
+        following["previousId"] = previous["id"]
+
+    # Instances beyond one per encounter are repeated assessments at a visit
+    instances = []
+    for i in range(max(size.instances, size.encounters)):
+        encounter_index = i % size.encounters
+        instances.append({
+            "id": ids("ScheduledActivityInstance"),
+            "extensionAttributes": [],
+            "name": f"SAI{i + 1}",
+            "label": f"Instance {i + 1}",
+            "description": "-",
+            "defaultConditionId": None,
+            "epochId": encounter_epochs[encounter_index]["id"],
+            "instanceType": "ScheduledActivityInstance",
+            "timelineId": None,
+            "timelineExitId": None,
+            "activityIds": [
+                activity["id"]
+                for activity in rng.sample(
+                    activities, min(size.activities_per_instance, len(activities))
+                )
+            ],
+            "encounterId": encounters[encounter_index]["id"],
+        })
+    for i, instance in enumerate(instances[:-1]):
+        instance["defaultConditionId"] = instances[i + 1]["id"]
+
+    timings = []
+    for i, day in enumerate(days):
+        # The uploader recognises the anchor by its description
+        if i == anchor:
+            timing_type, description = ("Fixed Reference", "Anchor timing")
+        elif i < anchor:
+            timing_type, description = ("Before", "Screening timing")
+        else:
+            timing_type, description = ("After", "Treatment timing")
+        timings.append({
+            "id": ids("Timing"),
+            "extensionAttributes": [],
+            "name": f"TIM{i + 1}",
+            "label": f"Visit {i + 1}",
+            "description": description,
+            "type": code("C201356", timing_type),
+            "value": f"P{abs(day)}D",
+            "valueLabel": f"{abs(day)} days" if i < anchor else f"Day {day}",
+            "relativeToFrom": code("C201355", "Start to Start"),
+            "relativeFromScheduledInstanceId": instances[i]["id"],
+            "relativeToScheduledInstanceId": instances[anchor]["id"],
+            "windowLower": None,
+            "windowUpper": None,
+            "windowLabel": "",
+            "instanceType": "Timing",
+        })
+
+    criterion_items = []
+    criteria = []
+    for i in range(size.criteria):
+        inclusion = i % 3 != 2
+        item_id = ids("EligibilityCriterionItem")
+        criterion_items.append({
+            "id": item_id,
+            "extensionAttributes": [],
+            "name": f"{'IN' if inclusion else 'EX'}{i + 1:02}",
+            "label": None,
+            "description": None,
+            "text": (
+                f"<p>{'Inclusion' if inclusion else 'Exclusion'} criterion {i + 1}:"
+                f" {' '.join(rng.sample(ACTIVITY_WORDS, 6))}.</p>"
+            ),
+            "dictionaryId": None,
+            "notes": [],
+            "instanceType": "EligibilityCriterionItem",
+        })
+        criteria.append({
+            "id": ids("EligibilityCriterion"),
+            "extensionAttributes": [],
+            "name": f"{'IN' if inclusion else 'EX'}{i + 1:02}",
+            "label": f"Criterion {i + 1}",
+            "description": "",
+            "category": code(
+                "C25532" if inclusion else "C25370",
+                "Inclusion Criteria" if inclusion else "Exclusion Criteria",
+            ),
+            "identifier": f"{i + 1:02}",
+            "criterionItemId": item_id,
+            "nextId": None,
+            "previousId": None,
+            "notes": [],
+            "instanceType": "EligibilityCriterion",
+        })
+
+    levels = (
+        ("C85826", "Primary Objective", "C94496", "Primary Endpoint"),
+        ("C85827", "Secondary Objective", "C139173", "Secondary Endpoint"),
+    )
+    objectives = []
+    for i in range(size.objectives):
+        objective_code, objective_level, endpoint_code, endpoint_level = levels[
+            0 if i == 0 else 1
+        ]
+        objectives.append({
+            "id": ids("Objective"),
+            "extensionAttributes": [],
+            "name": f"OBJ{i + 1}",
+            "label": "",
+            "description": "",
+            "text": f"Objective {i + 1}: {' '.join(rng.sample(ACTIVITY_WORDS, 5))}",
+            "dictionaryId": None,
+            "notes": [],
+            "instanceType": "Objective",
+            "level": code(objective_code, objective_level),
+            "endpoints": [
+                {
+                    "id": ids("Endpoint"),
+                    "extensionAttributes": [],
+                    "name": f"END{i + 1}.{j + 1}",
+                    "label": "",
+                    "description": "",
+                    "text": (
+                        f"Endpoint {i + 1}.{j + 1}:"
+                        f" {' '.join(rng.sample(ACTIVITY_WORDS, 5))}"
+                    ),
+                    "dictionaryId": None,
+                    "notes": [],
+                    "instanceType": "Endpoint",
+                    "purpose": "",
+                    "level": code(endpoint_code, endpoint_level),
+                }
+                for j in range(size.endpoints_per_objective)
+            ],
+        })
+
+    year = alias("C29848", "Year")
+    population = {
+        "id": ids("StudyDesignPopulation"),
+        "extensionAttributes": [],
+        "name": "POP1",
+        "label": "",
+        "description": "Synthetic study population",
+        "includesHealthySubjects": False,
+        "plannedEnrollmentNumber": quantity(100.0 * size.arms),
+        "plannedCompletionNumber": quantity(90.0 * size.arms),
+        "plannedSex": [code("C49636", "Both")],
+        "criterionIds": [criterion["id"] for criterion in criteria],
+        "plannedAge": {
+            "id": ids("Range"),
+            "extensionAttributes": [],
+            "minValue": quantity(18.0, year),
+            "maxValue": quantity(75.0, year),
+            "isApproximate": False,
+            "instanceType": "Range",
+        },
+        "notes": [],
+        "cohorts": [],
+        "instanceType": "StudyDesignPopulation",
+    }
+
+    design = {
+        "id": ids("InterventionalStudyDesign"),
+        "extensionAttributes": [],
+        "name": "Study Design 1",
+        "label": "",
+        "description": "Synthetic study design",
+        "studyType": code("C98388", "Interventional Study"),
+        "studyPhase": alias("C15602", "Phase III Trial"),
+        "therapeuticAreas": [code("38341003", "Hypertension")],
+        "characteristics": [],
+        "encounters": encounters,
+        "activities": activities,
+        "arms": arms,
+        "studyCells": study_cells,
+        "rationale": "Synthetic design for scaling tests",
+        "epochs": epochs,
+        "elements": elements,
+        "estimands": [],
+        "indications": [
+            {
+                "id": ids("Indication"),
+                "extensionAttributes": [],
+                "name": "IND1",
+                "label": "Hypertension",
+                "description": "Hypertension",
+                "codes": [code("38341003", "Hypertension")],
+                "isRareDisease": False,
+                "notes": [],
+                "instanceType": "Indication",
+            }
+        ],
+        "studyInterventionIds": [],
+        "objectives": objectives,
+        "population": population,
+        "scheduleTimelines": [
+            {
+                "id": ids("ScheduleTimeline"),
+                "extensionAttributes": [],
+                "name": "Main Timeline",
+                "label": "Main Timeline",
+                "description": "Main timeline",
+                "mainTimeline": True,
+                "entryCondition": "Informed consent",
+                "entryId": instances[0]["id"],
+                "exits": [],
+                "timings": timings,
+                "instances": instances,
+                "plannedDuration": None,
+                "instanceType": "ScheduleTimeline",
+            }
+        ],
+        "biospecimenRetentions": [],
+        "documentVersionIds": [],
+        "eligibilityCriteria": criteria,
+        "analysisPopulations": [],
+        "notes": [],
+        "instanceType": "InterventionalStudyDesign",
+        "subTypes": [code("C49666", "Efficacy Study")],
+        "model": code("C82639", "Parallel Study"),
+        "intentTypes": [code("C49656", "Treatment Study")],
+        "blindingSchema": None,
+    }
+
+    version = {
+        "id": ids("StudyVersion"),
+        "extensionAttributes": [],
+        "versionIdentifier": "1",
+        "rationale": "Synthetic study",
+        "documentVersionIds": [],
+        "dateValues": [],
+        "amendments": [],
+        "businessTherapeuticAreas": [],
+        "studyIdentifiers": [],
+        "referenceIdentifiers": [],
+        "studyDesigns": [design],
+        "titles": [
+            {
+                "id": ids("StudyTitle"),
+                "extensionAttributes": [],
+                "text": f"Synthetic study {name}",
+                "type": code("C99905x2", "Official Study Title"),
+                "instanceType": "StudyTitle",
+            }
+        ],
+        "eligibilityCriterionItems": criterion_items,
+        "narrativeContentItems": [],
+        "abbreviations": [],
+        "roles": [],
+        "organizations": [],
+        "studyInterventions": [],
+        "administrableProducts": [],
+        "medicalDevices": [],
+        "productOrganizationRoles": [],
+        "biomedicalConcepts": biomedical_concepts,
+        "bcCategories": [],
+        "bcSurrogates": [],
+        "dictionaries": [],
+        "conditions": [],
+        "notes": [],
+        "instanceType": "StudyVersion",
+    }
+
+    return {
+        "study": {
+            "id": ids("Study"),
+            "name": name,
+            "description": "Synthetic USDM study",
+            "label": name,
+            "versions": [version],
+            "documentedBy": [],
+            "instanceType": "Study",
+        },
+        "usdmVersion": "4.0.0",
+        "systemName": "usdm-osb-uploader synthetic generator",
+        "systemVersion": "1",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    for field, default in asdict(StudySize()).items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=int, default=default)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--name", default="SYNTHETIC")
+    parser.add_argument("--output", type=Path, required=True)
+    args = parser.parse_args()
+
+    size = StudySize(**{field: getattr(args, field) for field in asdict(StudySize())})
+    usdm = generate_usdm(size, seed=args.seed, name=args.name)
+    args.output.write_text(json.dumps(usdm, indent=2))
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,7 @@
+import glob
 import json
+import sys
+from pathlib import Path
 
 from cyclopts import App
 from pydantic import FilePath
@@ -10,23 +13,36 @@ from rich.progress import (
     TaskProgressColumn,
     TextColumn,
 )
+from rich.table import Table
 
 from .osb.activities import create_study_activity
 from .osb.arms import create_study_arm
+from .osb.cassette import cassette_transport
 from .osb.create_study import create_study_id
 from .osb.criteria import create_study_criteria
+from .osb.ct_cache import CtCacheStore, refresh_snapshot
 from .osb.download_usdm import download_usdm
 from .osb.elements import create_study_element
 from .osb.epochs import create_study_epochs
 from .osb.high_level_design import create_study_high_level_design
+from .osb.metrics import MetricsRecorder
 from .osb.objectivies_endpoints import create_study_objective_endpoint
 from .osb.population import create_study_population
+from .osb.scheduler import RequestScheduler
+from .osb.session import OsbSession, osb_client, osb_session
 from .osb.soa import create_schedule_of_activity
 from .osb.visits import create_study_visits
+from .pipeline import run_steps, upload_steps, upload_studies
+from .settings import settings
 
 cli = App()
 console = Console()
 
+ct_cache_cli = App(
+    name="ct-cache", help="Manage the local controlled terminology snapshot."
+)
+cli.command(ct_cache_cli)
+
 
 def load_study_design(usdm_file: FilePath):
     with open(usdm_file, "r", encoding="utf-8") as f:
@@ -34,157 +50,245 @@ def load_study_design(usdm_file: FilePath):
     return json_data
 
 
-@cli.command
-async def usdm_osb_uploader(usdm_file: FilePath):
-    """Upload a USDM file to the OSB system."""
-    usdm_data = load_study_design(usdm_file)
-
-    # Define all the steps with their descriptions
-    steps = [
-        ("Loading study data", lambda: None),
-        ("Creating study ID", lambda: create_study_id(usdm_data)),
-        (
-            "Creating high level design",
-            lambda: create_study_high_level_design(study_designs, study_uid),
-        ),
-        ("Creating study arms", lambda: create_study_arm(study_designs, study_uid)),
-        (
-            "Creating study epochs",
-            lambda: create_study_epochs(study_designs, study_uid),
-        ),
-        (
-            "Creating study elements",
-            lambda: create_study_element(study_designs, study_uid),
-        ),
-        (
-            "Creating study visits",
-            lambda: create_study_visits(study_designs, study_uid),
-        ),
-        (
-            "Creating study populations",
-            lambda: create_study_population(study_designs, study_uid),
-        ),
-        (
-            "Creating study criteria",
-            lambda: create_study_criteria(study_version, study_uid),
-        ),
-        (
-            "Creating objectives & endpoints",
-            lambda: create_study_objective_endpoint(study_designs, study_uid),
-        ),
-        (
-            "Creating study activities",
-            lambda: create_study_activity(study_version, study_uid, study_id),
-        ),
-        (
-            "Creating schedule of activities",
-            lambda: create_schedule_of_activity(study_designs, study_uid),
-        ),
-        ("Downloading USDM", lambda: download_usdm(study_uid)),
-    ]
-
-    with Progress(
-        SpinnerColumn(),
-        TextColumn("[progress.description]{task.description}"),
-        BarColumn(),
-        TaskProgressColumn(),
-        console=console,
-    ) as progress:
-        # Create overall progress task
-        overall_task = progress.add_task("Overall Progress", total=len(steps))
-
-        # Step 1: Load study data (already done)
-        current_task = progress.add_task(steps[0][0], total=1)
-        progress.update(current_task, advance=1)
-        progress.update(overall_task, advance=1)
-
-        # Step 2: Create study ID
-        current_task = progress.add_task(steps[1][0], total=1)
-        study_uid, study_id = await create_study_id(usdm_data)
-        progress.update(current_task, advance=1)
-        progress.update(overall_task, advance=1)
-
-        # Prepare data for subsequent steps
-        study_version = usdm_data.get("study", {}).get("versions", [])[0]
-        study_designs = (
-            usdm_data.get("study", {}).get("versions", [])[0].get("studyDesigns", [])
+def print_scheduler_stats(scheduler: RequestScheduler):
+    table = Table(title="OSB request scheduler")
+    table.add_column("Endpoint family")
+    table.add_column("Limit", justify="right")
+    table.add_column("Requests", justify="right")
+    table.add_column("Max in flight", justify="right")
+    table.add_column("Max queued", justify="right")
+    table.add_column("Mean wait (ms)", justify="right")
+    table.add_column("Max wait (ms)", justify="right")
+    table.add_column("Retries", justify="right")
+    for family, row in scheduler.stats().items():
+        table.add_row(
+            family,
+            str(scheduler.family_limits.get(family, scheduler.max_in_flight)),
+            str(row["requests"]),
+            str(row["max_in_flight"]),
+            str(row["max_queued"]),
+            f"{row['mean_wait'] * 1000:.1f}",
+            f"{row['max_wait'] * 1000:.1f}",
+            str(row["retries"]),
         )
+    console.print(table)
+
+
+def print_metrics(metrics: MetricsRecorder, endpoints: int = 15):
+    table = Table(title="OSB requests per step")
+    table.add_column("Step")
+    table.add_column("Requests", justify="right")
+    table.add_column("Cached", justify="right")
+    table.add_column("Errors", justify="right")
+    table.add_column("Retries", justify="right")
+    table.add_column("KiB", justify="right")
+    table.add_column("Total (s)", justify="right")
+    table.add_column("p50 (ms)", justify="right")
+    table.add_column("p95 (ms)", justify="right")
+    table.add_column("Max (ms)", justify="right")
+    rows = metrics.by_step()
+    rows["Total"] = metrics.report()["total"]
+    for step, row in rows.items():
+        table.add_row(
+            step,
+            str(row["requests"]),
+            str(row["cached"]),
+            str(row["errors"]),
+            str(row["retries"]),
+            f"{row['bytes'] / 1024:.1f}",
+            f"{row['total_latency']:.2f}",
+            f"{row['p50_latency'] * 1000:.0f}",
+            f"{row['p95_latency'] * 1000:.0f}",
+            f"{row['max_latency'] * 1000:.0f}",
+            end_section=len(table.rows) == len(rows) - 2,
+        )
+    console.print(table)
+
+    table = Table(title=f"Slowest OSB endpoints (top {endpoints} by total time)")
+    table.add_column("Method")
+    table.add_column("Endpoint")
+    table.add_column("Requests", justify="right")
+    table.add_column("Errors", justify="right")
+    table.add_column("Retries", justify="right")
+    table.add_column("Total (s)", justify="right")
+    table.add_column("p50 (ms)", justify="right")
+    table.add_column("p95 (ms)", justify="right")
+    for row in metrics.by_endpoint()[:endpoints]:
+        table.add_row(
+            row["method"],
+            row["template"],
+            str(row["requests"]),
+            str(row["errors"]),
+            str(row["retries"]),
+            f"{row['total_latency']:.2f}",
+            f"{row['p50_latency'] * 1000:.0f}",
+            f"{row['p95_latency'] * 1000:.0f}",
+        )
+    console.print(table)
 
-        # Step 3: High level design
-        current_task = progress.add_task(steps[2][0], total=1)
-        await create_study_high_level_design(study_designs, study_uid)
-        progress.update(current_task, advance=1)
-        progress.update(overall_task, advance=1)
-
-        # Step 4: Study arms
-        current_task = progress.add_task(steps[3][0], total=1)
-        await create_study_arm(study_designs, study_uid)
-        progress.update(current_task, advance=1)
-        progress.update(overall_task, advance=1)
-
-        # Step 5: Study epochs
-        current_task = progress.add_task(steps[4][0], total=1)
-        await create_study_epochs(study_designs, study_uid)
-        progress.update(current_task, advance=1)
-        progress.update(overall_task, advance=1)
-
-        # Step 6: Study elements
-        current_task = progress.add_task(steps[5][0], total=1)
-        await create_study_element(study_designs, study_uid)
-        progress.update(current_task, advance=1)
-        progress.update(overall_task, advance=1)
 
-        # Step 7: Study visits
-        current_task = progress.add_task(steps[6][0], total=1)
-        await create_study_visits(study_designs, study_uid)
-        progress.update(current_task, advance=1)
-        progress.update(overall_task, advance=1)
+def write_metrics(session: OsbSession, path: Path, extra: dict | None = None):
+    report = session.metrics.report()
+    report["scheduler"] = session.scheduler.stats()
+    report.update(extra or {})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    console.print(f"Metrics written to {path}")
 
-        # Step 8: Study populations
-        current_task = progress.add_task(steps[7][0], total=1)
-        await create_study_population(study_designs, study_uid)
-        progress.update(current_task, advance=1)
-        progress.update(overall_task, advance=1)
 
-        # Step 9: Study criteria
-        current_task = progress.add_task(steps[8][0], total=1)
-        await create_study_criteria(study_version, study_uid)
-        progress.update(current_task, advance=1)
-        progress.update(overall_task, advance=1)
+@cli.command
+async def usdm_osb_uploader(
+    usdm_file: FilePath,
+    ct_cache: bool = settings.osb_ct_cache_enabled,
+    scheduler_stats: bool = False,
+    metrics_out: Path | None = None,
+    record: Path | None = None,
+    replay: Path | None = None,
+    replay_speed: float = 1.0,
+):
+    """Upload a USDM file to the OSB system.
+
+    Args:
+        usdm_file: USDM JSON file to upload.
+        ct_cache: Serve controlled terminology from the local snapshot.
+        scheduler_stats: Print the queue depth and wait time per endpoint family.
+        metrics_out: Write the request metrics of the upload to this JSON file.
+        record: Record every OSB request and response to this cassette file.
+        replay: Answer OSB requests from this cassette file instead of OSB.
+        replay_speed: Factor applied to the recorded response times when
+            replaying; 0 replays without delays.
+    """
+    usdm_data = load_study_design(usdm_file)
 
-        # Step 10: Objectives & endpoints
-        current_task = progress.add_task(steps[9][0], total=1)
-        await create_study_objective_endpoint(study_designs, study_uid)
-        progress.update(current_task, advance=1)
-        progress.update(overall_task, advance=1)
+    # Cassettes hold the whole conversation, so the snapshot is not used
+    with cassette_transport(record, replay, replay_speed) as transport:
+        async with osb_session(
+            ct_cache=ct_cache and transport is None, transport=transport
+        ) as session:
+            with Progress(
+                SpinnerColumn(),
+                TextColumn("[progress.description]{task.description}"),
+                BarColumn(),
+                TaskProgressColumn(),
+                console=console,
+            ) as progress:
+                await run_steps(upload_steps(usdm_data), progress=progress)
+
+    print_metrics(session.metrics)
+    if scheduler_stats:
+        print_scheduler_stats(session.scheduler)
+    if metrics_out:
+        write_metrics(session, metrics_out)
+    console.print("✅ [bold green]USDM upload completed successfully![/bold green]")
 
-        # Step 11: Study activities
-        current_task = progress.add_task(steps[10][0], total=1)
-        await create_study_activity(study_version, study_uid, study_id)
-        progress.update(current_task, advance=1)
-        progress.update(overall_task, advance=1)
 
-        # Step 12: Schedule of activities
-        current_task = progress.add_task(steps[11][0], total=1)
-        await create_schedule_of_activity(study_designs, study_uid)
-        progress.update(current_task, advance=1)
-        progress.update(overall_task, advance=1)
+def find_usdm_files(source: str) -> list[Path]:
+    """Return the JSON files of a directory, or the files matching a glob."""
+    path = Path(source)
+    if path.is_dir():
+        return sorted(path.glob("*.json"))
+    return sorted(Path(match) for match in glob.glob(source) if Path(match).is_file())
 
-        # Step 13: Download USDM
-        current_task = progress.add_task(steps[12][0], total=1)
-        await download_usdm(study_uid)
-        progress.update(current_task, advance=1)
-        progress.update(overall_task, advance=1)
 
-    console.print("✅ [bold green]USDM upload completed successfully![/bold green]")
+@cli.command
+async def batch_upload(
+    source: str,
+    ct_cache: bool = settings.osb_ct_cache_enabled,
+    max_studies: int = settings.osb_max_parallel_studies,
+    scheduler_stats: bool = False,
+    metrics_out: Path | None = None,
+    record: Path | None = None,
+    replay: Path | None = None,
+    replay_speed: float = 1.0,
+):
+    """Upload every USDM file of a directory or glob pattern.
+
+    The studies share one OSB session, so connections and terminology and
+    activity lookups are reused. A failing study does not stop the others.
+
+    Args:
+        source: Directory of USDM JSON files, or a glob pattern such as
+            "studies/*_usdm.json".
+        ct_cache: Serve controlled terminology from the local snapshot.
+        max_studies: Number of studies uploaded at the same time.
+        scheduler_stats: Print the queue depth and wait time per endpoint family.
+        metrics_out: Write the request metrics of the batch to this JSON file.
+        record: Record every OSB request and response to this cassette file.
+        replay: Answer OSB requests from this cassette file instead of OSB.
+        replay_speed: Factor applied to the recorded response times when
+            replaying; 0 replays without delays.
+    """
+    paths = find_usdm_files(source)
+    if not paths:
+        console.print(f"[bold red]No USDM files found for {source}[/bold red]")
+        sys.exit(1)
+
+    with cassette_transport(record, replay, replay_speed) as transport:
+        async with osb_session(
+            ct_cache=ct_cache and transport is None, transport=transport
+        ) as session:
+            with Progress(
+                SpinnerColumn(),
+                TextColumn("[progress.description]{task.description}"),
+                BarColumn(),
+                TaskProgressColumn(),
+                console=console,
+            ) as progress:
+                uploads = await upload_studies(
+                    paths, progress=progress, max_concurrency=max_studies
+                )
+
+    table = Table(title="Batch upload")
+    table.add_column("File")
+    table.add_column("Study UID")
+    table.add_column("Study ID")
+    table.add_column("Status")
+    table.add_column("Duration (s)", justify="right")
+    table.add_column("Requests", justify="right")
+    for upload in uploads:
+        table.add_row(
+            upload.path.name,
+            upload.study_uid or "",
+            upload.study_id or "",
+            "[green]uploaded[/green]" if upload.succeeded else "[red]failed[/red]",
+            f"{upload.duration:.1f}",
+            str(upload.requests),
+        )
+    print_metrics(session.metrics)
+    console.print(table)
+    if scheduler_stats:
+        print_scheduler_stats(session.scheduler)
+    if metrics_out:
+        studies = [
+            {
+                "path": str(upload.path),
+                "study_uid": upload.study_uid,
+                "error": upload.error,
+                "duration": upload.duration,
+                "requests": upload.requests,
+            }
+            for upload in uploads
+        ]
+        write_metrics(session, metrics_out, {"studies": studies})
+
+    failed = [upload for upload in uploads if not upload.succeeded]
+    for upload in failed:
+        console.print(f"[red]{upload.path.name}: {upload.error}[/red]")
+    if failed:
+        console.print(
+            f"❌ [bold red]{len(failed)} of {len(uploads)} studies failed[/bold red]"
+        )
+        sys.exit(1)
+    console.print(f"✅ [bold green]{len(uploads)} studies uploaded![/bold green]")
 
 
 @cli.command
 async def create_study_uid(usdm_file: FilePath):
     """Create a study in the OSB system."""
     usdm_data = load_study_design(usdm_file)
-    study_uid, study_id = await create_study_id(usdm_data)
-    return study_uid, study_id
+    async with osb_session():
+        study_uid, study_id = await create_study_id(usdm_data)
+        return study_uid, study_id
 
 
 @cli.command
@@ -194,7 +298,8 @@ async def create_study_properties(usdm_file: FilePath, study_uid: str):
     study_designs = (
         usdm_data.get("study", {}).get("versions", [])[0].get("studyDesigns", [])
     )
-    return await create_study_high_level_design(study_designs, study_uid)
+    async with osb_session():
+        return await create_study_high_level_design(study_designs, study_uid)
 
 
 @cli.command
@@ -204,7 +309,8 @@ async def create_study_arms(usdm_file: FilePath, study_uid: str):
     study_designs = (
         usdm_data.get("study", {}).get("versions", [])[0].get("studyDesigns", [])
     )
-    await create_study_arm(study_designs, study_uid)
+    async with osb_session():
+        await create_study_arm(study_designs, study_uid)
 
 
 @cli.command
@@ -214,7 +320,8 @@ async def create_study_populations(usdm_file: FilePath, study_uid: str):
     study_designs = (
         usdm_data.get("study", {}).get("versions", [])[0].get("studyDesigns", [])
     )
-    await create_study_population(study_designs, study_uid)
+    async with osb_session():
+        await create_study_population(study_designs, study_uid)
 
 
 @cli.command
@@ -224,7 +331,8 @@ async def create_study_objectives_endpoints(usdm_file: FilePath, study_uid: str)
     study_designs = (
         usdm_data.get("study", {}).get("versions", [])[0].get("studyDesigns", [])
     )
-    await create_study_objective_endpoint(study_designs, study_uid)
+    async with osb_session():
+        await create_study_objective_endpoint(study_designs, study_uid)
 
 
 @cli.command
@@ -234,7 +342,8 @@ async def create_study_elements(usdm_file: FilePath, study_uid: str):
     study_designs = (
         usdm_data.get("study", {}).get("versions", [])[0].get("studyDesigns", [])
     )
-    await create_study_element(study_designs, study_uid)
+    async with osb_session():
+        await create_study_element(study_designs, study_uid)
 
 
 @cli.command
@@ -242,7 +351,8 @@ async def create_study_criteria_cmd(usdm_file: FilePath, study_uid: str):
     """Create study criteria in the OSB system."""
     usdm_data = load_study_design(usdm_file)
     study_version = usdm_data.get("study", {}).get("versions", [])[0]
-    await create_study_criteria(study_version, study_uid)
+    async with osb_session():
+        await create_study_criteria(study_version, study_uid)
 
 
 @cli.command
@@ -250,7 +360,8 @@ async def create_study_activities(usdm_file: FilePath, study_uid: str, study_id:
     """Create study activities in the OSB system."""
     usdm_data = load_study_design(usdm_file)
     study_version = usdm_data.get("study", {}).get("versions", [])[0]
-    await create_study_activity(study_version, study_uid, study_id)
+    async with osb_session():
+        await create_study_activity(study_version, study_uid, study_id)
 
 
 @cli.command
@@ -260,7 +371,8 @@ async def create_study_epochs_cmd(usdm_file: FilePath, study_uid: str):
     study_designs = (
         usdm_data.get("study", {}).get("versions", [])[0].get("studyDesigns", [])
     )
-    await create_study_epochs(study_designs, study_uid)
+    async with osb_session():
+        await create_study_epochs(study_designs, study_uid)
 
 
 @cli.command
@@ -270,7 +382,8 @@ async def create_study_visits_cmd(usdm_file: FilePath, study_uid: str):
     study_designs = (
         usdm_data.get("study", {}).get("versions", [])[0].get("studyDesigns", [])
     )
-    await create_study_visits(study_designs, study_uid)
+    async with osb_session():
+        await create_study_visits(study_designs, study_uid)
 
 
 @cli.command
@@ -280,10 +393,69 @@ async def create_soa(usdm_file: FilePath, study_uid: str):
     study_designs = (
         usdm_data.get("study", {}).get("versions", [])[0].get("studyDesigns", [])
     )
-    await create_schedule_of_activity(study_designs, study_uid)
+    async with osb_session():
+        await create_schedule_of_activity(study_designs, study_uid)
 
 
 @cli.command
 async def download_usdm_cmd(study_uid: str):
     """Download the USDM file from the OSB system."""
-    return await download_usdm(study_uid)
+    async with osb_session():
+        return await download_usdm(study_uid)
+
+
+@ct_cache_cli.command
+async def refresh():
+    """Re-download all cached terminology of the configured OSB instance."""
+    store = CtCacheStore(settings.osb_ct_cache_path)
+    try:
+        async with osb_session(ct_cache=False), osb_client() as client:
+            refreshed, failed = await refresh_snapshot(store, client)
+    finally:
+        store.close()
+    console.print(f"Refreshed {refreshed} terminology entries ({failed} failed).")
+
+
+@ct_cache_cli.command
+def clear(all_instances: bool = False):
+    """Delete the cached terminology of the configured OSB instance.
+
+    Args:
+        all_instances: Delete the cached terminology of every OSB instance.
+    """
+    store = CtCacheStore(settings.osb_ct_cache_path)
+    try:
+        deleted = store.clear(
+            None if all_instances else settings.osb_base_url.rstrip("/")
+        )
+    finally:
+        store.close()
+    console.print(f"Deleted {deleted} terminology entries.")
+
+
+@ct_cache_cli.command
+def stats():
+    """Show the size and age of the cached terminology."""
+    store = CtCacheStore(settings.osb_ct_cache_path)
+    try:
+        rows = store.stats(settings.osb_ct_cache_ttl)
+    finally:
+        store.close()
+
+    table = Table(title=f"Terminology snapshot: {settings.osb_ct_cache_path}")
+    table.add_column("OSB base URL")
+    table.add_column("Entries", justify="right")
+    table.add_column("Expired", justify="right")
+    table.add_column("Size (KiB)", justify="right")
+    table.add_column("Oldest (h)", justify="right")
+    table.add_column("Newest (h)", justify="right")
+    for row in rows:
+        table.add_row(
+            row["base_url"],
+            str(row["entries"]),
+            str(row["expired"]),
+            f"{row['bytes'] / 1024:.1f}",
+            f"{row['oldest_age'] / 3600:.1f}",
+            f"{row['newest_age'] / 3600:.1f}",
+        )
+    console.print(table)
@@ -0,0 +1,1023 @@
+"""In-process stand-in for the OSB API endpoints used by the uploader.
+
+``FakeOsb`` is an httpx transport, so uploads run against it without a
+network or an OSB instance:
+
+    async with osb_session(transport=FakeOsb(latency=0.02), ct_cache=False):
+        await upload_studies([Path("examples/CDISC_Pilot_Study.json")])
+
+It is seeded with the terminology, units, dictionary terms and activity
+library the example studies need, keeps the studies it creates in memory,
+and can add latency and failures per route. Route names (``ct-terms``,
+``study-visits``, ``approvals``, ...) are the keys of ``requests`` and of
+the ``latency`` and ``error_rate`` dicts; ``"*"`` applies to every route.
+
+Run ``python -m usdm_osb_uploader.fake_osb examples/*.json`` to upload
+files against it. ``--record`` saves the conversation to a cassette, and
+``--replay`` uploads the same files from that cassette without delays and
+fails unless every recorded request is replayed exactly once.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import sys
+from collections import Counter
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+
+from .osb.cassette import Cassette, RecordingTransport, ReplayTransport
+from .osb.session import osb_session
+from .pipeline import StudyUpload, upload_studies
+from .settings import settings
+
+
+def _term(term_uid, codelist_uid, name, concept_id=None, submission_value=None):
+    return {
+        "term_uid": term_uid,
+        "catalogue_name": "SDTM CT",
+        "codelist_uid": codelist_uid,
+        "library_name": "Sponsor",
+        "name": {"sponsor_preferred_name": name, "status": "Final"},
+        "attributes": {
+            "concept_id": concept_id,
+            "name_submission_value": submission_value or name.upper(),
+            "definition": f"Definition of {name}",
+            "status": "Final",
+        },
+    }
+
+
+# codelist_uid -> (submission_value, codelist name, [(concept_id, name), ...])
+SEED_CODELISTS = {
+    "C99077": (
+        "STYPE",
+        "Study Type",
+        [("C98388", "Interventional Study"), ("C16084", "Observational Study")],
+    ),
+    "C66737": (
+        "TPHASE",
+        "Trial Phase",
+        [
+            ("C15600", "Phase I Trial"),
+            ("C15601", "Phase II Trial"),
+            ("C15602", "Phase III Trial"),
+        ],
+    ),
+    "C66739": (
+        "TTYPE",
+        "Trial Type",
+        [
+            ("C49663", "Pharmacokinetic Study"),
+            ("C49666", "Efficacy Study"),
+            ("C49667", "Safety Study"),
+        ],
+    ),
+    "C99079": (
+        "EPOCH",
+        "Epoch",
+        [
+            ("C48262", "Screening"),
+            ("C202487", "Screening"),
+            ("C101526", "Treatment"),
+            ("C98779", "Run-in"),
+            ("C99158", "Follow-Up"),
+            ("C202578", "Follow-Up"),
+        ],
+    ),
+    "C66797": (
+        "IECAT",
+        "Category of Inclusion/Exclusion",
+        [("C25532", "Inclusion Criteria"), ("C25370", "Exclusion Criteria")],
+    ),
+    "C66732": (
+        "SEX",
+        "Sex",
+        [("C49636", "Both"), ("C20197", "Male"), ("C16576", "Female")],
+    ),
+    "CTCodelist_ARMTTP": (
+        "ARMTTP",
+        "Arm Type",
+        [
+            ("C174268", "Placebo Comparator Arm"),
+            ("C174266", "Investigational Arm"),
+            ("C174267", "Active Comparator Arm"),
+            ("C174269", "Observational Arm"),
+        ],
+    ),
+    "CTCodelist_ELEMTP": (
+        "ELEMTP",
+        "Element Type",
+        [("C0001", "Treatment"), ("C0002", "No Treatment")],
+    ),
+    "CTCodelist_ELEMSTP": (
+        "ELEMSTP",
+        "Element Sub Type",
+        [
+            ("C0011", "Screening"),
+            ("C0012", "Run-in"),
+            ("C0013", "Treatment"),
+            ("C0014", "Follow-up"),
+            ("C0015", "Wash-out"),
+        ],
+    ),
+    "CTCodelist_OBJTLEVL": (
+        "OBJTLEVL",
+        "Objective Level",
+        [
+            ("C85826", "Primary Objective"),
+            ("C85827", "Secondary Objective"),
+            ("C163559", "Exploratory Objective"),
+            ("C0021", "Trial Primary Objective"),
+            ("C0022", "Trial Secondary Objective"),
+            ("C0023", "Trial Exploratory Objective"),
+        ],
+    ),
+    "CTCodelist_ENDPLEVL": (
+        "ENDPLEVL",
+        "Endpoint Level",
+        [
+            ("C94496", "Primary Endpoint"),
+            ("C139173", "Secondary Endpoint"),
+            ("C170559", "Exploratory Endpoint"),
+        ],
+    ),
+    "CTCodelist_VISITTYPE": (
+        "VISITTYPE",
+        "VisitType",
+        [
+            (None, "Screening"),
+            (None, "Treatment"),
+            (None, "Run-in"),
+            (None, "Follow-Up"),
+        ],
+    ),
+    "CTCodelist_CONTACT": (
+        "VISCNTMD",
+        "Visit Contact Mode",
+        [(None, "On Site Visit"), (None, "Phone Contact"), (None, "Virtual Visit")],
+    ),
+    "CTCodelist_TPREF": (
+        "TPREF",
+        "Time Point Reference",
+        [(None, "GLOBAL ANCHOR VISIT REFERENCE"), (None, "PREVIOUS VISIT REFERENCE")],
+    ),
+    "CTCodelist_EPALLOC": (
+        "EPALLOC",
+        "Epoch Allocation",
+        [(None, "PREVIOUS VISIT"), (None, "CURRENT VISIT")],
+    ),
+}
+
+SEED_UNITS = [
+    {
+        "uid": "UnitDefinition_000361",
+        "name": "hour",
+        "conversion_factor_to_master": 3600,
+    },
+    {
+        "uid": "UnitDefinition_000364",
+        "name": "day",
+        "conversion_factor_to_master": 86400,
+    },
+    {
+        "uid": "UnitDefinition_000367",
+        "name": "week",
+        "conversion_factor_to_master": 604800,
+    },
+    {
+        "uid": "UnitDefinition_000368",
+        "name": "years",
+        "conversion_factor_to_master": 31536000,
+    },
+]
+
+SEED_DICTIONARY = [
+    ("26929004", "Alzheimer's disease"),
+    ("88518009", "Wilson's disease"),
+    ("38341003", "Hypertension"),
+    ("73211009", "Diabetes mellitus"),
+]
+
+SEED_ACTIVITY_NAMES = [
+    "Informed consent",
+    "Inclusion/exclusion criteria",
+    "Patient number assigned",
+    "Demographics",
+    "Medical history",
+    "Physical examination",
+    "Height",
+    "Weight",
+    "Vital signs",
+    "Systolic blood pressure",
+    "Diastolic blood pressure",
+    "Heart rate",
+    "Temperature",
+    "Respiratory rate",
+    "ECG",
+    "Hematology",
+    "Chemistry",
+    "Urinalysis",
+    "Adverse events",
+    "Concomitant medications",
+    "Pregnancy test",
+    "Alanine aminotransferase",
+    "Aspartate aminotransferase",
+    "Albumin",
+    "Creatinine",
+    "Glucose",
+    "Hemoglobin",
+    "Sodium",
+    "Potassium",
+]
+
+
+class FakeOsb(httpx.AsyncBaseTransport):
+    """Fake OSB API answering the requests of an ``httpx.AsyncClient``.
+
+    Args:
+        library_size: Number of activities in the seeded activity library.
+        latency: Seconds added to every response, or per route name.
+        error_rate: Probability of answering with ``error_status`` instead,
+            or per route name.
+        error_status: Status of injected failures.
+        seed: Seed of the failure injection.
+        base_url: OSB base URL the requests are made to; defaults to
+            ``settings.osb_base_url``.
+    """
+
+    def __init__(
+        self,
+        library_size: int = 1200,
+        latency: float | dict[str, float] = 0.0,
+        error_rate: float | dict[str, float] = 0.0,
+        error_status: int = 503,
+        seed: int = 0,
+        base_url: str | None = None,
+    ):
+        self.base_path = urlsplit(base_url or settings.osb_base_url).path.rstrip("/")
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._counters: Counter = Counter()
+        self.requests: Counter = Counter()
+        self.codelists: dict[str, dict] = {}
+        self.terms: dict[str, list[dict]] = {}
+        for codelist_uid, (submission_value, name, terms) in SEED_CODELISTS.items():
+            self.codelists[codelist_uid] = {
+                "codelist_uid": codelist_uid,
+                "library_name": "Sponsor",
+                "catalogue_name": "SDTM CT",
+                "attributes": {"submission_value": submission_value, "name": name},
+                "name": {"name": name},
+            }
+            self.terms[codelist_uid] = [
+                _term(self._uid("CTTerm"), codelist_uid, term_name, concept_id)
+                for concept_id, term_name in terms
+            ]
+        self.dictionary_terms = [
+            {
+                "term_uid": self._uid("DictionaryTerm"),
+                "dictionary_id": code,
+                "name": name,
+            }
+            for code, name in SEED_DICTIONARY
+        ]
+        self.groups: dict[str, dict] = {}
+        self.subgroups: dict[str, dict] = {}
+        self.activities: dict[str, dict] = {}
+        group = self._create_group("General")
+        subgroup = self._create_subgroup("General", group["uid"])
+        for i in range(library_size):
+            name = (
+                SEED_ACTIVITY_NAMES[i]
+                if i < len(SEED_ACTIVITY_NAMES)
+                else f"Library activity {i:05d}"
+            )
+            self._create_activity(
+                name, group["uid"], subgroup["uid"], "Sponsor", "Final"
+            )
+        self.studies: dict[str, dict] = {
+            "Study_000001": self._new_study("Study_000001", "999-1000", "Seed")
+        }
+        self.templates: dict[str, dict] = {}
+        self._routes = self._build_routes()
+
+    def _uid(self, prefix: str) -> str:
+        self._counters[prefix] += 1
+        return f"{prefix}_{self._counters[prefix]:06d}"
+
+    def _new_study(self, uid, study_id, acronym):
+        return {
+            "uid": uid,
+            "id": study_id,
+            "acronym": acronym,
+            "metadata": {},
+            "arms": [],
+            "epochs": [],
+            "elements": [],
+            "visits": [],
+            "criteria": [],
+            "objectives": [],
+            "endpoints": [],
+            "activities": [],
+            "schedules": {},
+        }
+
+    def _create_group(self, name):
+        group = {"uid": self._uid("ActivityGroup"), "name": name, "status": "Final"}
+        self.groups[group["uid"]] = group
+        return group
+
+    def _create_subgroup(self, name, group_uid):
+        subgroup = {
+            "uid": self._uid("ActivitySubGroup"),
+            "name": name,
+            "status": "Final",
+            "activity_groups": [group_uid],
+        }
+        self.subgroups[subgroup["uid"]] = subgroup
+        return subgroup
+
+    def _create_activity(self, name, group_uid, subgroup_uid, library_name, status):
+        activity = {
+            "uid": self._uid("Activity"),
+            "name": name,
+            "name_sentence_case": name.lower(),
+            "library_name": library_name,
+            "status": status,
+            "version": "1.0" if status == "Final" else "0.1",
+            "synonyms": [],
+            "activity_groupings": [
+                {
+                    "activity_group_uid": group_uid,
+                    "activity_group_name": self.groups.get(group_uid, {}).get("name"),
+                    "activity_subgroup_uid": subgroup_uid,
+                    "activity_subgroup_name": self.subgroups.get(subgroup_uid, {}).get(
+                        "name"
+                    ),
+                }
+            ],
+        }
+        self.activities[activity["uid"]] = activity
+        return activity
+
+    def _setting(self, value, route_name):
+        if isinstance(value, dict):
+            return value.get(route_name, value.get("*", 0.0))
+        return value
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        method = request.method
+        path = request.url.path
+        if path.startswith(self.base_path):
+            path = path[len(self.base_path) :]
+        for route_method, pattern, name, handler in self._routes:
+            if route_method != method:
+                continue
+            match = pattern.fullmatch(path)
+            if match is None:
+                continue
+            self.requests[name] += 1
+            latency = self._setting(self.latency, name)
+            if latency:
+                await asyncio.sleep(latency)
+            if self._random.random() < self._setting(self.error_rate, name):
+                return httpx.Response(
+                    self.error_status, json={"message": "Injected failure"}
+                )
+            query = {k: v[-1] for k, v in parse_qs(request.url.query.decode()).items()}
+            body = json.loads(request.content) if request.content else None
+            try:
+                status, payload = handler(query=query, body=body, **match.groupdict())
+            except KeyError as e:
+                status, payload = 404, {"message": f"Not found: {e}"}
+            return httpx.Response(status, json=payload)
+        self.requests["unknown"] += 1
+        return httpx.Response(404, json={"message": f"No route for {method} {path}"})
+
+    def _build_routes(self):
+        study = r"/studies/(?P<study_uid>[^/]+)"
+        routes = [
+            ("GET", r"/studies/list", "studies-list", self.list_studies),
+            ("POST", r"/studies", "studies", self.create_study),
+            ("PATCH", study, "studies", self.patch_study),
+            ("GET", r"/ct/codelists", "ct-codelists", self.get_codelists),
+            ("GET", r"/ct/terms", "ct-terms", self.get_terms),
+            ("GET", r"/ct/terms/names", "ct-terms", self.get_term_names),
+            ("GET", r"/dictionaries/terms", "dictionaries", self.get_dictionary_terms),
+            ("GET", r"/concepts/unit-definitions", "unit-definitions", self.get_units),
+            ("GET", r"/epochs/allowed-configs", "epochs", self.allowed_configs),
+            ("POST", study + r"/study-arms", "study-arms", self.create_arm),
+            ("POST", study + r"/study-epochs", "study-epochs", self.create_epoch),
+            ("GET", study + r"/study-epochs", "study-epochs", self.get_epochs),
+            ("POST", study + r"/study-elements", "study-elements", self.create_element),
+            (
+                "POST",
+                study + r"/study-visits/preview",
+                "study-visits-preview",
+                self.preview_visit,
+            ),
+            ("POST", study + r"/study-visits", "study-visits", self.create_visit),
+            ("GET", study + r"/study-visits", "study-visits", self.get_visits),
+            (
+                "POST",
+                r"/(?P<kind>criteria|objective|endpoint)-templates",
+                "templates",
+                self.create_template,
+            ),
+            (
+                "GET",
+                r"/(?P<kind>criteria|objective|endpoint)-templates/(?P<uid>[^/]+)",
+                "templates",
+                self.get_template,
+            ),
+            (
+                "POST",
+                r"/(?P<kind>criteria|objective|endpoint)-templates/(?P<uid>[^/]+)/approvals",
+                "approvals",
+                self.approve_template,
+            ),
+            (
+                "POST",
+                study + r"/study-criteria",
+                "study-criteria",
+                self.create_study_criteria,
+            ),
+            (
+                "POST",
+                study + r"/study-objectives",
+                "study-objectives",
+                self.create_study_objective,
+            ),
+            (
+                "GET",
+                study + r"/study-objectives",
+                "study-objectives",
+                self.get_study_objectives,
+            ),
+            (
+                "POST",
+                study + r"/study-endpoints",
+                "study-endpoints",
+                self.create_study_endpoint,
+            ),
+            (
+                "GET",
+                r"/concepts/activities/activities",
+                "activities",
+                self.get_activities,
+            ),
+            (
+                "POST",
+                r"/concepts/activities/activities",
+                "activities",
+                self.post_activity,
+            ),
+            (
+                "POST",
+                r"/concepts/activities/activities/(?P<uid>[^/]+)/approvals",
+                "approvals",
+                self.approve_activity,
+            ),
+            (
+                "GET",
+                r"/concepts/activities/activity-groups",
+                "activity-groups",
+                self.get_groups,
+            ),
+            (
+                "POST",
+                r"/concepts/activities/activity-groups",
+                "activity-groups",
+                self.post_group,
+            ),
+            (
+                "POST",
+                r"/concepts/activities/activity-groups/(?P<uid>[^/]+)/approvals",
+                "approvals",
+                self.approve_noop,
+            ),
+            (
+                "GET",
+                r"/concepts/activities/activity-sub-groups",
+                "activity-groups",
+                self.get_subgroups,
+            ),
+            (
+                "POST",
+                r"/concepts/activities/activity-sub-groups",
+                "activity-groups",
+                self.post_subgroup,
+            ),
+            (
+                "POST",
+                r"/concepts/activities/activity-sub-groups/(?P<uid>[^/]+)/approvals",
+                "approvals",
+                self.approve_noop,
+            ),
+            (
+                "POST",
+                study + r"/study-activities",
+                "study-activities",
+                self.create_study_activity,
+            ),
+            (
+                "POST",
+                study + r"/study-activities/batch",
+                "study-activities",
+                self.batch_study_activities,
+            ),
+            (
+                "GET",
+                study + r"/study-activities",
+                "study-activities",
+                self.get_study_activities,
+            ),
+            (
+                "POST",
+                study + r"/study-activity-schedules",
+                "study-activity-schedules",
+                self.create_schedule,
+            ),
+            (
+                "POST",
+                study + r"/study-activity-schedules/batch",
+                "study-activity-schedules",
+                self.batch_schedules,
+            ),
+            (
+                "GET",
+                study + r"/study-activity-schedules",
+                "study-activity-schedules",
+                self.get_schedules,
+            ),
+            (
+                "GET",
+                r"/usdm/v3/studyDefinitions/(?P<study_uid>[^/]+)",
+                "usdm",
+                self.get_usdm,
+            ),
+        ]
+        return [
+            (method, re.compile(pattern), name, handler)
+            for method, pattern, name, handler in routes
+        ]
+
+    @staticmethod
+    def _page(items, query):
+        page_size = int(query.get("page_size", 10))
+        page_number = int(query.get("page_number", 1))
+        total = len(items)
+        if page_size:
+            start = (page_number - 1) * page_size
+            items = items[start : start + page_size]
+        return {
+            "items": items,
+            "total": total,
+            "page": page_number,
+            "size": page_size,
+        }
+
+    def _study(self, study_uid):
+        return self.studies[study_uid]
+
+    def list_studies(self, query, body):
+        return 200, [
+            {"uid": s["uid"], "id": s["id"], "acronym": s["acronym"]}
+            for s in self.studies.values()
+        ]
+
+    def create_study(self, query, body):
+        uid = f"Study_{len(self.studies) + 1:06d}"
+        study = self._new_study(
+            uid,
+            f"{body['project_number']}-{body['study_number']}",
+            body["study_acronym"],
+        )
+        self.studies[uid] = study
+        return 201, {"uid": uid, "current_metadata": {}}
+
+    def patch_study(self, query, body, study_uid):
+        study = self._study(study_uid)
+        study["metadata"].update((body or {}).get("current_metadata", {}))
+        return 200, {"uid": study_uid, "current_metadata": study["metadata"]}
+
+    def get_codelists(self, query, body):
+        filters = json.loads(query.get("filters", "{}"))
+        items = list(self.codelists.values())
+        if "attributes.submission_value" in filters:
+            values = filters["attributes.submission_value"]["v"]
+            items = [c for c in items if c["attributes"]["submission_value"] in values]
+        if "*" in filters:
+            needles = [v.lower() for v in filters["*"]["v"]]
+            items = [
+                c
+                for c in items
+                if any(n in c["attributes"]["name"].lower() for n in needles)
+            ]
+        return 200, self._page(items, query)
+
+    def _codelist_by_name(self, name):
+        for codelist_uid, codelist in self.codelists.items():
+            if codelist["attributes"]["name"].lower() == name.lower():
+                return codelist_uid
+        return None
+
+    def get_terms(self, query, body):
+        codelist_uid = query.get("codelist_uid")
+        if codelist_uid is None and "codelist_name" in query:
+            codelist_uid = self._codelist_by_name(query["codelist_name"])
+        items = list(self.terms.get(codelist_uid, []))
+        filters = json.loads(query.get("filters", "{}"))
+        if "attributes.name_submission_value" in filters:
+            values = filters["attributes.name_submission_value"]["v"]
+            items = [
+                t for t in items if t["attributes"]["name_submission_value"] in values
+            ]
+        return 200, self._page(items, query)
+
+    def get_term_names(self, query, body):
+        codelist_uid = self._codelist_by_name(query.get("codelist_name", ""))
+        items = [
+            {
+                "term_uid": t["term_uid"],
+                "sponsor_preferred_name": t["name"]["sponsor_preferred_name"],
+            }
+            for t in self.terms.get(codelist_uid, [])
+        ]
+        return 200, self._page(items, query)
+
+    def get_dictionary_terms(self, query, body):
+        return 200, self._page(self.dictionary_terms, query)
+
+    def get_units(self, query, body):
+        return 200, self._page(SEED_UNITS, query)
+
+    def allowed_configs(self, query, body):
+        configs = []
+        for term in self.terms["C99079"]:
+            name = term["name"]["sponsor_preferred_name"]
+            configs.append({
+                "type": f"EpochType_{name.lower()}",
+                "type_name": name.lower(),
+                "subtype": term["term_uid"],
+                "subtype_name": name,
+            })
+        return 200, configs
+
+    def create_arm(self, query, body, study_uid):
+        arm = dict(body, arm_uid=self._uid("StudyArm"))
+        self._study(study_uid)["arms"].append(arm)
+        return 201, arm
+
+    def _term_name(self, term_uid):
+        for terms in self.terms.values():
+            for term in terms:
+                if term["term_uid"] == term_uid:
+                    return term["name"]["sponsor_preferred_name"]
+        return ""
+
+    def create_epoch(self, query, body, study_uid):
+        study = self._study(study_uid)
+        subtype_name = self._term_name(body.get("epoch_subtype"))
+        epoch = {
+            "uid": self._uid("StudyEpoch"),
+            "epoch_subtype": body.get("epoch_subtype"),
+            "epoch_subtype_name": subtype_name,
+            "order": body.get("order"),
+            "description": body.get("description"),
+        }
+        study["epochs"].append(epoch)
+        same = [
+            e for e in study["epochs"] if e["epoch_subtype"] == epoch["epoch_subtype"]
+        ]
+        for i, e in enumerate(same, start=1):
+            e["epoch_name"] = subtype_name if len(same) == 1 else f"{subtype_name} {i}"
+        return 201, epoch
+
+    def get_epochs(self, query, body, study_uid):
+        return 200, self._page(self._study(study_uid)["epochs"], query)
+
+    def create_element(self, query, body, study_uid):
+        element = dict(body, element_uid=self._uid("StudyElement"))
+        self._study(study_uid)["elements"].append(element)
+        return 201, element
+
+    @staticmethod
+    def _labels(body):
+        # Worked out from the seeded unit definitions in seconds, weeks from
+        # the week unit, rather than with the uploader's day based formula, so
+        # that OSB_VISIT_LABELS=verify compares two derivations of OSB's rules
+        factors = {
+            unit["uid"]: unit["conversion_factor_to_master"] for unit in SEED_UNITS
+        }
+        by_name = {
+            unit["name"]: unit["conversion_factor_to_master"] for unit in SEED_UNITS
+        }
+        seconds = float(body.get("time_value") or 0) * factors.get(
+            body.get("time_unit_uid"), by_name["day"]
+        )
+        days = math.trunc(seconds / by_name["day"])
+        weeks = math.trunc(seconds / by_name["week"])
+        # There is no day or week 0: the anchor visit is on day 1 of week 1
+        # and the day before it on day -1 of week -1
+        after_anchor = days >= 0
+        return (
+            f"Day {days + 1 if after_anchor else days}",
+            f"Week {weeks + 1 if after_anchor else weeks - 1}",
+        )
+
+    def preview_visit(self, query, body, study_uid):
+        day_label, week_label = self._labels(body)
+        return 200, dict(
+            body, study_day_label=day_label, study_week_label=week_label, uid=None
+        )
+
+    def create_visit(self, query, body, study_uid):
+        study = self._study(study_uid)
+        if body.get("is_global_anchor_visit") and any(
+            v.get("is_global_anchor_visit") for v in study["visits"]
+        ):
+            return 400, {"message": "Global anchor visit already exists"}
+        visit = dict(body, uid=self._uid("StudyVisit"))
+        study["visits"].append(visit)
+        return 201, visit
+
+    def get_visits(self, query, body, study_uid):
+        return 200, self._page(
+            self._study(study_uid)["visits"],
+            query | {"page_size": query.get("page_size", 0)},
+        )
+
+    def create_template(self, query, body, kind):
+        template = {
+            "uid": self._uid(f"{kind.capitalize()}Template"),
+            "name": body["name"],
+            "status": "Draft",
+            "kind": kind,
+        }
+        self.templates[template["uid"]] = template
+        return 201, template
+
+    def get_template(self, query, body, kind, uid):
+        if uid not in self.templates:
+            return 404, {"message": "Not found"}
+        return 200, self.templates[uid]
+
+    def approve_template(self, query, body, kind, uid):
+        template = self.templates.get(uid)
+        if template is None:
+            return 404, {"message": "Not found"}
+        if template["status"] != "Draft":
+            return 400, {"message": "The object isn't in draft status."}
+        template["status"] = "Final"
+        return 201, template
+
+    def create_study_criteria(self, query, body, study_uid):
+        criteria = dict(body, study_criteria_uid=self._uid("StudyCriteria"))
+        self._study(study_uid)["criteria"].append(criteria)
+        return 201, criteria
+
+    def create_study_objective(self, query, body, study_uid):
+        template = self.templates[body["objective_data"]["objective_template_uid"]]
+        objective = {
+            "study_objective_uid": self._uid("StudyObjective"),
+            "objective_level": {"term_uid": body.get("objective_level_uid")},
+            "objective": {"name": template["name"]},
+        }
+        self._study(study_uid)["objectives"].append(objective)
+        return 201, objective
+
+    def get_study_objectives(self, query, body, study_uid):
+        return 200, self._page(self._study(study_uid)["objectives"], query)
+
+    def create_study_endpoint(self, query, body, study_uid):
+        endpoint = dict(body, study_endpoint_uid=self._uid("StudyEndpoint"))
+        self._study(study_uid)["endpoints"].append(endpoint)
+        return 201, endpoint
+
+    def get_activities(self, query, body):
+        items = list(self.activities.values())
+        if "library_name" in query:
+            items = [a for a in items if a["library_name"] == query["library_name"]]
+        name_filter = json.loads(query.get("filters", "{}")).get("name")
+        if name_filter:
+            values = [v.lower() for v in name_filter["v"]]
+            if name_filter.get("op") == "co":
+                items = [
+                    a for a in items if any(v in a["name"].lower() for v in values)
+                ]
+            else:
+                items = [a for a in items if a["name"].lower() in values]
+        return 200, self._page(items, query)
+
+    def post_activity(self, query, body):
+        for activity in self.activities.values():
+            if activity["name"].lower() == body["name"].lower():
+                return 409, {
+                    "message": f"Activity with name {body['name']} already exists."
+                }
+        grouping = body["activity_groupings"][0]
+        activity = self._create_activity(
+            body["name"],
+            grouping["activity_group_uid"],
+            grouping["activity_subgroup_uid"],
+            body.get("library_name", "Requested"),
+            "Draft",
+        )
+        return 201, activity
+
+    def approve_activity(self, query, body, uid):
+        activity = self.activities.get(uid)
+        if activity is None:
+            return 404, {"message": "Not found"}
+        if activity["status"] != "Draft":
+            return 400, {"message": "The object isn't in draft status."}
+        activity["status"] = "Final"
+        activity["version"] = "1.0"
+        return 201, activity
+
+    def get_groups(self, query, body):
+        return 200, self._page(list(self.groups.values()), query)
+
+    def post_group(self, query, body):
+        return 201, self._create_group(body["name"])
+
+    def get_subgroups(self, query, body):
+        return 200, self._page(list(self.subgroups.values()), query)
+
+    def post_subgroup(self, query, body):
+        return 201, self._create_subgroup(body["name"], body["activity_groups"][0])
+
+    def approve_noop(self, query, body, uid):
+        return 201, {"uid": uid, "status": "Final"}
+
+    def _add_study_activity(self, study_uid, content):
+        study = self._study(study_uid)
+        activity = self.activities.get(content.get("activity_uid"))
+        if activity is None:
+            return 404, {"message": "Activity not found"}
+        if activity["status"] != "Final":
+            return 400, {"message": "Activity is not approved"}
+        for existing in study["activities"]:
+            if existing["activity"]["uid"] == activity["uid"]:
+                return 409, {"message": "Study activity already exists"}
+        study_activity = {
+            "study_activity_uid": self._uid("StudyActivity"),
+            "order": len(study["activities"]) + 1,
+            "activity": {"uid": activity["uid"], "name": activity["name"]},
+            "study_activity_group": {
+                "activity_group_uid": content.get("activity_group_uid")
+            },
+            "study_activity_subgroup": {
+                "activity_subgroup_uid": content.get("activity_subgroup_uid")
+            },
+        }
+        study["activities"].append(study_activity)
+        return 201, study_activity
+
+    def create_study_activity(self, query, body, study_uid):
+        return self._add_study_activity(study_uid, body)
+
+    def batch_study_activities(self, query, body, study_uid):
+        results = []
+        for operation in body:
+            status, content = self._add_study_activity(study_uid, operation["content"])
+            results.append({"response_code": status, "content": content})
+        return 207, results
+
+    def get_study_activities(self, query, body, study_uid):
+        return 200, self._page(self._study(study_uid)["activities"], query)
+
+    def _add_schedule(self, study_uid, content):
+        schedules = self._study(study_uid)["schedules"]
+        key = (content["study_activity_uid"], content["study_visit_uid"])
+        if key in schedules:
+            return 400, {"message": "Study activity schedule already exists"}
+        schedule = dict(
+            content, study_activity_schedule_uid=self._uid("StudyActivitySchedule")
+        )
+        schedules[key] = schedule
+        return 201, schedule
+
+    def create_schedule(self, query, body, study_uid):
+        return self._add_schedule(study_uid, body)
+
+    def batch_schedules(self, query, body, study_uid):
+        results = []
+        for operation in body:
+            status, content = self._add_schedule(study_uid, operation["content"])
+            results.append({"response_code": status, "content": content})
+        return 207, results
+
+    def get_schedules(self, query, body, study_uid):
+        return 200, list(self._study(study_uid)["schedules"].values())
+
+    def get_usdm(self, query, body, study_uid):
+        study = self._study(study_uid)
+        return 200, {
+            "study": {
+                "id": study["uid"],
+                "name": study["acronym"],
+                "versions": [
+                    {
+                        "studyDesigns": [
+                            {
+                                "arms": study["arms"],
+                                "epochs": study["epochs"],
+                                "encounters": study["visits"],
+                                "activities": study["activities"],
+                            }
+                        ]
+                    }
+                ],
+            }
+        }
+
+
+async def upload_against_fake(
+    paths: list[Path], fake: httpx.AsyncBaseTransport, ct_cache: bool = False
+) -> list[StudyUpload]:
+    """Upload ``paths`` against ``fake`` and return their ``StudyUpload``.
+
+    ``fake`` is a ``FakeOsb``, possibly wrapped to record or replay it.
+    """
+    async with osb_session(ct_cache=ct_cache, transport=fake):
+        return await upload_studies(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Upload USDM files against an in-process fake OSB."
+    )
+    parser.add_argument("paths", type=Path, nargs="+", help="USDM JSON files")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added to every response"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Probability of a 503 response"
+    )
+    parser.add_argument(
+        "--error-routes",
+        nargs="+",
+        help="Routes the error rate applies to, e.g. ct-terms; all by default",
+    )
+    parser.add_argument(
+        "--ct-cache",
+        action="store_true",
+        help="Send terminology requests through the snapshot at OSB_CT_CACHE_PATH",
+    )
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument(
+        "--record", type=Path, help="Save the requests and responses to a cassette"
+    )
+    cassette_group.add_argument(
+        "--replay",
+        type=Path,
+        help="Answer the requests from a cassette instead, without delays",
+    )
+    args = parser.parse_args()
+    if args.ct_cache and (args.record or args.replay):
+        parser.error("--ct-cache cannot be combined with --record or --replay")
+
+    if args.replay:
+        fake = ReplayTransport(Cassette.load(args.replay), time_scale=0)
+    else:
+        error_rate = (
+            {route: args.error_rate for route in args.error_routes}
+            if args.error_routes
+            else args.error_rate
+        )
+        fake = FakeOsb(latency=args.latency, error_rate=error_rate)
+        if args.record:
+            cassette = Cassette()
+            fake = RecordingTransport(fake, cassette)
+    uploads = asyncio.run(upload_against_fake(args.paths, fake, args.ct_cache))
+    if args.record:
+        cassette.save(args.record)
+    if args.replay and (fake.remaining or fake.reused or fake.misses):
+        sys.exit(
+            f"Replay differs from the recording: {fake.remaining} recorded"
+            f" requests not replayed, {fake.reused} responses reused and"
+            f" {fake.misses} requests not recorded"
+        )
+    for upload in uploads:
+        status = "uploaded" if upload.succeeded else f"failed: {upload.error}"
+        print(
+            f"{upload.path.name}: {status} in {upload.duration:.1f}s"
+            f" with {upload.requests} requests",
+            file=sys.stderr,
+        )
+    if not all(upload.succeeded for upload in uploads):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,165 +1,162 @@
-from difflib import get_close_matches
-
-import httpx
+import asyncio
 
 from ..settings import settings
+from .activity_library import (
+    ActivityLibraryIndex,
+    activity_library_index,
+    fetch_activity_by_name,
+    remember_activity,
+)
 from .osb_api import (
     create_study_activities_approvals,
     create_study_activities_batch,
     create_study_activities_concept,
 )
+from .session import osb_client, session_lock
 
 
-async def search_frontend_activity(name):
-    headers = {"accept": "application/json, text/plain, */*"}
-    endpoint = f"{settings.osb_base_url}/concepts/activities/activities?page_number=1&page_size=1000"
-    async with httpx.AsyncClient() as client:
-        response = await client.get(endpoint, headers=headers)
-        if response.status_code != 200:
-            return None
-        items = response.json().get("items", [])
-        match = get_close_matches(
-            name.lower(), [i.get("name", "").lower() for i in items], n=1, cutoff=0.6
-        )
-        if match:
-            for i in items:
-                if i.get("name", "").lower() == match[0]:
-                    return i
-        return None
+async def search_frontend_activity(name, library: ActivityLibraryIndex | None = None):
+    if library is None:
+        library = await activity_library_index()
+    position = library.matcher.best(
+        name.lower(), cutoff=settings.osb_activity_match_cutoff
+    )
+    if position is not None:
+        return library.items[position]
+    return None
 
 
-async def get_or_create_group(group_name):
-    clean_name = group_name.lower().replace("grouping activity", "").strip()
-    target_name = group_name.upper() if clean_name.startswith("tbd") else clean_name
-    headers = {"accept": "application/json, text/plain, */*"}
+async def load_activity_groupings(kind: str) -> dict[str, str]:
+    """Uids of the OSB activity groups or sub-groups by lowercased name.
 
-    async with httpx.AsyncClient() as client:
+    ``kind`` is ``activity-groups`` or ``activity-sub-groups``. When several
+    share a name the first one wins.
+    """
+    headers = {"accept": "application/json, text/plain, */*"}
+    async with osb_client() as client:
         response = await client.get(
-            f"{settings.osb_base_url}/concepts/activities/activity-groups?page_number=1&page_size=1000",
+            f"{settings.osb_base_url}/concepts/activities/{kind}?page_number=1&page_size=1000",
             headers=headers,
         )
         response.raise_for_status()
-        groups = response.json().get("items", [])
+    uids: dict[str, str] = {}
+    for item in response.json().get("items", []):
+        uids.setdefault(item.get("name", "").lower().strip(), item.get("uid"))
+    return uids
 
-        for group in groups:
-            if group.get("name", "").lower().strip() == target_name.lower().strip():
-                group_uid = group.get("uid")
-                return group_uid
-        else:
-            payload = {
-                "name": target_name,
-                "name_sentence_case": clean_name.lower(),
-                "definition": f"Auto-generated group for {clean_name}",
-                "abbreviation": clean_name[:3].upper(),
-                "library_name": "Requested",
-            }
-
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{settings.osb_base_url}/concepts/activities/activity-groups",
-                    json=payload,
+
+async def get_or_create_group(group_name, groups: dict[str, str]):
+    """Find the group ``group_name`` in ``groups`` or create and approve it.
+
+    ``groups`` is loaded with ``load_activity_groupings`` and gets the uid of
+    every created group, so each group is created once.
+    """
+    clean_name = group_name.lower().replace("grouping activity", "").strip()
+    target_name = group_name.upper() if clean_name.startswith("tbd") else clean_name
+    headers = {"accept": "application/json, text/plain, */*"}
+
+    async with session_lock("activity-groups"):
+        key = target_name.lower().strip()
+        if key in groups:
+            return groups[key]
+
+        payload = {
+            "name": target_name,
+            "name_sentence_case": clean_name.lower(),
+            "definition": f"Auto-generated group for {clean_name}",
+            "abbreviation": clean_name[:3].upper(),
+            "library_name": "Requested",
+        }
+
+        async with osb_client() as client:
+            response = await client.post(
+                f"{settings.osb_base_url}/concepts/activities/activity-groups",
+                json=payload,
+                headers=headers,
+            )
+            if response.status_code == 422:
+                print(f"Failed to create group '{target_name}': {response.text}")
+                return None
+            response.raise_for_status()
+            group_uid = response.json().get("uid")
+            groups[key] = group_uid
+            try:
+                await client.post(
+                    f"{settings.osb_base_url}/concepts/activities/activity-groups/{group_uid}/approvals?cascade=false",
                     headers=headers,
                 )
-                if response.status_code == 422:
-                    print(f"Failed to create group '{target_name}': {response.text}")
-                    return None
-                response.raise_for_status()
-                group_uid = response.json().get("uid")
-                try:
-                    await client.post(
-                        f"{settings.osb_base_url}/concepts/activities/activity-groups/{group_uid}/approvals?cascade=false",
-                        headers=headers,
-                    )
-                except Exception as e:
-                    print(f"Failed to approve group {group_uid}: {e}")
-                return group_uid
+            except Exception as e:
+                print(f"Failed to approve group {group_uid}: {e}")
+            return group_uid
 
 
-async def get_or_create_subgroup(subgroup_name, group_uid):
+async def get_or_create_subgroup(subgroup_name, group_uid, subgroups: dict[str, str]):
+    """Find the sub-group ``subgroup_name`` in ``subgroups`` or create it.
+
+    Like ``get_or_create_group``, created sub-groups are added to
+    ``subgroups``.
+    """
     clean_name = subgroup_name.lower().replace("grouping activity", "").strip()
     target_name = subgroup_name.upper() if clean_name.startswith("tbd") else clean_name
     headers = {"accept": "application/json, text/plain, */*"}
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{settings.osb_base_url}/concepts/activities/activity-sub-groups?page_number=1&page_size=1000",
-            headers=headers,
-        )
-        response.raise_for_status()
-        subgroups = response.json().get("items", [])
-
-        for sg in subgroups:
-            name = sg.get("name", "").lower().strip()
-            if name == target_name.lower().strip():
-                subgroup_uid = sg.get("uid")
-                return subgroup_uid
-        else:
-            payload = {
-                "name": target_name,
-                "name_sentence_case": clean_name.lower(),
-                "definition": f"Auto-generated subgroup for {clean_name}",
-                "abbreviation": clean_name[:3].upper(),
-                "library_name": "Requested",
-                "activity_groups": [group_uid],
-            }
-
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{settings.osb_base_url}/concepts/activities/activity-sub-groups",
-                    json=payload,
+    async with session_lock("activity-sub-groups"):
+        key = target_name.lower().strip()
+        if key in subgroups:
+            return subgroups[key]
+
+        payload = {
+            "name": target_name,
+            "name_sentence_case": clean_name.lower(),
+            "definition": f"Auto-generated subgroup for {clean_name}",
+            "abbreviation": clean_name[:3].upper(),
+            "library_name": "Requested",
+            "activity_groups": [group_uid],
+        }
+
+        async with osb_client() as client:
+            response = await client.post(
+                f"{settings.osb_base_url}/concepts/activities/activity-sub-groups",
+                json=payload,
+                headers=headers,
+            )
+            if response.status_code == 422:
+                print(f"Failed to create subgroup '{target_name}': {response.text}")
+                return None
+            response.raise_for_status()
+            subgroup_uid = response.json().get("uid")
+            subgroups[key] = subgroup_uid
+            try:
+                await client.post(
+                    f"{settings.osb_base_url}/concepts/activities/activity-sub-groups/{subgroup_uid}/approvals?cascade=false",
                     headers=headers,
                 )
-                if response.status_code == 422:
-                    print(f"Failed to create subgroup '{target_name}': {response.text}")
-                    return None
-                response.raise_for_status()
-                subgroup_uid = response.json().get("uid")
-                try:
-                    await client.post(
-                        f"{settings.osb_base_url}/concepts/activities/activity-sub-groups/{subgroup_uid}/approvals?cascade=false",
-                        headers=headers,
-                    )
-                except Exception as e:
-                    print(f"Failed to approve subgroup {subgroup_uid}: {e}")
-                return subgroup_uid
+            except Exception as e:
+                print(f"Failed to approve subgroup {subgroup_uid}: {e}")
+            return subgroup_uid
 
 
-async def match_synonym_to_activity(synonyms):
-    headers = {"accept": "application/json, text/plain, */*"}
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{settings.osb_base_url}/concepts/activities/activities?page_number=1&page_size=1000",
-            headers=headers,
-        )
-        if response.status_code != 200:
-            return None
-    items = response.json().get("items", [])
-    synonym_set = set(s.lower() for s in synonyms)
-    for item in items:
-        name = item.get("name", "").lower()
-        if any(get_close_matches(name, synonym_set, n=1, cutoff=0.6)):
-            return item
+async def match_synonym_to_activity(
+    synonyms, library: ActivityLibraryIndex | None = None
+):
+    if library is None:
+        library = await activity_library_index()
+    position = library.matcher.first_match(
+        (s.lower() for s in synonyms), cutoff=settings.osb_activity_match_cutoff
+    )
+    if position is not None:
+        return library.items[position]
     return None
 
 
 async def find_existing_activity_by_name(activity_name: str, library_name: str):
     """Helper function to find existing activity by name and check status"""
-    endpoint = f"{settings.osb_base_url}/concepts/activities/activities"
-
-    params = {
-        "library_name": library_name,
-        "page_size": 1000,
-    }
-
-    async with httpx.AsyncClient() as client:
-        response = await client.get(endpoint, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            # Find activity by name (case-insensitive)
-            for item in data.get("items", []):
-                if item.get("name", "").lower() == activity_name.lower():
-                    return item
-        return None
+    library = await activity_library_index()
+    item = library.by_name(activity_name, library_name=library_name)
+    if item is None:
+        # The activity may have been created after the library was loaded
+        item = await fetch_activity_by_name(activity_name, library_name)
+    return item
 
 
 async def create_study_activities(
@@ -169,6 +166,11 @@ async def create_study_activities(
     subgroup_uid: str,
     soa_group_term_uid: str,
 ):
+    """Create and approve the activity concept ``name``.
+
+    Returns the payload adding the approved activity to the study, or
+    ``None`` if it could not be created or approved.
+    """
     response = None
     concept_already_exists = False
 
@@ -248,152 +250,273 @@ async def create_study_activities(
     if not approval_response or not approval_response.get("uid"):
         print("Error: No valid approval response or UID")
         return None
+    remember_activity(approval_response)
+
+    grouping = approval_response.get("activity_groupings", [{}])[0]
+    return {
+        "soa_group_term_uid": soa_group_term_uid,
+        "activity_uid": approval_response.get("uid"),
+        "order": None,
+        "activity_group_uid": grouping.get("activity_group_uid", ""),
+        "activity_subgroup_uid": grouping.get("activity_subgroup_uid", ""),
+    }
 
-    try:
-        batch_response = await create_study_activities_batch(
-            study_uid=study_uid,
-            activity_uid=approval_response.get("uid"),
-            activity_group_uid=approval_response.get("activity_groupings", [{}])[0].get(
-                "activity_group_uid", ""
-            ),
-            activity_subgroup_uid=approval_response.get("activity_groupings", [{}])[
-                0
-            ].get("activity_subgroup_uid", ""),
-            soa_group_term_uid=soa_group_term_uid,
-        )
-    except Exception as e:
-        print(f"Error creating study activities batch: {e}")
-        return None
-    return batch_response
-
-
-async def create_study_activity(version: list, study_uid: str, study_number: str):
-    design = version.get("studyDesigns", [])
-
-    for des in design:
-        activities = des.get("activities", [])
-        biomedical_concepts = version.get("biomedicalConcepts", [])
 
-        for act in activities:
-            label = act.get("label", "")  # noqa: F841
-            description = act.get("description", "")
-            name = act.get("name", "")
-            bc_ids = act.get("biomedicalConceptIds")
+async def add_study_activities(
+    study_uid: str, pending: list[tuple[str, str, dict]]
+) -> dict[str, str]:
+    """Add approved activities to the study with chunked batch requests.
+
+    Args:
+        study_uid: The study UID
+        pending: USDM activity id, name and study activity payload of every
+            activity, in the order they are added to the study
+
+    Returns the study activity UID of every USDM activity id whose activity
+    is in the study. OSB adds an activity to a study once, so USDM activities
+    sharing one all get the study activity it was added as.
+    """
+    added: dict[str, str] = {}
+    chunk_size = max(settings.osb_study_activity_batch_size, 1)
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start : start + chunk_size]
+        try:
+            results = await create_study_activities_batch(
+                study_uid, [payload for _, _, payload in chunk]
+            )
+        except Exception as e:
+            for _, name, _ in chunk:
+                print(f"Error creating study activities batch for '{name}': {e}")
+            continue
+        for (_, name, payload), result in zip(chunk, results):
+            status = result.get("response_code", 0)
+            if status >= 400:
+                print(
+                    f"Error adding study activity '{name}': {status} - {result.get('content')}"
+                )
+                continue
+            added.setdefault(
+                payload.get("activity_uid"),
+                result.get("content", {}).get("study_activity_uid"),
+            )
 
-            if "grouping activity" in (description or "").lower():
-                for child_id in act.get("childIds", []):
-                    child_act = next(
-                        (a for a in activities if a.get("id") == child_id), None
+    study_activity_uids: dict[str, str] = {}
+    for activity_id, _, payload in pending:
+        study_activity_uid = added.get(payload.get("activity_uid"))
+        if study_activity_uid:
+            study_activity_uids.setdefault(activity_id, study_activity_uid)
+    return study_activity_uids
+
+
+async def resolve_study_activity(
+    act: dict,
+    activities: list,
+    biomedical_concepts: list,
+    study_number: str,
+    create,
+    group,
+    library: ActivityLibraryIndex,
+) -> list[tuple[str, str, dict]]:
+    """Find or create the grouping of ``act`` and its activity concepts.
+
+    ``create(name, group_uid, subgroup_uid)`` creates and approves a concept
+    and returns its study activity payload, ``group(name)`` finds or creates
+    the group and sub-group ``name`` and returns their uids, and ``library``
+    is the activity library the activity is matched against. Returns the
+    USDM activity id, name and payload of every concept of the activity, in
+    USDM order.
+    """
+    payloads: list[tuple[str, str, dict]] = []
+
+    def queue(payload: dict | None):
+        if payload is not None:
+            payloads.append((act.get("id"), act.get("name", ""), payload))
+
+    label = act.get("label", "")  # noqa: F841
+    description = act.get("description", "")
+    name = act.get("name", "")
+    bc_ids = act.get("biomedicalConceptIds")
+
+    if "grouping activity" in (description or "").lower():
+        for child_id in act.get("childIds", []):
+            child_act = next((a for a in activities if a.get("id") == child_id), None)
+            if not child_act:
+                continue
+            child_label = (
+                child_act.get("label", "")
+                or child_act.get("name", "")
+                or child_act.get("description", "")
+            )
+            child_bc_ids = child_act.get("biomedicalConceptIds")
+            if not child_bc_ids:
+                matched_act = await search_frontend_activity(
+                    name=child_label, library=library
+                )
+                if matched_act:
+                    grouping = matched_act.get("activity_groupings", [])[0]
+                    queue(
+                        await create(
+                            name=name,
+                            group_uid=str(grouping.get("activity_grouping_uid")),
+                            subgroup_uid=str(grouping.get("activity_subgrouping_uid")),
+                        ),
                     )
-                    if not child_act:
-                        continue
-                    child_label = (
-                        child_act.get("label", "")
-                        or child_act.get("name", "")
-                        or child_act.get("description", "")
+                else:
+                    group_id, subgroup_id = await group(description)
+                    queue(
+                        await create(
+                            name=name,
+                            group_uid=str(group_id),
+                            subgroup_uid=str(subgroup_id),
+                        ),
                     )
-                    child_bc_ids = child_act.get("biomedicalConceptIds")
-                    if not child_bc_ids:
-                        matched_act = await search_frontend_activity(name=child_label)
-                        if matched_act:
-                            grouping = matched_act.get("activity_groupings", [])[0]
-                            await create_study_activities(
-                                study_uid=study_uid,
-                                name=name,
-                                group_uid=str(grouping.get("activity_grouping_uid")),
-                                subgroup_uid=str(
-                                    grouping.get("activity_subgrouping_uid")
-                                ),
-                                soa_group_term_uid="CTTerm_000067",  # Todo: hardcoded soa group term uid
-                            )
-                        else:
-                            group_id = await get_or_create_group(group_name=description)
-                            subgroup_id = await get_or_create_subgroup(
-                                subgroup_name=description, group_uid=group_id
-                            )
-                            await create_study_activities(
-                                study_uid=study_uid,
-                                name=name,
-                                group_uid=str(group_id),
-                                subgroup_uid=str(subgroup_id),
-                                soa_group_term_uid="CTTerm_000067",  # Todo: hardcoded soa group term uid
-                            )
 
-                    else:
-                        for bc_id in bc_ids:
-                            bc = next(
-                                (
-                                    b
-                                    for b in biomedical_concepts
-                                    if b.get("id") == bc_id
+            else:
+                for bc_id in bc_ids:
+                    bc = next(
+                        (b for b in biomedical_concepts if b.get("id") == bc_id),
+                        None,
+                    )
+                    if bc:
+                        match = await match_synonym_to_activity(
+                            bc.get("synonyms", []), library
+                        )
+                        if match:
+                            grouping = match.get("activity_groupings", [])[0]
+                            queue(
+                                await create(
+                                    name=name,
+                                    group_uid=str(
+                                        grouping.get("activity_grouping_uid")
+                                    ),
+                                    subgroup_uid=str(
+                                        grouping.get("activity_subgrouping_uid")
+                                    ),
                                 ),
-                                None,
                             )
-                            if bc:
-                                match = await match_synonym_to_activity(
-                                    bc.get("synonyms", [])
-                                )
-                                if match:
-                                    grouping = match.get("activity_groupings", [])[0]
-                                    await create_study_activities(
-                                        study_uid=study_uid,
-                                        name=name,
-                                        group_uid=str(
-                                            grouping.get("activity_grouping_uid")
-                                        ),
-                                        subgroup_uid=str(
-                                            grouping.get("activity_subgrouping_uid")
-                                        ),
-                                        soa_group_term_uid="CTTerm_000067",  # Todo: hardcoded soa group term uid
-                                    )
+    else:
+        if not bc_ids:
+            matched_act = await search_frontend_activity(name=name, library=library)
+            if matched_act:
+                grouping = matched_act.get("activity_groupings", [])[0]
+                try:
+                    queue(
+                        await create(
+                            name=name,
+                            group_uid=str(grouping.get("activity_group_uid")),
+                            subgroup_uid=str(grouping.get("activity_subgroup_uid")),
+                        ),
+                    )
+                except Exception as e:
+                    print(f"Failed to create study activity: {e}")
+
             else:
-                if not bc_ids:
-                    matched_act = await search_frontend_activity(name=name)
-                    if matched_act:
-                        grouping = matched_act.get("activity_groupings", [])[0]
-                        try:
-                            await create_study_activities(
-                                study_uid=study_uid,
+                tbd_name = f"TBD_{study_number}"  # Todo: hardcoded tbd name
+                group_id, subgroup_id = await group(tbd_name)
+                queue(
+                    await create(
+                        name=name,
+                        group_uid=str(group_id),
+                        subgroup_uid=str(subgroup_id),
+                    ),
+                )
+        else:
+            for bc_id in bc_ids:
+                bc = next(
+                    (b for b in biomedical_concepts if b.get("id") == bc_id),
+                    None,
+                )
+                if bc:
+                    match = await match_synonym_to_activity(
+                        bc.get("synonyms", []), library
+                    )
+                    if match:
+                        grouping = match.get("activity_groupings", [])[0]
+                        queue(
+                            await create(
                                 name=name,
                                 group_uid=str(grouping.get("activity_group_uid")),
                                 subgroup_uid=str(grouping.get("activity_subgroup_uid")),
-                                soa_group_term_uid="CTTerm_000067",  # Todo: hardcoded soa group term uid
-                            )
-                        except Exception as e:
-                            print(f"Failed to create study activity: {e}")
-
-                    else:
-                        tbd_name = f"TBD_{study_number}"  # Todo: hardcoded tbd name
-                        group_id = await get_or_create_group(tbd_name)
-                        subgroup_id = await get_or_create_subgroup(
-                            subgroup_name=tbd_name, group_uid=group_id
+                            ),
                         )
-                        await create_study_activities(
+
+    return payloads
+
+
+async def create_study_activity(version: list, study_uid: str, study_number: str):
+    design = version.get("studyDesigns", [])
+    # Activities are resolved, created and approved concurrently, at most
+    # settings.osb_activity_concurrency at a time, then added to the study in
+    # USDM order with a few batch requests. They are matched against the
+    # library as it was when the step started and the activity groups are
+    # listed once, so the requests do not depend on which activity is
+    # resolved first
+    semaphore = asyncio.Semaphore(max(settings.osb_activity_concurrency, 1))
+    library = (await activity_library_index()).snapshot()
+    concepts: dict[str, asyncio.Task] = {}
+    groupings: dict[str, asyncio.Task] = {}
+
+    try:
+        async with asyncio.TaskGroup() as tasks:
+
+            async def create(name: str, group_uid: str, subgroup_uid: str):
+                # Each concept is created and approved once, however many
+                # activities use it, so concurrent activities never race on the
+                # same name
+                if name not in concepts:
+                    concepts[name] = tasks.create_task(
+                        create_study_activities(
                             study_uid=study_uid,
                             name=name,
-                            group_uid=str(group_id),
-                            subgroup_uid=str(subgroup_id),
+                            group_uid=group_uid,
+                            subgroup_uid=subgroup_uid,
                             soa_group_term_uid="CTTerm_000067",  # Todo: hardcoded soa group term uid
                         )
-                else:
-                    for bc_id in bc_ids:
-                        bc = next(
-                            (b for b in biomedical_concepts if b.get("id") == bc_id),
-                            None,
-                        )
-                        if bc:
-                            match = await match_synonym_to_activity(
-                                bc.get("synonyms", [])
-                            )
-                            if match:
-                                grouping = match.get("activity_groupings", [])[0]
-                                await create_study_activities(
-                                    study_uid=study_uid,
-                                    name=name,
-                                    group_uid=str(grouping.get("activity_group_uid")),
-                                    subgroup_uid=str(
-                                        grouping.get("activity_subgroup_uid")
-                                    ),
-                                    soa_group_term_uid="CTTerm_000067",  # Todo: hardcoded soa group term uid
-                                )
+                    )
+                payload = await asyncio.shield(concepts[name])
+                return dict(payload) if payload is not None else None
+
+            async def listed(kind: str) -> dict[str, str]:
+                if kind not in groupings:
+                    groupings[kind] = tasks.create_task(load_activity_groupings(kind))
+                return await asyncio.shield(groupings[kind])
+
+            async def group(name: str) -> tuple[str | None, str | None]:
+                group_uid = await get_or_create_group(
+                    name, await listed("activity-groups")
+                )
+                subgroup_uid = await get_or_create_subgroup(
+                    name, group_uid, await listed("activity-sub-groups")
+                )
+                return group_uid, subgroup_uid
+
+            async def resolve(act: dict, activities: list, biomedical_concepts: list):
+                async with semaphore:
+                    return await resolve_study_activity(
+                        act,
+                        activities,
+                        biomedical_concepts,
+                        study_number,
+                        create,
+                        group,
+                        library,
+                    )
+
+            # A failing activity cancels every other resolve and concept task
+            # of the step instead of leaving them sending requests
+            resolutions = []
+            for des in design:
+                activities = des.get("activities", [])
+                biomedical_concepts = version.get("biomedicalConcepts", [])
+                resolutions.extend(
+                    tasks.create_task(resolve(act, activities, biomedical_concepts))
+                    for act in activities
+                )
+    except ExceptionGroup as e:
+        # Report the first failure like a plain gather would
+        raise e.exceptions[0] from e
+    pending = [payload for task in resolutions for payload in task.result()]
+
+    study_activity_uids = await add_study_activities(study_uid, pending)
     print("Study activities created successfully.")
+    return study_activity_uids
@@ -0,0 +1,223 @@
+import asyncio
+import json
+
+from ..settings import settings
+from .ct_terms import normalize_name
+from .matching import FuzzyMatcher
+from .session import current_session, osb_client
+
+HEADERS = {"accept": "application/json, text/plain, */*"}
+PAGE_SIZE = 1000
+
+
+class ActivityLibraryIndex:
+    """The OSB activity library with O(1) lookups by name and synonym.
+
+    Items keep the order in which OSB returned them; when several activities
+    share a key the first one wins, matching the linear scans this index
+    replaces.
+    """
+
+    def __init__(self, items: list[dict] | None = None):
+        self.items: list[dict] = []
+        self.names: list[str] = []
+        self._positions: dict[str, int] = {}
+        self._by_name: dict[str, str] = {}
+        self._by_library_name: dict[tuple[str, str], str] = {}
+        self._by_synonym: dict[str, str] = {}
+        self._matcher: FuzzyMatcher | None = None
+        for item in items or []:
+            self.add(item)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    @staticmethod
+    def _keys(item: dict) -> list[tuple[str, object]]:
+        name = normalize_name(item.get("name"))
+        return [
+            ("_by_name", name),
+            ("_by_library_name", (item.get("library_name", ""), name)),
+        ] + [
+            ("_by_synonym", normalize_name(synonym))
+            for synonym in item.get("synonyms") or []
+        ]
+
+    def _index_keys(self, uid: str, keys: list[tuple[str, object]]):
+        for lookup, key in keys:
+            getattr(self, lookup).setdefault(key, uid)
+
+    def add(self, item: dict):
+        """Add an activity, or replace the activity with the same uid."""
+        uid = item.get("uid")
+        position = self._positions.get(uid)
+        name = item.get("name", "").lower()
+        if position is not None:
+            old_keys = self._keys(self.items[position])
+            new_keys = self._keys(item)
+            self.items[position] = item
+            if self.names[position] != name:
+                self.names[position] = name
+                self._matcher = None
+            # Keys the activity no longer has go to the next activity with
+            # them, if any, so lookups never return the replaced version
+            for lookup, key in old_keys:
+                if (lookup, key) in new_keys:
+                    continue
+                keys = getattr(self, lookup)
+                if keys.get(key) == uid:
+                    del keys[key]
+                    for other in self.items:
+                        if (lookup, key) in self._keys(other) and other.get("uid"):
+                            keys[key] = other["uid"]
+                            break
+            self._index_keys(uid, new_keys)
+            return
+
+        if uid is not None:
+            self._positions[uid] = len(self.items)
+        self.items.append(item)
+        self.names.append(name)
+        if self._matcher is not None:
+            self._matcher.add(name)
+        if uid is None:
+            return
+        self._index_keys(uid, self._keys(item))
+
+    def snapshot(self) -> "ActivityLibraryIndex":
+        """A copy that activities added or replaced later do not change."""
+        return ActivityLibraryIndex(self.items)
+
+    @property
+    def matcher(self) -> FuzzyMatcher:
+        """Fuzzy matcher over the lowercased names, in library order."""
+        if self._matcher is None:
+            self._matcher = FuzzyMatcher(self.names)
+        return self._matcher
+
+    def _get(self, uid: str | None) -> dict | None:
+        position = self._positions.get(uid)
+        return None if position is None else self.items[position]
+
+    def by_uid(self, uid: str) -> dict | None:
+        return self._get(uid)
+
+    def by_name(self, name: str, library_name: str | None = None) -> dict | None:
+        """Look up an activity by normalized name, optionally within a library."""
+        if library_name is None:
+            return self._get(self._by_name.get(normalize_name(name)))
+        return self._get(
+            self._by_library_name.get((library_name, normalize_name(name)))
+        )
+
+    def by_synonym(self, synonym: str) -> dict | None:
+        """Look up an activity by one of its library synonyms."""
+        return self._get(self._by_synonym.get(normalize_name(synonym)))
+
+
+async def load_activity_library() -> ActivityLibraryIndex | None:
+    """Download every page of the activity library.
+
+    Returns ``None`` when the library could not be listed.
+    """
+    endpoint = f"{settings.osb_base_url}/concepts/activities/activities"
+    index = ActivityLibraryIndex()
+    page_number = 1
+    async with osb_client() as client:
+        while True:
+            response = await client.get(
+                endpoint,
+                params={
+                    "page_number": page_number,
+                    "page_size": PAGE_SIZE,
+                    "total_count": "true",
+                },
+                headers=HEADERS,
+            )
+            if response.status_code != 200:
+                return None
+            data = response.json()
+            items = data.get("items", [])
+            loaded = len(index)
+            for item in items:
+                index.add(item)
+            total = data.get("total") or 0
+            if (
+                len(items) < PAGE_SIZE
+                or len(index) == loaded
+                or (total and len(index) >= total)
+            ):
+                return index
+            page_number += 1
+
+
+async def fetch_activity_by_name(name: str, library_name: str) -> dict | None:
+    """Look up a single activity of a library by name in OSB.
+
+    Used when the activity is missing from the session's library, e.g.
+    because it was created elsewhere after the download, and added to it.
+    """
+    filters = {"name": {"v": [name], "op": "co"}}
+    async with osb_client() as client:
+        response = await client.get(
+            f"{settings.osb_base_url}/concepts/activities/activities",
+            params={
+                "library_name": library_name,
+                "filters": json.dumps(filters, separators=(",", ":")),
+                "page_number": 1,
+                "page_size": PAGE_SIZE,
+            },
+            headers=HEADERS,
+        )
+    if response.status_code != 200:
+        return None
+    target = normalize_name(name)
+    for item in response.json().get("items", []):
+        if normalize_name(item.get("name")) == target:
+            remember_activity(item)
+            return item
+    return None
+
+
+async def activity_library_index(refresh: bool = False) -> ActivityLibraryIndex:
+    """Return the activity library of the active session.
+
+    The library is downloaded once per session; ``refresh`` forces a new
+    download, e.g. when an activity created elsewhere is missing. Outside of a
+    session the library is downloaded on every call.
+    """
+    session = current_session()
+    if session is None:
+        return await load_activity_library() or ActivityLibraryIndex()
+
+    if refresh or session.activity_library is None:
+        session.activity_library = asyncio.ensure_future(load_activity_library())
+    task = session.activity_library
+    try:
+        # Shielded, as other steps may be waiting for the same download
+        index = await asyncio.shield(task)
+    except Exception:
+        if session.activity_library is task:
+            session.activity_library = None
+        raise
+    if index is None:
+        # Failed downloads are not kept so a later lookup can try again
+        if session.activity_library is task:
+            session.activity_library = None
+        return ActivityLibraryIndex()
+    return index
+
+
+def remember_activity(item: dict):
+    """Record a created or approved activity in the session's library.
+
+    Does nothing when the library has not been downloaded yet, as the next
+    download will include the activity anyway.
+    """
+    session = current_session()
+    if session is None or session.activity_library is None:
+        return
+    task = session.activity_library
+    if task.done() and not task.cancelled() and task.exception() is None:
+        if index := task.result():
+            index.add(item)
@@ -0,0 +1,257 @@
+import asyncio
+import base64
+import json
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Iterator
+
+import httpx
+
+from ..settings import settings
+from .session import build_transport
+
+SCRUBBED = "[scrubbed]"
+
+# The recorded body is already decoded, so these would no longer describe it
+_DROPPED_RESPONSE_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+class CassetteMiss(Exception):
+    """A replayed request has no unused recorded interaction."""
+
+
+@dataclass
+class Interaction:
+    """One recorded request and its response.
+
+    ``path`` is relative to the OSB base URL so a cassette can be replayed
+    against another base URL. ``started`` is the offset from the first
+    request of the recording and ``duration`` the time until the response
+    body was received, both in seconds.
+    """
+
+    method: str
+    path: str
+    request_headers: dict[str, str]
+    request_body: str
+    status: int
+    response_headers: dict[str, str]
+    response_body: str
+    started: float
+    duration: float
+    binary: bool = False
+
+
+def _encode(content: bytes) -> tuple[str, bool]:
+    try:
+        return content.decode("utf-8"), False
+    except UnicodeDecodeError:
+        return base64.b64encode(content).decode("ascii"), True
+
+
+def _decode(body: str, binary: bool) -> bytes:
+    return base64.b64decode(body) if binary else body.encode("utf-8")
+
+
+def _relative_path(url: httpx.URL, base_url: str) -> str:
+    raw = str(url)
+    base_url = base_url.rstrip("/")
+    return raw[len(base_url) :] if raw.startswith(base_url) else raw
+
+
+class Cassette:
+    """The HTTP conversation of an upload, saved to and loaded from JSON."""
+
+    def __init__(
+        self,
+        interactions: list[Interaction] | None = None,
+        base_url: str | None = None,
+    ):
+        self.interactions = interactions or []
+        self.base_url = base_url or settings.osb_base_url
+
+    @classmethod
+    def load(cls, path: Path) -> "Cassette":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(
+            [Interaction(**interaction) for interaction in data["interactions"]],
+            data.get("base_url"),
+        )
+
+    def save(self, path: Path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "base_url": self.base_url,
+                    "interactions": [asdict(i) for i in self.interactions],
+                },
+                f,
+                indent=1,
+            )
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Send requests through ``transport`` and record them in a ``Cassette``.
+
+    Headers named in ``scrub_headers`` (``settings.osb_cassette_scrub_headers``
+    by default) are replaced before anything is stored.
+    """
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        cassette: Cassette,
+        scrub_headers: set[str] | None = None,
+    ):
+        self._transport = transport
+        self.cassette = cassette
+        self.scrub_headers = {
+            name.lower()
+            for name in (
+                settings.osb_cassette_scrub_headers
+                if scrub_headers is None
+                else scrub_headers
+            )
+        }
+        self._origin: float | None = None
+
+    def _headers(self, headers: httpx.Headers, dropped=()) -> dict[str, str]:
+        return {
+            name: SCRUBBED if name in self.scrub_headers else value
+            for name, value in headers.items()
+            if name not in dropped
+        }
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        if self._origin is None:
+            self._origin = start
+        response = await self._transport.handle_async_request(request)
+        try:
+            await response.aread()
+        except BaseException:
+            await response.aclose()
+            raise
+        request_body, _ = _encode(request.content)
+        response_body, response_binary = _encode(response.content)
+        self.cassette.interactions.append(
+            Interaction(
+                method=request.method,
+                path=_relative_path(request.url, self.cassette.base_url),
+                request_headers=self._headers(request.headers),
+                request_body=request_body,
+                status=response.status_code,
+                response_headers=self._headers(
+                    response.headers, _DROPPED_RESPONSE_HEADERS
+                ),
+                response_body=response_body,
+                started=start - self._origin,
+                duration=time.perf_counter() - start,
+                binary=response_binary,
+            )
+        )
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """Answer requests from a ``Cassette`` instead of the network.
+
+    A request is answered with the first unused interaction of the same
+    method, path and body, or failing that of the same method and path, so
+    the n-th request to an endpoint gets the n-th recorded response. A GET
+    sent more often than recorded gets the last recorded response of its
+    endpoint again; any other request without an unused interaction raises
+    ``CassetteMiss``. ``reused`` and ``misses`` count both cases.
+    Each response is delayed by its recorded duration times ``time_scale``:
+    ``1`` preserves the recorded timing, ``0.1`` compresses it tenfold and
+    ``0`` replays without delays.
+    """
+
+    def __init__(self, cassette: Cassette, time_scale: float = 1.0):
+        self.time_scale = time_scale
+        self.base_url = settings.osb_base_url
+        self._unused: dict[tuple[str, str], list[Interaction]] = {}
+        self._last: dict[tuple[str, str], Interaction] = {}
+        self.reused = 0
+        self.misses = 0
+        for interaction in cassette.interactions:
+            key = (interaction.method, interaction.path)
+            self._unused.setdefault(key, []).append(interaction)
+
+    @property
+    def remaining(self) -> int:
+        """Number of recorded interactions not replayed yet."""
+        return sum(len(interactions) for interactions in self._unused.values())
+
+    def _take(self, request: httpx.Request) -> Interaction:
+        key = (request.method, _relative_path(request.url, self.base_url))
+        candidates = self._unused.get(key)
+        if not candidates:
+            if request.method == "GET" and key in self._last:
+                self.reused += 1
+                return self._last[key]
+            self.misses += 1
+            raise CassetteMiss(
+                f"No recorded response left for {request.method} {request.url}"
+            )
+        body, _ = _encode(request.content)
+        position = next(
+            (
+                i
+                for i, interaction in enumerate(candidates)
+                if interaction.request_body == body
+            ),
+            0,
+        )
+        self._last[key] = candidates.pop(position)
+        return self._last[key]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        interaction = self._take(request)
+        if self.time_scale:
+            await asyncio.sleep(interaction.duration * self.time_scale)
+        return httpx.Response(
+            interaction.status,
+            headers=interaction.response_headers,
+            content=_decode(interaction.response_body, interaction.binary),
+            request=request,
+        )
+
+
+@contextmanager
+def cassette_transport(
+    record: Path | None = None,
+    replay: Path | None = None,
+    time_scale: float = 1.0,
+) -> Iterator[httpx.AsyncBaseTransport | None]:
+    """Transport recording to or replaying from a cassette file, if either is set.
+
+    A recording is saved when the context exits, also when the upload
+    failed. Yields ``None`` when neither ``record`` nor ``replay`` is given.
+    """
+    if record and replay:
+        raise ValueError("Cannot record and replay a cassette at the same time")
+    if replay:
+        transport = ReplayTransport(Cassette.load(replay), time_scale)
+        yield transport
+        if transport.remaining:
+            print(f"{transport.remaining} recorded requests were not replayed")
+        if transport.reused:
+            print(f"{transport.reused} requests were answered with a reused response")
+        return
+    if not record:
+        yield None
+        return
+
+    cassette = Cassette()
+    try:
+        yield RecordingTransport(build_transport(), cassette)
+    finally:
+        cassette.save(record)
+        print(f"Recorded {len(cassette.interactions)} requests to {record}")
@@ -7,6 +7,8 @@ async def create_study_id(usdm_data: dict) -> dict:
     study_versions = study_info.get("versions", [])
     study_titles = study_versions[0].get("titles", [])
 
+    # Studies without an official title use their first title instead
+    title1 = study_titles[0].get("text", "") if study_titles else ""
     for title in study_titles:
         if title.get("type", {}).get("decode", "") == "Official Study Title":
             title1 = title.get("text", "")
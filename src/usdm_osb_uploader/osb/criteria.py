@@ -1,8 +1,6 @@
 import re
 
-import httpx
-
-from ..settings import settings
+from .ct_terms import ct_term_index
 from .osb_api import (
     create_study_criteria_inclusion_approvals,
     create_study_criteria_inclusion_create_criteria,
@@ -23,18 +21,9 @@ async def create_study_criteria(study_version: dict, study_uid: str):
             raw_text = text_map.get(item_id, "")
             mapped_criteria.append({"id": item_id, "type": crit_type, "text": raw_text})
 
+    criteria_types = await ct_term_index().terms("C66797")
     for crit in mapped_criteria:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.osb_base_url}/ct/terms?codelist_uid=C66797&page_number=1&page_size=1000"
-            )
-            for item in response.json().get("items", []):
-                if (
-                    item.get("name", {}).get("sponsor_preferred_name", "").lower()
-                    == crit["type"]
-                ):
-                    type_uid = item.get("term_uid")
-                    break
+        type_uid = (criteria_types.by_name(crit["type"]) or {}).get("term_uid")
 
         raw_html = crit.get("text", "")
         plain_text = re.sub(r"<[^>]+>", "", raw_html).strip()
@@ -0,0 +1,177 @@
+import sqlite3
+import time
+from pathlib import Path
+
+import httpx
+
+from ..settings import settings
+
+# GET endpoints whose responses only change when the terminology is updated
+CACHED_PATH_PREFIXES = ("/ct/", "/dictionaries/", "/concepts/unit-definitions")
+
+
+class CtCacheStore:
+    """Single-file SQLite snapshot of controlled terminology responses.
+
+    Entries are keyed by OSB base URL and the request path with its query, so
+    one file can hold snapshots of several OSB instances.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.path)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ct_cache (
+                base_url TEXT NOT NULL,
+                url TEXT NOT NULL,
+                content_type TEXT,
+                body BLOB NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (base_url, url)
+            )
+            """
+        )
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+    def get(self, base_url: str, url: str, ttl: float) -> tuple[str, bytes] | None:
+        """Return ``(content_type, body)`` of an entry younger than ``ttl``."""
+        row = self._connection.execute(
+            "SELECT content_type, body, fetched_at FROM ct_cache"
+            " WHERE base_url = ? AND url = ?",
+            (base_url, url),
+        ).fetchone()
+        if row is None or time.time() - row[2] > ttl:
+            return None
+        return row[0], row[1]
+
+    def put(self, base_url: str, url: str, content_type: str | None, body: bytes):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO ct_cache VALUES (?, ?, ?, ?, ?)",
+            (base_url, url, content_type, body, time.time()),
+        )
+        self._connection.commit()
+
+    def urls(self, base_url: str) -> list[str]:
+        rows = self._connection.execute(
+            "SELECT url FROM ct_cache WHERE base_url = ? ORDER BY url", (base_url,)
+        )
+        return [row[0] for row in rows]
+
+    def clear(self, base_url: str | None = None) -> int:
+        """Delete the entries of ``base_url`` (or all entries) and return the count."""
+        if base_url is None:
+            cursor = self._connection.execute("DELETE FROM ct_cache")
+        else:
+            cursor = self._connection.execute(
+                "DELETE FROM ct_cache WHERE base_url = ?", (base_url,)
+            )
+        self._connection.commit()
+        return cursor.rowcount
+
+    def stats(self, ttl: float) -> list[dict]:
+        """Summarize the snapshot per base URL."""
+        now = time.time()
+        rows = self._connection.execute(
+            """
+            SELECT base_url, COUNT(*), SUM(LENGTH(body)), MIN(fetched_at),
+                   MAX(fetched_at), SUM(CASE WHEN ? - fetched_at > ? THEN 1 ELSE 0 END)
+            FROM ct_cache GROUP BY base_url ORDER BY base_url
+            """,
+            (now, ttl),
+        )
+        return [
+            {
+                "base_url": base_url,
+                "entries": entries,
+                "bytes": size,
+                "oldest_age": now - oldest,
+                "newest_age": now - newest,
+                "expired": expired,
+            }
+            for base_url, entries, size, oldest, newest, expired in rows
+        ]
+
+
+def cache_key(request: httpx.Request, base_url: str) -> str | None:
+    """Return the store key of a cacheable request, or ``None``."""
+    if request.method != "GET":
+        return None
+    url = str(request.url)
+    if not url.startswith(base_url):
+        return None
+    key = url[len(base_url) :]
+    if not key.startswith(CACHED_PATH_PREFIXES):
+        return None
+    return key
+
+
+class CtCacheTransport(httpx.AsyncBaseTransport):
+    """Serve terminology GETs from a ``CtCacheStore`` and record misses."""
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        store: CtCacheStore,
+        base_url: str | None = None,
+        ttl: float | None = None,
+    ):
+        self._transport = transport
+        self.store = store
+        self.base_url = (base_url or settings.osb_base_url).rstrip("/")
+        self.ttl = settings.osb_ct_cache_ttl if ttl is None else ttl
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = cache_key(request, self.base_url)
+        if key is None:
+            return await self._transport.handle_async_request(request)
+
+        cached = self.store.get(self.base_url, key, self.ttl)
+        if cached is not None:
+            content_type, body = cached
+            headers = {"content-type": content_type} if content_type else {}
+            return httpx.Response(
+                200, headers=headers, content=body, extensions={"osb_ct_cache": "hit"}
+            )
+
+        response = await self._transport.handle_async_request(request)
+        if response.status_code != 200:
+            return response
+        # aread() decodes any content encoding, so only the content type needs
+        # to be kept alongside the body
+        body = await response.aread()
+        content_type = response.headers.get("content-type")
+        self.store.put(self.base_url, key, content_type, body)
+        headers = {"content-type": content_type} if content_type else {}
+        # The extensions carry e.g. the number of retries to the metrics
+        return httpx.Response(
+            200, headers=headers, content=body, extensions=response.extensions
+        )
+
+    async def aclose(self):
+        self.store.close()
+        await self._transport.aclose()
+
+
+async def refresh_snapshot(
+    store: CtCacheStore, client: httpx.AsyncClient, base_url: str | None = None
+) -> tuple[int, int]:
+    """Re-download every snapshot entry of ``base_url``.
+
+    ``client`` must not itself be backed by the snapshot. Returns the number
+    of refreshed and failed entries; failed entries keep their old value.
+    """
+    base_url = (base_url or settings.osb_base_url).rstrip("/")
+    refreshed = failed = 0
+    for url in store.urls(base_url):
+        response = await client.get(base_url + url)
+        if response.status_code != 200:
+            failed += 1
+            continue
+        store.put(base_url, url, response.headers.get("content-type"), response.content)
+        refreshed += 1
+    return refreshed, failed
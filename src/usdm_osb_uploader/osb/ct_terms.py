@@ -0,0 +1,227 @@
+import asyncio
+import json
+from typing import Callable
+
+from ..settings import settings
+from .session import current_session, osb_client
+
+HEADERS = {"accept": "application/json, text/plain, */*"}
+
+
+def normalize_name(name: str | None) -> str:
+    """Normalize a term name for case and whitespace insensitive lookups."""
+    return " ".join((name or "").lower().split())
+
+
+def _ct_concept_id(item: dict) -> str:
+    return item.get("attributes", {}).get("concept_id", "")
+
+
+def _ct_name(item: dict) -> str:
+    return item.get("name", {}).get("sponsor_preferred_name", "")
+
+
+class CodelistTerms:
+    """Terms of a single codelist with O(1) lookups.
+
+    When several terms share a key the first one in OSB order wins, matching
+    the linear scans this index replaces.
+    """
+
+    def __init__(
+        self,
+        items: list[dict],
+        concept_id: Callable[[dict], str] = _ct_concept_id,
+        name: Callable[[dict], str] = _ct_name,
+    ):
+        self.items = items
+        self._by_concept_id: dict[str, dict] = {}
+        self._by_term_uid: dict[str, dict] = {}
+        self._by_name: dict[str, dict] = {}
+        for item in items:
+            if key := concept_id(item):
+                self._by_concept_id.setdefault(key, item)
+            if key := item.get("term_uid"):
+                self._by_term_uid.setdefault(key, item)
+            if key := normalize_name(name(item)):
+                self._by_name.setdefault(key, item)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def by_concept_id(self, concept_id: str | None) -> dict | None:
+        return self._by_concept_id.get(concept_id or "")
+
+    def by_term_uid(self, term_uid: str | None) -> dict | None:
+        return self._by_term_uid.get(term_uid or "")
+
+    def by_name(self, name: str | None) -> dict | None:
+        """Look up a term by its normalized sponsor preferred name."""
+        return self._by_name.get(normalize_name(name))
+
+
+class CtTermIndex:
+    """Run-scoped cache of controlled terminology.
+
+    Every codelist is downloaded at most once per run, even when several
+    steps ask for it concurrently.
+    """
+
+    def __init__(self):
+        self._tasks: dict[tuple, asyncio.Task] = {}
+
+    async def _load(self, key: tuple, loader):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(loader())
+            self._tasks[key] = task
+        try:
+            # Shielded, as other steps may be waiting for the same lookup when
+            # this one is cancelled
+            result = await asyncio.shield(task)
+        except Exception:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+            raise
+        if result is None and self._tasks.get(key) is task:
+            # Failed lookups are not cached so a later step can try again
+            del self._tasks[key]
+        return result
+
+    async def terms(self, codelist_uid: str) -> CodelistTerms:
+        """Return all terms of the codelist with the given uid."""
+
+        async def loader():
+            async with osb_client() as client:
+                response = await client.get(
+                    f"{settings.osb_base_url}/ct/terms",
+                    params={
+                        "codelist_uid": codelist_uid,
+                        "page_number": 1,
+                        "page_size": 1000,
+                    },
+                    headers=HEADERS,
+                )
+            if response.status_code != 200:
+                return None
+            return CodelistTerms(response.json().get("items", []))
+
+        return await self._load(("terms", codelist_uid), loader) or CodelistTerms([])
+
+    async def codelist_uid(self, submission_value: str) -> str | None:
+        """Resolve the uid of a sponsor SDTM CT codelist by submission value."""
+
+        async def loader():
+            filters = {
+                "attributes.submission_value": {"v": [submission_value], "op": "eq"}
+            }
+            async with osb_client() as client:
+                response = await client.get(
+                    f"{settings.osb_base_url}/ct/codelists",
+                    params={
+                        "total_count": "true",
+                        "library_name": "Sponsor",
+                        "catalogue_name": "SDTM CT",
+                        "filters": json.dumps(filters, separators=(",", ":")),
+                    },
+                    headers=HEADERS,
+                )
+            if response.status_code != 200:
+                return None
+            items = response.json().get("items", [])
+            return items[0].get("codelist_uid") if items else None
+
+        return await self._load(("codelist", submission_value), loader)
+
+    async def term_uid(self, codelist_name: str, submission_value: str) -> str | None:
+        """Resolve the uid of a term by its codelist name and submission value."""
+
+        async def loader():
+            filters = {
+                "attributes.name_submission_value": {
+                    "v": [submission_value],
+                    "op": "eq",
+                }
+            }
+            async with osb_client() as client:
+                response = await client.get(
+                    f"{settings.osb_base_url}/ct/terms",
+                    params={
+                        "codelist_name": codelist_name,
+                        "filters": json.dumps(filters, separators=(",", ":")),
+                    },
+                    headers=HEADERS,
+                )
+            if response.status_code != 200:
+                return None
+            items = response.json().get("items", [])
+            return items[0].get("term_uid") if items else None
+
+        return await self._load(("term", codelist_name, submission_value), loader)
+
+    async def search_codelist_uid(self, text: str) -> str | None:
+        """Resolve the uid of the first sponsor codelist matching ``text``."""
+
+        async def loader():
+            filters = {"*": {"v": [text]}}
+            async with osb_client() as client:
+                response = await client.get(
+                    f"{settings.osb_base_url}/ct/codelists",
+                    params={
+                        "filters": json.dumps(filters, separators=(",", ":")),
+                        "library_name": "Sponsor",
+                    },
+                    headers=HEADERS,
+                )
+            if response.status_code != 200:
+                return None
+            items = response.json().get("items", [])
+            return items[0].get("codelist_uid") if items else None
+
+        return await self._load(("codelist-search", text), loader)
+
+    async def terms_by_submission_value(self, submission_value: str) -> CodelistTerms:
+        """Return all terms of the codelist with the given submission value."""
+        codelist_uid = await self.codelist_uid(submission_value)
+        if codelist_uid is None:
+            return CodelistTerms([])
+        return await self.terms(codelist_uid)
+
+    async def dictionary_terms(self, codelist_uid: str) -> CodelistTerms:
+        """Return all terms of a dictionary codelist (e.g. SNOMED)."""
+
+        async def loader():
+            async with osb_client() as client:
+                response = await client.get(
+                    f"{settings.osb_base_url}/dictionaries/terms",
+                    params={
+                        "codelist_uid": codelist_uid,
+                        "page_number": 1,
+                        "page_size": 1000,
+                    },
+                    headers=HEADERS,
+                )
+            if response.status_code != 200:
+                return None
+            return CodelistTerms(
+                response.json().get("items", []),
+                concept_id=lambda item: item.get("dictionary_id", ""),
+                name=lambda item: item.get("name", ""),
+            )
+
+        return await self._load(
+            ("dictionary", codelist_uid), loader
+        ) or CodelistTerms([])
+
+
+def ct_term_index() -> CtTermIndex:
+    """Return the terminology index of the active session.
+
+    Outside of a session a fresh, unshared index is returned.
+    """
+    session = current_session()
+    if session is None:
+        return CtTermIndex()
+    if session.ct_terms is None:
+        session.ct_terms = CtTermIndex()
+    return session.ct_terms
@@ -1,14 +1,13 @@
 import json
 
-import httpx
-
 from ..settings import settings
+from .session import osb_client
 
 
 async def download_usdm(study_uid: str):
     file_path = f"./{study_uid}_usdm.json"
     endpoint = f"{settings.osb_base_url}/usdm/v3/studyDefinitions/{study_uid}"
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.get(endpoint)
         response.raise_for_status()
         with open(file_path, "w") as f:
@@ -1,23 +1,24 @@
-import httpx
-
-from ..settings import settings
+from .ct_terms import ct_term_index
 from .osb_api import create_study_structure_study_element
 
 
 async def create_study_element(study_designs: list, study_uid: str):
     design = study_designs[0]
     elements = design.get("elements", [])
+    ct_terms = ct_term_index()
+    element_types = await ct_terms.terms_by_submission_value("ELEMTP")
+    element_subtypes_uid = await ct_terms.codelist_uid("ELEMSTP")
+    element_subtypes = await ct_terms.terms_by_submission_value("ELEMSTP")
     for elem in elements:
         name = elem.get("name", "")
         label = name.lower() if len(name) > 3 else elem.get("label", "").lower()
-        start_rule = elem.get("transitionStartRule", {}).get("text", "")
+        start_rule = (elem.get("transitionStartRule") or {}).get("text", "")
         end_rule = (
             elem.get("transitionEndRule", {}).get("text", None)
             if elem.get("transitionEndRule")
             else None
         )
         description = elem.get("description", "")
-        code = None
 
         if label in [
             "screening",
@@ -37,47 +38,19 @@ async def create_study_element(study_designs: list, study_uid: str):
             element_type = "Treatment"
             label = "treatment"
 
-        async with httpx.AsyncClient() as client:
-            res = await client.get(
-                settings.osb_base_url
-                + '/ct/codelists?total_count=true&library_name=Sponsor&catalogue_name=SDTM+CT&filters={"attributes.submission_value":{"v":["ELEMTP"],"op":"eq"}}'
-            )
-            data = res.json()
-            type_uid = data.get("items", [])[0].get("codelist_uid")
-
-            response = await client.get(
-                f"{settings.osb_base_url}/ct/terms?codelist_uid={type_uid}&page_number=1&page_size=1000"
-            )
-
-            for item in response.json().get("items", []):
-                if (
-                    item.get("name", {}).get("sponsor_preferred_name", "")
-                    == element_type
-                ):
-                    code = item.get("term_uid")
-                    break
-
-        async with httpx.AsyncClient() as client:
-            res = await client.get(
-                (settings.osb_base_url)
-                + '/ct/codelists?total_count=true&library_name=Sponsor&catalogue_name=SDTM+CT&filters={"attributes.submission_value":{"v":["ELEMSTP"],"op":"eq"}}'
-            )
-            data = res.json()
-            subtype_uid = data.get("items", [])[0].get("codelist_uid")
+        code = (element_types.by_name(element_type) or {}).get("term_uid")
 
-            response = await client.get(
-                f"{settings.osb_base_url}/ct/terms?codelist_uid={subtype_uid}&page_number=1&page_size=1000"
-            )
-            for item in response.json().get("items", []):
-                if (
-                    item.get("name", {})
-                    .get("sponsor_preferred_name", "")
-                    .lower()
-                    .split("-")[0]
-                    in label.lower()
-                ):
-                    subtype_uid = item.get("term_uid")
-                    break
+        subtype_uid = element_subtypes_uid
+        for item in element_subtypes.items:
+            if (
+                item.get("name", {})
+                .get("sponsor_preferred_name", "")
+                .lower()
+                .split("-")[0]
+                in label.lower()
+            ):
+                subtype_uid = item.get("term_uid")
+                break
 
         element_name = name if len(name) > 3 else elem.get("label", "")
 
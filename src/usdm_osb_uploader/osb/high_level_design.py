@@ -1,11 +1,16 @@
-import httpx
-
-from ..settings import settings
+from .ct_terms import ct_term_index
 from .osb_api import create_high_level_design
 
 
+def _term_ref(item: dict) -> dict:
+    return {
+        "term_uid": item.get("term_uid", "string"),
+        "name": item.get("name", {}).get("sponsor_preferred_name", "string"),
+    }
+
+
 async def create_study_high_level_design(study_designs: list, study_uid: str):
-    headers = {"accept": "application/json, text/plain, */*"}
+    ct_terms = ct_term_index()
     study_type_code = {}
     trial_phase_code = {}
     trial_type_codes = []
@@ -15,42 +20,18 @@ async def create_study_high_level_design(study_designs: list, study_uid: str):
         study_type_code = studyType.get("code", "")
 
         if study_type_code:
-            endpoint = f"{settings.osb_base_url}/ct/terms?codelist_uid=C99077&page_number=1&page_size=1000"
-            async with httpx.AsyncClient() as client:
-                response = await client.get(endpoint, headers=headers)
-                if response.status_code == 200:
-                    items = response.json().get("items", [])
-                    for item in items:
-                        codelists = item.get("attributes", {}).get("concept_id", "")
-                        if codelists == study_type_code:
-                            study_type_code = {
-                                "term_uid": item.get("term_uid", "string"),
-                                "name": item.get("name", {}).get(
-                                    "sponsor_preferred_name", "string"
-                                ),
-                            }
-                            break
+            terms = await ct_terms.terms("C99077")
+            if item := terms.by_concept_id(study_type_code):
+                study_type_code = _term_ref(item)
 
         studyPhase = design.get("studyPhase", {})
         standardCode = studyPhase.get("standardCode", {})
         phase_code = standardCode.get("code", "")
 
         if phase_code:
-            endpoint = f"{settings.osb_base_url}/ct/terms?codelist_uid=C66737&page_number=1&page_size=1000"
-            async with httpx.AsyncClient() as client:
-                response = await client.get(endpoint, headers=headers)
-                if response.status_code == 200:
-                    items = response.json().get("items", [])
-                    for item in items:
-                        codelists = item.get("attributes", {}).get("concept_id", "")
-                        if codelists == phase_code:
-                            trial_phase_code = {
-                                "term_uid": item.get("term_uid", "string"),
-                                "name": item.get("name", {}).get(
-                                    "sponsor_preferred_name", "string"
-                                ),
-                            }
-                            break
+            terms = await ct_terms.terms("C66737")
+            if item := terms.by_concept_id(phase_code):
+                trial_phase_code = _term_ref(item)
 
         subTypes = design.get("subTypes", {})
         trial_type_codes_list = [
@@ -58,23 +39,10 @@ async def create_study_high_level_design(study_designs: list, study_uid: str):
         ]
 
         if trial_type_codes_list:
-            endpoint = f"{settings.osb_base_url}/ct/terms?codelist_uid=C66739&page_number=1&page_size=1000"
-            headers = {"accept": "application/json, text/plain, */*"}
-            async with httpx.AsyncClient() as client:
-                response = await client.get(endpoint, headers=headers)
-                if response.status_code == 200:
-                    items = response.json().get("items", [])
-                    for code in trial_type_codes_list:
-                        for item in items:
-                            codelists = item.get("attributes", {}).get("concept_id", "")
-                            if codelists == code:
-                                trial_type_codes.append({
-                                    "term_uid": item.get("term_uid", "string"),
-                                    "name": item.get("name", {}).get(
-                                        "sponsor_preferred_name", "string"
-                                    ),
-                                })
-                                break
+            terms = await ct_terms.terms("C66739")
+            for code in trial_type_codes_list:
+                if item := terms.by_concept_id(code):
+                    trial_type_codes.append(_term_ref(item))
 
     response = await create_high_level_design(
         study_uid=study_uid,
@@ -0,0 +1,149 @@
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from typing import Iterable
+
+SHORTLIST_SIZE = 32
+
+
+def trigrams(text: str) -> set[str]:
+    """Character trigrams of ``text``, padded so short strings still have some."""
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def _ratio_bound(matches: int, length: int) -> float:
+    # Same expression as difflib, so bounds and ratios compare exactly
+    return 2.0 * matches / length if length else 1.0
+
+
+class FuzzyMatcher:
+    """Drop-in replacement for ``difflib.get_close_matches`` on a fixed list.
+
+    The choices are indexed once by trigram, length and character counts.
+    A lookup scores the few choices sharing the most trigrams with the query
+    first, then uses the best ratio found so far to skip every choice whose
+    length or character counts cannot beat it. Everything that is not skipped
+    is scored with ``SequenceMatcher`` exactly like difflib does, so results,
+    including tie-breaks, are identical to difflib's.
+    """
+
+    def __init__(self, choices: Iterable[str] = (), shortlist: int = SHORTLIST_SIZE):
+        self.shortlist = shortlist
+        self.choices: list[str] = []
+        self._counts: list[Counter] = []
+        self._grams: list[set[str]] = []
+        self._postings: dict[str, list[int]] = defaultdict(list)
+        self._by_length: dict[int, list[int]] = defaultdict(list)
+        for choice in choices:
+            self.add(choice)
+
+    def __len__(self) -> int:
+        return len(self.choices)
+
+    def add(self, choice: str) -> int:
+        """Append a choice and return its position."""
+        position = len(self.choices)
+        self.choices.append(choice)
+        self._counts.append(Counter(choice))
+        grams = trigrams(choice)
+        self._grams.append(grams)
+        for gram in grams:
+            self._postings[gram].append(position)
+        self._by_length[len(choice)].append(position)
+        return position
+
+    def _quick_bound(self, counts: Counter, position: int, length: int) -> float:
+        other = self._counts[position]
+        matches = sum(min(n, other[char]) for char, n in counts.items())
+        return _ratio_bound(matches, length)
+
+    def _lengths_within(self, length: int, bound: float) -> list[int]:
+        """Choice lengths whose ``real_quick_ratio`` against ``length`` reaches ``bound``."""
+        return [
+            other
+            for other in self._by_length
+            if _ratio_bound(min(length, other), length + other) >= bound
+        ]
+
+    def _shortlist(self, query: str) -> list[int]:
+        grams = trigrams(query)
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        return sorted(
+            shared,
+            key=lambda position: (
+                -shared[position] / (len(grams) + len(self._grams[position]))
+            ),
+        )[: self.shortlist]
+
+    def best(self, query: str, cutoff: float = 0.6) -> int | None:
+        """Position of the choice ``get_close_matches(query, choices, n=1)`` returns.
+
+        Among equal choices the first position is returned. ``None`` means no
+        choice scores at least ``cutoff``.
+        """
+        matcher = SequenceMatcher()
+        matcher.set_seq2(query)
+        counts = Counter(query)
+        best_key: tuple[float, str] | None = None
+        best_position = None
+        scored = set()
+
+        def score(position: int):
+            nonlocal best_key, best_position
+            scored.add(position)
+            choice = self.choices[position]
+            length = len(query) + len(choice)
+            bound = best_key[0] if best_key else cutoff
+            if _ratio_bound(min(len(query), len(choice)), length) < bound:
+                return
+            if self._quick_bound(counts, position, length) < bound:
+                return
+            matcher.set_seq1(choice)
+            key = (matcher.ratio(), choice)
+            if key[0] < cutoff:
+                return
+            if (
+                best_key is None
+                or key > best_key
+                or (key == best_key and position < best_position)
+            ):
+                best_key, best_position = key, position
+
+        for position in self._shortlist(query):
+            score(position)
+
+        bound = best_key[0] if best_key else cutoff
+        for length in self._lengths_within(len(query), bound):
+            for position in self._by_length[length]:
+                if position not in scored:
+                    score(position)
+        return best_position
+
+    def first_match(self, queries: Iterable[str], cutoff: float = 0.6) -> int | None:
+        """Lowest position whose choice is a close match of any of ``queries``.
+
+        Equivalent to scanning the choices in order and returning the first
+        one for which ``get_close_matches(choice, queries, n=1, cutoff=cutoff)``
+        is not empty.
+
+        Unlike ``best`` this does not use the trigram postings: it is still a
+        linear scan in library order, with only the length and character
+        count bounds skipping ``SequenceMatcher`` calls. Synonym matches are
+        usually found early in the library, where narrowing the candidates
+        through the postings first costs more than the scan it saves.
+        """
+        queries = [(query, len(query), Counter(query)) for query in set(queries)]
+        for position, choice in enumerate(self.choices):
+            for query, query_length, counts in queries:
+                length = query_length + len(choice)
+                if _ratio_bound(min(query_length, len(choice)), length) < cutoff:
+                    continue
+                if self._quick_bound(counts, position, length) < cutoff:
+                    continue
+                # get_close_matches(choice, queries) compares each query
+                # against the choice, which is the second sequence
+                if SequenceMatcher(None, query, choice).ratio() >= cutoff:
+                    return position
+        return None
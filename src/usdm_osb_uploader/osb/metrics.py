@@ -0,0 +1,196 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from urllib.parse import urlsplit
+
+import httpx
+
+from ..settings import settings
+from .scheduler import UID_PATTERN
+
+# Upper bounds of the latency histogram buckets in milliseconds
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_current_step: ContextVar[str | None] = ContextVar("osb_step", default=None)
+
+
+@contextmanager
+def metrics_step(name: str):
+    """Attribute the OSB requests made in this context to step ``name``."""
+    token = _current_step.set(name)
+    try:
+        yield
+    finally:
+        _current_step.reset(token)
+
+
+def endpoint_template(request: httpx.Request, base_url: str | None = None) -> str:
+    """Path of ``request`` with its uids replaced by placeholders.
+
+    ``/studies/Study_000001/study-visits/preview`` becomes
+    ``/studies/{study_uid}/study-visits/preview``.
+    """
+    base_path = urlsplit(base_url or settings.osb_base_url).path.rstrip("/")
+    path = request.url.path
+    if path.startswith(base_path):
+        path = path[len(base_path) :]
+    segments = [segment for segment in path.split("/") if segment]
+    for i, segment in enumerate(segments):
+        if i and segments[i - 1] in ("studies", "studyDefinitions"):
+            if segment != "list":
+                segments[i] = "{study_uid}"
+        elif UID_PATTERN.fullmatch(segment):
+            segments[i] = "{uid}"
+    return "/" + "/".join(segments)
+
+
+@dataclass
+class RequestRecord:
+    """One OSB call as seen by the steps, including retries and queueing."""
+
+    step: str | None
+    method: str
+    template: str
+    status: int | None
+    latency: float
+    bytes: int
+    bytes_sent: int
+    retries: int
+    cached: bool
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of sorted ``values``."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def histogram(latencies: list[float]) -> list[int]:
+    """Number of latencies per ``LATENCY_BUCKETS_MS`` bucket, plus overflow."""
+    counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    for latency in latencies:
+        counts[bisect_left(LATENCY_BUCKETS_MS, latency * 1000)] += 1
+    return counts
+
+
+def summarize(records: list[RequestRecord]) -> dict:
+    """Request count, errors, retries, bytes and latency of ``records``.
+
+    ``bytes`` counts response bodies and ``bytes_sent`` request bodies.
+    """
+    latencies = sorted(record.latency for record in records)
+    statuses: dict[str, int] = {}
+    for record in records:
+        status = str(record.status) if record.status is not None else "error"
+        statuses[status] = statuses.get(status, 0) + 1
+    return {
+        "requests": len(records),
+        "cached": sum(record.cached for record in records),
+        "errors": sum(
+            record.status is None or record.status >= 400 for record in records
+        ),
+        "retries": sum(record.retries for record in records),
+        "bytes": sum(record.bytes for record in records),
+        "bytes_sent": sum(record.bytes_sent for record in records),
+        "statuses": statuses,
+        "total_latency": sum(latencies),
+        "p50_latency": percentile(latencies, 0.5),
+        "p95_latency": percentile(latencies, 0.95),
+        "max_latency": latencies[-1] if latencies else 0.0,
+        "histogram": histogram(latencies),
+    }
+
+
+class MetricsRecorder:
+    """Collects a ``RequestRecord`` for every OSB call of a session."""
+
+    def __init__(self):
+        self.records: list[RequestRecord] = []
+        self.started = time.perf_counter()
+
+    def record(self, record: RequestRecord):
+        self.records.append(record)
+
+    def by_step(self) -> dict[str, dict]:
+        """Summary per step, in the order the steps made their first call."""
+        groups: dict[str, list[RequestRecord]] = {}
+        for record in self.records:
+            groups.setdefault(record.step or "-", []).append(record)
+        return {step: summarize(records) for step, records in groups.items()}
+
+    def by_endpoint(self) -> list[dict]:
+        """Summary per method and endpoint template, slowest in total first."""
+        groups: dict[tuple[str, str], list[RequestRecord]] = {}
+        for record in self.records:
+            groups.setdefault((record.method, record.template), []).append(record)
+        rows = [
+            {"method": method, "template": template, **summarize(records)}
+            for (method, template), records in groups.items()
+        ]
+        return sorted(rows, key=lambda row: -row["total_latency"])
+
+    def report(self) -> dict:
+        """Everything recorded, in a JSON serializable form."""
+        return {
+            "wall_time": time.perf_counter() - self.started,
+            "latency_buckets_ms": list(LATENCY_BUCKETS_MS),
+            "total": summarize(self.records),
+            "steps": self.by_step(),
+            "endpoints": self.by_endpoint(),
+            "requests": [asdict(record) for record in self.records],
+        }
+
+
+class MetricsTransport(httpx.AsyncBaseTransport):
+    """Record every request sent through ``transport`` in a ``MetricsRecorder``."""
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        recorder: MetricsRecorder,
+        base_url: str | None = None,
+    ):
+        self._transport = transport
+        self.recorder = recorder
+        self.base_url = base_url
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        try:
+            response = await self._transport.handle_async_request(request)
+            await response.aread()
+        except BaseException as e:
+            self._record(request, None, start, getattr(e, "osb_retries", 0))
+            raise
+        self._record(request, response, start)
+        return response
+
+    def _record(
+        self,
+        request: httpx.Request,
+        response: httpx.Response | None,
+        start: float,
+        retries: int = 0,
+    ):
+        self.recorder.record(
+            RequestRecord(
+                step=_current_step.get(),
+                method=request.method,
+                template=endpoint_template(request, self.base_url),
+                status=None if response is None else response.status_code,
+                latency=time.perf_counter() - start,
+                bytes=0 if response is None else len(response.content),
+                bytes_sent=int(request.headers.get("content-length", 0)),
+                retries=retries
+                if response is None
+                else response.extensions.get("osb_retries", 0),
+                cached=response is not None
+                and response.extensions.get("osb_ct_cache") == "hit",
+            )
+        )
+
+    async def aclose(self):
+        await self._transport.aclose()
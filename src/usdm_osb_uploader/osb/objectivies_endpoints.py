@@ -1,6 +1,5 @@
-import httpx
-
 from ..settings import settings
+from .ct_terms import ct_term_index
 from .osb_api import (
     create_study_endpoint_approvals,
     create_study_endpoint_create_objective,
@@ -9,6 +8,7 @@ from .osb_api import (
     create_study_purpose_endpoint_templates,
     create_study_purpose_objective_templates,
 )
+from .session import osb_client
 
 
 async def create_study_objective_endpoint(study_design: dict, study_uid: str):
@@ -16,6 +16,9 @@ async def create_study_objective_endpoint(study_design: dict, study_uid: str):
     design = study_design[0]
     objectives = design.get("objectives", [])
     level_uid = None
+    ct_terms = ct_term_index()
+    objective_levels = await ct_terms.terms_by_submission_value("OBJTLEVL")
+    endpoint_levels = await ct_terms.terms_by_submission_value("ENDPLEVL")
 
     for obj in objectives:
         template_response = await create_study_purpose_objective_templates(
@@ -29,23 +32,9 @@ async def create_study_objective_endpoint(study_design: dict, study_uid: str):
         approval_response = await create_study_objective_approvals(template_uid)  # noqa: F841
         # print(approval_response.get("uid"))
 
-        async with httpx.AsyncClient() as client:
-            res = await client.get(
-                (settings.osb_base_url)
-                + '/ct/codelists?total_count=true&library_name=Sponsor&catalogue_name=SDTM+CT&filters={"attributes.submission_value":{"v":["OBJTLEVL"],"op":"eq"}}'
-            )
-            data = res.json()
-            level_uid = data.get("items", [])[0].get("codelist_uid")
-            response = await client.get(
-                f"{settings.osb_base_url}/ct/terms?codelist_uid={level_uid}&page_number=1&page_size=1000"
-            )
-            for item in response.json().get("items", []):
-                if (
-                    item.get("name", {}).get("sponsor_preferred_name", "").lower()
-                    == obj.get("level", {}).get("decode", "").lower()
-                ):
-                    level_uid = item.get("term_uid")
-                    break
+        level_uid = (
+            objective_levels.by_name(obj.get("level", {}).get("decode", "")) or {}
+        ).get("term_uid")
 
         create_response = await create_study_objective_create_objective(  # noqa: F841
             study_uid=study_uid, uid=template_uid, objective_level_uid=level_uid
@@ -53,7 +42,7 @@ async def create_study_objective_endpoint(study_design: dict, study_uid: str):
 
         endpoint = f"{settings.osb_base_url}/studies/{study_uid}/study-objectives"
         study_objective_uid = None  # Initialize the variable
-        async with httpx.AsyncClient() as client:
+        async with osb_client() as client:
             response = await client.get(endpoint, headers=headers)
             # print(response.json().get("items", []))
             for existing in response.json().get("items", []):
@@ -82,25 +71,10 @@ async def create_study_objective_endpoint(study_design: dict, study_uid: str):
                 endpoint_template_uid
             )  # noqa: F841
 
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(
-                    (settings.osb_base_url)
-                    + "/ct/codelists?total_count=true&library_name=Sponsor&catalogue_name=SDTM+CT&filters={%22attributes.submission_value%22:{%22v%22:[%22ENDPLEVL%22],%22op%22:%22eq%22}}"
-                )
-                resp.raise_for_status()
-                data = resp.json()
-                endpoint_codelist_uid = data.get("items", [])[0].get("codelist_uid")
-                response = await client.get(
-                    f"{settings.osb_base_url}/ct/terms?codelist_uid={endpoint_codelist_uid}&page_number=1&page_size=1000"
-                )
-                endpoint_level_uid = None
-                for item in response.json().get("items", []):
-                    if (
-                        item.get("name", {}).get("sponsor_preferred_name", "").lower()
-                        == obj_end.get("level", {}).get("decode", "").lower()
-                    ):
-                        endpoint_level_uid = item.get("term_uid")
-                        break
+            endpoint_level_uid = (
+                endpoint_levels.by_name(obj_end.get("level", {}).get("decode", ""))
+                or {}
+            ).get("term_uid")
 
             create_response = await create_study_endpoint_create_objective(  # noqa: F841
                 study_uid=study_uid,
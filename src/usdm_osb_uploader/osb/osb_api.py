@@ -1,9 +1,11 @@
+from dataclasses import dataclass
 from typing import Annotated
 
-import httpx
 from pydantic import BaseModel, Field, RootModel
 
 from ..settings import settings
+from .ct_terms import ct_term_index
+from .session import osb_client, session_lock
 
 
 class StudyMinimal(BaseModel):
@@ -21,7 +23,9 @@ async def create_study(name: str, description: str):
     latest_study_number_url = rf"{settings.osb_base_url}/studies/list?minimal=true"
 
     headers = {"accept": "application/json, text/plain, */*"}
-    async with httpx.AsyncClient() as client:
+    # The study number is derived from the existing studies, so concurrent
+    # uploads must not create their studies at the same time
+    async with session_lock("create-study"), osb_client() as client:
         response = await client.get(latest_study_number_url, headers=headers)
         response.raise_for_status()
         data = RootModel[list[StudyMinimal]].model_validate(response.json())
@@ -92,7 +96,7 @@ async def create_high_level_design(
             }
         }
     }
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.patch(endpoint, json=req_body)
         if (
             response.status_code == 422
@@ -128,7 +132,7 @@ async def create_study_structure_study_arm(
         "description": description,
         "number_of_subjects": 0,
     }
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, json=req_body)
         if (
             response.status_code == 422
@@ -164,7 +168,7 @@ async def create_study_structure_study_epoch(
         "order": order,
         "description": description,
     }
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, json=req_body)
         if (
             response.status_code == 422
@@ -201,7 +205,7 @@ async def create_study_structure_study_element(
         "element_colour": "#BDBDBD",  # Default color, can be customized
         "element_subtype_uid": subtype_uid,
     }
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, json=req_body)
         if (
             response.status_code == 422
@@ -226,7 +230,7 @@ async def create_study_structure_study_element_patch(
         "short_name": short_name,
         "element_subtype_uid": subtype_uid,
     }
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.patch(endpoint, json=req_body)
         if (
             response.status_code == 422
@@ -294,7 +298,7 @@ async def create_study_population_api(
         },
         "study_parent_part_uid": None,
     }
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.patch(endpoint, json=req_body)
         if (
             response.status_code == 422
@@ -322,7 +326,7 @@ async def create_study_criteria_inclusion_criteria_templates(
         "category_uids": None,
         "sub_category_uids": None,
     }
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, json=req_body)
         if (
             response.status_code == 422
@@ -343,7 +347,7 @@ async def create_study_criteria_inclusion_approvals(
 ):  # criteria_template
     endpoint = f"{settings.osb_base_url}/criteria-templates/{criteria_template_uid}/approvals?cascade=true"
     HEADERS = {"Content-Type": "application/json"}
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, headers=HEADERS)
         if (
             response.status_code == 422
@@ -369,7 +373,7 @@ async def create_concepts_numeric(
         "template_parameter": template_parameter,
     }
 
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, json=req_body)
         if (
             response.status_code == 422
@@ -407,7 +411,7 @@ async def create_concepts_numeric_with_unit(
         "unit_definition_uid": unit_definition_uid,
     }
 
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, json=req_body)
         if (
             response.status_code == 422
@@ -435,7 +439,7 @@ async def create_study_criteria_inclusion_create_criteria(
         }
     }
 
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, json=req_body)
         if (
             response.status_code == 422
@@ -464,7 +468,7 @@ async def create_study_purpose_objective_templates(
         "category_uids": None,
         "is_confirmatory_testing": False,
     }
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, json=req_body)
         if (
             response.status_code == 422
@@ -485,7 +489,7 @@ async def get_objective_template_status(objective_template_uid: str) -> dict:
     endpoint = f"{settings.osb_base_url}/objective-templates/{objective_template_uid}"
     headers = {"accept": "application/json"}
 
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.get(endpoint, headers=headers)
         if (
             response.status_code == 422
@@ -515,7 +519,7 @@ async def create_study_objective_approvals(objective_template_uid: str):
         endpoint = f"{settings.osb_base_url}/objective-templates/{objective_template_uid}/approvals?cascade=true"
         HEADERS = {"Content-Type": "application/json"}
 
-        async with httpx.AsyncClient() as client:
+        async with osb_client() as client:
             response = await client.post(endpoint, headers=HEADERS)
             if (
                 response.status_code == 422
@@ -549,7 +553,7 @@ async def create_study_objective_create_objective(
         },
     }
 
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, json=req_body)
         if (
             response.status_code == 422
@@ -578,7 +582,7 @@ async def create_study_purpose_endpoint_templates(
         "category_uids": None,
         "is_confirmatory_testing": False,
     }
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, json=req_body)
         if (
             response.status_code == 422
@@ -599,7 +603,7 @@ async def get_endpoint_template_status(endpoint_template_uid: str) -> dict:
     endpoint = f"{settings.osb_base_url}/endpoint-templates/{endpoint_template_uid}"
     headers = {"accept": "application/json"}
 
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.get(endpoint, headers=headers)
         if (
             response.status_code == 422
@@ -629,7 +633,7 @@ async def create_study_endpoint_approvals(endpoint_template_uid: str):
         endpoint = f"{settings.osb_base_url}/endpoint-templates/{endpoint_template_uid}/approvals?cascade=true"
         HEADERS = {"Content-Type": "application/json"}
 
-        async with httpx.AsyncClient() as client:
+        async with osb_client() as client:
             response = await client.post(endpoint, headers=HEADERS)
             if (
                 response.status_code == 422
@@ -671,7 +675,7 @@ async def create_study_endpoint_create_objective(
         "timeframe_uid": None,
     }
 
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, json=req_body)
         if (
             response.status_code == 422
@@ -687,42 +691,47 @@ async def create_study_endpoint_create_objective(
         return response.json()
 
 
-async def create_study_structure_study_visit(
-    study_uid: str,
-    is_global_anchor_visit: bool,
+@dataclass(frozen=True)
+class StudyVisitContext:
+    """Terms shared by every visit of a study."""
+
+    time_reference_uid: str
+    epoch_allocation_uid: str
+
+
+async def study_visit_context() -> StudyVisitContext:
+    """
+    Resolve the global anchor visit time reference and the previous visit
+    epoch allocation, once per run.
+    """
+    terms = ct_term_index()
+    time_reference_uid = await terms.term_uid(
+        "Time Point Reference", "GLOBAL ANCHOR VISIT REFERENCE"
+    )
+    if time_reference_uid is None:
+        raise Exception(
+            "Time Point Reference 'GLOBAL ANCHOR VISIT REFERENCE' not found"
+        )
+    epoch_allocation_uid = await terms.term_uid("Epoch Allocation", "PREVIOUS VISIT")
+    if epoch_allocation_uid is None:
+        raise Exception("Epoch Allocation 'PREVIOUS VISIT' not found")
+    return StudyVisitContext(time_reference_uid, epoch_allocation_uid)
+
+
+def study_visit_request_body(
     study_epoch_uid: str,
     visit_type_uid: str,
     visit_contact_mode_uid: str,
     time_value: str,
     time_unit_uid: str,
     description: str,
+    context: StudyVisitContext,
     min_visit_window_value: str = "0",
     max_visit_window_value: str = "0",
     visit_window_unit_uid: str = "UnitDefinition_000364",
-):
-    # get global anchor visit ct
-    async with httpx.AsyncClient(timeout=60) as client:
-        resp = await client.get(
-            settings.osb_base_url
-            + "/ct/terms?codelist_name=Time+Point+Reference&filters={%22attributes.name_submission_value%22:{%22v%22:[%22GLOBAL%20ANCHOR%20VISIT%20REFERENCE%22],%22op%22:%22eq%22}}"
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        time_reference_uid = data["items"][0]["term_uid"]
-
-    async with httpx.AsyncClient(timeout=60) as client:
-        resp = await client.get(
-            settings.osb_base_url
-            + "/ct/terms?codelist_name=Epoch+Allocation&filters={%22attributes.name_submission_value%22:{%22v%22:[%22PREVIOUS%20VISIT%22],%22op%22:%22eq%22}}"
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        epoch_allocation_uid = data["items"][0]["term_uid"]
-
-    preview_endpoint = (
-        f"{settings.osb_base_url}/studies/{study_uid}/study-visits/preview"
-    )
-    req_body = {
+) -> dict:
+    """Body previewing a single visit, before its labels are known."""
+    return {
         "is_global_anchor_visit": False,
         "visit_class": "SINGLE_VISIT",
         "show_visit": True,
@@ -731,20 +740,45 @@ async def create_study_structure_study_visit(
         "visit_subclass": "SINGLE_VISIT",
         "visit_window_unit_uid": visit_window_unit_uid,
         "study_epoch_uid": study_epoch_uid,
-        "epoch_allocation_uid": epoch_allocation_uid,
+        "epoch_allocation_uid": context.epoch_allocation_uid,
         "visit_type_uid": visit_type_uid,
         "visit_contact_mode_uid": visit_contact_mode_uid,
-        "time_reference_uid": time_reference_uid,
+        "time_reference_uid": context.time_reference_uid,
         "time_value": time_value,
         "time_unit_uid": time_unit_uid,
         "description": description,
     }
-    # print(req_body)
-    async with httpx.AsyncClient(timeout=60) as client:
+
+
+async def preview_study_visit(study_uid: str, req_body: dict) -> dict:
+    """
+    Preview a visit to get the study day and week labels OSB derives for it.
+
+    Args:
+        study_uid: The study UID
+        req_body: Visit body from study_visit_request_body
+    """
+    preview_endpoint = (
+        f"{settings.osb_base_url}/studies/{study_uid}/study-visits/preview"
+    )
+    async with osb_client() as client:
         response = await client.post(preview_endpoint, json=req_body)
         response.raise_for_status()
-        preview = response.json()
+        return response.json()
+
+
+async def submit_study_visit(
+    study_uid: str, req_body: dict, preview: dict, is_global_anchor_visit: bool
+) -> dict:
+    """
+    Create a previewed visit.
 
+    Args:
+        study_uid: The study UID
+        req_body: Visit body the preview was made with
+        preview: Response of preview_study_visit
+        is_global_anchor_visit: Whether the visit is the study's global anchor
+    """
     submit_endpoint = f"{settings.osb_base_url}/studies/{study_uid}/study-visits"
 
     submit_req_body = req_body.copy()
@@ -753,12 +787,46 @@ async def create_study_structure_study_visit(
     if is_global_anchor_visit:
         submit_req_body["is_global_anchor_visit"] = is_global_anchor_visit
 
-    async with httpx.AsyncClient(timeout=60) as client:
+    async with osb_client() as client:
         response = await client.post(submit_endpoint, json=submit_req_body)
         response.raise_for_status()
         return response.json()
 
 
+async def create_study_structure_study_visit(
+    study_uid: str,
+    is_global_anchor_visit: bool,
+    study_epoch_uid: str,
+    visit_type_uid: str,
+    visit_contact_mode_uid: str,
+    time_value: str,
+    time_unit_uid: str,
+    description: str,
+    min_visit_window_value: str = "0",
+    max_visit_window_value: str = "0",
+    visit_window_unit_uid: str = "UnitDefinition_000364",
+    context: StudyVisitContext | None = None,
+):
+    if context is None:
+        context = await study_visit_context()
+    req_body = study_visit_request_body(
+        study_epoch_uid=study_epoch_uid,
+        visit_type_uid=visit_type_uid,
+        visit_contact_mode_uid=visit_contact_mode_uid,
+        time_value=time_value,
+        time_unit_uid=time_unit_uid,
+        description=description,
+        context=context,
+        min_visit_window_value=min_visit_window_value,
+        max_visit_window_value=max_visit_window_value,
+        visit_window_unit_uid=visit_window_unit_uid,
+    )
+    preview = await preview_study_visit(study_uid, req_body)
+    return await submit_study_visit(
+        study_uid, req_body, preview, is_global_anchor_visit
+    )
+
+
 async def create_study_activities_concept(
     name: str,
     group_uid: str,
@@ -781,7 +849,7 @@ async def create_study_activities_concept(
         "is_data_collected": is_data_collected,
         "flowchat_group": flowchat_group,
     }
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, json=req_body, headers=HEADERS)
         if (
             response.status_code == 422
@@ -800,7 +868,7 @@ async def create_study_activities_concept(
 async def create_study_activities_approvals(activity_uid: str):
     endpoint = f"{settings.osb_base_url}/concepts/activities/activities/{activity_uid}/approvals"
     HEADERS = {"Content-Type": "application/json"}
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, headers=HEADERS)
         if (
             response.status_code == 422
@@ -834,7 +902,7 @@ async def create_study_activity_api(
     }
     endpoint = f"{settings.osb_base_url}/studies/{study_uid}/study-activities"
     HEADERS = {"Content-Type": "application/json"}
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, json=post_payload, headers=HEADERS)
         if response.status_code == 409:
             # Log and continue if the activity already exists
@@ -867,7 +935,7 @@ async def create_study_activity_schedule(
         "study_visit_uid": study_visit_uid,
     }
 
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, json=payload, headers=headers)
 
         if (
@@ -885,32 +953,51 @@ async def create_study_activity_schedule(
         return response.json()
 
 
-async def create_study_activities_batch(
-    study_uid: str,
-    activity_uid: str,
-    activity_group_uid: str,
-    activity_subgroup_uid: str,
-    soa_group_term_uid: str,
-):  # study_objective
+async def create_study_activity_schedules_batch(
+    study_uid: str, schedules: list[dict]
+) -> list[dict]:
+    """
+    Create several study activity schedules with one batch request.
+
+    Args:
+        study_uid: The study UID
+        schedules: Payloads with a study_activity_uid and a study_visit_uid
+
+    Returns one result per schedule, in the same order, with the
+    ``response_code`` and ``content`` of its creation. Raises
+    ``httpx.HTTPStatusError`` if the batch request itself fails.
+    """
+    endpoint = (
+        f"{settings.osb_base_url}/studies/{study_uid}/study-activity-schedules/batch"
+    )
+    req_body = [{"method": "POST", "content": schedule} for schedule in schedules]
+
+    async with osb_client() as client:
+        response = await client.post(endpoint, json=req_body)
+        response.raise_for_status()
+        return response.json()
+
+
+async def create_study_activities_batch(study_uid: str, activities: list[dict]):
+    """
+    Add several activities to a study with one batch request.
+
+    Args:
+        study_uid: The study UID
+        activities: Payloads with the activity_uid, activity_group_uid,
+            activity_subgroup_uid, soa_group_term_uid and order of an activity
+
+    Returns one result per activity, in the same order, with the
+    ``response_code`` and ``content`` of its creation.
+    """
     endpoint = f"{settings.osb_base_url}/studies/{study_uid}/study-activities/batch"
-    req_body = [
-        {
-            "method": "POST",
-            "content": {
-                "soa_group_term_uid": soa_group_term_uid,
-                "activity_uid": activity_uid,
-                "order": None,
-                "activity_group_uid": activity_group_uid,
-                "activity_subgroup_uid": activity_subgroup_uid,
-            },
-        }
-    ]
+    req_body = [{"method": "POST", "content": activity} for activity in activities]
 
-    async with httpx.AsyncClient(timeout=60) as client:
+    async with osb_client() as client:
         response = await client.post(endpoint, json=req_body)
         if response.status_code == 422 or response.status_code == 404:
             raise Exception(
-                f"Failed to create study objective - Invalid data: {response.status_code} - {response.text}"
+                f"Failed to create study activities - Invalid data: {response.status_code} - {response.text}"
             )
         response.raise_for_status()
         return response.json()
@@ -1,10 +1,9 @@
-import httpx
-
-from ..settings import settings
+from .ct_terms import ct_term_index
 from .osb_api import create_study_population_api
 
 
 async def create_study_population(study_designs: list, study_uid: str):
+    ct_terms = ct_term_index()
     design = study_designs[0]
     indications = design.get("indications", [])
     standard_codes = [
@@ -15,31 +14,19 @@ async def create_study_population(study_designs: list, study_uid: str):
     disease_conditions_or_indications_codes = []
     if standard_codes:
         # Validate disease condition codes with OSB API
-        headers = {"accept": "application/json, text/plain, */*"}
-        async with httpx.AsyncClient() as client:
-            endpoint = f"{settings.osb_base_url}/dictionaries/terms?codelist_uid=DictionaryCodelist_000001&page_number=1&page_size=1000"  # TODO: hardcoded code
-            response = await client.get(endpoint, headers=headers)
-            if response.status_code == 200:
-                valid_codes = response.json().get("items", [])
-                valid_code_ids = [item.get("dictionary_id", "") for item in valid_codes]
-                for codes_list in standard_codes:
-                    for code_dict in codes_list:
-                        code = code_dict.get("code", "")
-                        if code in valid_code_ids:
-                            # Find the matching term_uid from OSB
-                            matching_item = next(
-                                (
-                                    item
-                                    for item in valid_codes
-                                    if item.get("dictionary_id", "") == code
-                                ),
-                                None,
-                            )
-                            if matching_item:
-                                disease_conditions_or_indications_codes.append({
-                                    "term_uid": matching_item.get("term_uid", "string"),
-                                    "name": matching_item.get("name", ""),
-                                })
+        dictionary_terms = await ct_terms.dictionary_terms(
+            "DictionaryCodelist_000001"  # TODO: hardcoded code
+        )
+        for codes_list in standard_codes:
+            for code_dict in codes_list:
+                matching_item = dictionary_terms.by_concept_id(
+                    code_dict.get("code", "")
+                )
+                if matching_item:
+                    disease_conditions_or_indications_codes.append({
+                        "term_uid": matching_item.get("term_uid", "string"),
+                        "name": matching_item.get("name", ""),
+                    })
 
     therapeutic_area = design.get("therapeuticAreas", [])
     therapeutic_area_codes = []
@@ -48,34 +35,22 @@ async def create_study_population(study_designs: list, study_uid: str):
             area.get("decode", "") for area in therapeutic_area if "code" in area
         ]
         if therapeutic_phase_codes:
-            headers = {"accept": "application/json, text/plain, */*"}
-            async with httpx.AsyncClient() as client:
-                endpoint = f"{settings.osb_base_url}/dictionaries/terms?codelist_uid=DictionaryCodelist_000001&page_number=1&page_size=1000"  # TODO: hardcoded code
-                response = await client.get(endpoint, headers=headers)
-                if response.status_code == 200:
-                    items = response.json().get("items", [])
-                    valid_decode = [item.get("name", "") for item in items]
-                    for decode in therapeutic_phase_codes:
-                        if decode in valid_decode:
-                            matching_item = next(
-                                (
-                                    item
-                                    for item in items
-                                    if item.get("name", "") == decode
-                                ),
-                                None,
-                            )
-                            if matching_item:
-                                therapeutic_area_codes.append({
-                                    "term_uid": matching_item.get("term_uid", "string"),
-                                    "name": matching_item.get("name", ""),
-                                })
-                                break
+            dictionary_terms = await ct_terms.dictionary_terms(
+                "DictionaryCodelist_000001"  # TODO: hardcoded code
+            )
+            for decode in therapeutic_phase_codes:
+                matching_item = dictionary_terms.by_name(decode)
+                if matching_item:
+                    therapeutic_area_codes.append({
+                        "term_uid": matching_item.get("term_uid", "string"),
+                        "name": matching_item.get("name", ""),
+                    })
+                    break
 
     population = design.get("population", {})
-    number_of_expected_subjects = population.get(
-        "plannedEnrollmentNumberQuantity", {}
-    ).get("value")  # noqa: F841
+    number_of_expected_subjects = (  # noqa: F841
+        population.get("plannedEnrollmentNumberQuantity") or {}
+    ).get("value")
 
     planned_sex = population.get("plannedSex", [])
     sex_of_participants_code = {}
@@ -83,22 +58,14 @@ async def create_study_population(study_designs: list, study_uid: str):
         sex_of_participants_code = planned_sex[0].get("code", "")
 
         if sex_of_participants_code:
-            endpoint = f"{settings.osb_base_url}/ct/terms?codelist_uid=C66732"
-            headers = {"accept": "application/json, text/plain, */*"}
-            async with httpx.AsyncClient() as client:
-                response = await client.get(endpoint, headers=headers)
-            if response.status_code == 200:
-                items = response.json().get("items", [])
-                for item in items:
-                    codelists = item.get("attributes", {}).get("concept_id", "")
-                    if codelists == sex_of_participants_code:
-                        sex_of_participants_code = {
-                            "term_uid": item.get("term_uid", "string"),
-                            "name": item.get("name", {}).get(
-                                "sponsor_preferred_name", "string"
-                            ),
-                        }
-                        break
+            sex_terms = await ct_terms.terms("C66732")
+            if item := sex_terms.by_concept_id(sex_of_participants_code):
+                sex_of_participants_code = {
+                    "term_uid": item.get("term_uid", "string"),
+                    "name": item.get("name", {}).get(
+                        "sponsor_preferred_name", "string"
+                    ),
+                }
 
     planned_age = population.get("plannedAge", {})
     planned_minimum_age_of_subjects = {}
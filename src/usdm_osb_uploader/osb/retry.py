@@ -0,0 +1,139 @@
+import asyncio
+import random
+import re
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable
+
+import httpx
+
+from ..settings import settings
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Raised before the request reached OSB, so any method can be sent again
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+TRANSIENT_ERRORS = (httpx.TransportError,)
+
+
+class RetryPolicy:
+    """Which OSB requests are retried, how often and after which delay."""
+
+    def __init__(
+        self,
+        max_retries: int,
+        backoff: float,
+        max_backoff: float,
+        statuses: set[int],
+        safe_posts: list[str] | None = None,
+        rng: random.Random | None = None,
+    ):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = set(statuses)
+        self.safe_posts = [re.compile(pattern) for pattern in safe_posts or []]
+        self._random = rng or random.Random()
+
+    @classmethod
+    def from_settings(cls) -> "RetryPolicy":
+        return cls(
+            max_retries=settings.osb_max_retries,
+            backoff=settings.osb_retry_backoff,
+            max_backoff=settings.osb_retry_max_backoff,
+            statuses=settings.osb_retry_statuses,
+            safe_posts=settings.osb_retry_safe_posts,
+        )
+
+    def is_idempotent(self, request: httpx.Request) -> bool:
+        """GETs and the POSTs listed as safe can be sent more than once."""
+        if request.method in IDEMPOTENT_METHODS:
+            return True
+        return request.method == "POST" and any(
+            pattern.search(request.url.path) for pattern in self.safe_posts
+        )
+
+    def delay(self, retry: int, response: httpx.Response | None = None) -> float:
+        """Seconds to wait before retry number ``retry`` (starting at 1).
+
+        Exponential backoff with full jitter, unless a 429 or 503 response
+        says when to come back with ``Retry-After``.
+        """
+        if response is not None and response.status_code in (429, 503):
+            retry_after = parse_retry_after(response.headers.get("retry-after"))
+            if retry_after is not None:
+                return min(retry_after, self.max_backoff)
+        ceiling = min(self.max_backoff, self.backoff * 2 ** (retry - 1))
+        return self._random.uniform(0, ceiling)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds from a ``Retry-After`` header given in seconds or as a date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryTransport(httpx.AsyncBaseTransport):
+    """Retry transient OSB failures according to a ``RetryPolicy``.
+
+    Requests that never reached OSB are retried for every method; error
+    statuses and other transport errors only for idempotent requests. Each
+    retry is reported to ``on_retry``, and their number is stored in
+    ``response.extensions["osb_retries"]`` or in the ``osb_retries``
+    attribute of any error raised, cancellation included. Nothing is
+    printed, so callers decide how retries are shown.
+    """
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        policy: RetryPolicy,
+        on_retry: Callable[[httpx.Request], None] | None = None,
+    ):
+        self._transport = transport
+        self.policy = policy
+        self.on_retry = on_retry
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        idempotent = self.policy.is_idempotent(request)
+        retry = 0
+        try:
+            while True:
+                try:
+                    response = await self._transport.handle_async_request(request)
+                except TRANSIENT_ERRORS as e:
+                    retryable = isinstance(e, UNSENT_ERRORS) or idempotent
+                    if not retryable or retry >= self.policy.max_retries:
+                        raise
+                    retry += 1
+                    delay = self.policy.delay(retry)
+                else:
+                    if (
+                        response.status_code not in self.policy.statuses
+                        or not idempotent
+                        or retry >= self.policy.max_retries
+                    ):
+                        response.extensions["osb_retries"] = retry
+                        return response
+                    await response.aclose()
+                    retry += 1
+                    delay = self.policy.delay(retry, response)
+                if self.on_retry is not None:
+                    self.on_retry(request)
+                await asyncio.sleep(delay)
+        except BaseException as e:
+            # Whatever ends the attempts, cancellation during the backoff
+            # included, carries the retries already reported to on_retry
+            e.osb_retries = retry
+            raise
+
+    async def aclose(self):
+        await self._transport.aclose()
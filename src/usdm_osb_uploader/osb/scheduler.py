@@ -0,0 +1,171 @@
+import asyncio
+import re
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+from ..settings import settings
+
+UID_PATTERN = re.compile(r"[A-Za-z]+_\d+")
+
+
+def endpoint_family(request: httpx.Request, base_url: str | None = None) -> str:
+    """Group a request into the endpoint family its concurrency limit applies to.
+
+    Every approval is ``approvals``; study sub-resources are named after the
+    resource (``/studies/{uid}/study-visits/preview`` is ``study-visits``);
+    other endpoints use their first two path segments that are not uids
+    (``ct/terms``, ``objective-templates``).
+    """
+    base_path = urlsplit(base_url or settings.osb_base_url).path.rstrip("/")
+    path = request.url.path
+    if path.startswith(base_path):
+        path = path[len(base_path) :]
+    segments = [segment for segment in path.split("/") if segment]
+    if "approvals" in segments:
+        return "approvals"
+    if segments[:1] == ["studies"] and len(segments) > 2:
+        return segments[2]
+    names = [segment for segment in segments if not UID_PATTERN.fullmatch(segment)]
+    return "/".join(names[:2])
+
+
+class FamilyStats:
+    """Queue and wait statistics of one endpoint family."""
+
+    def __init__(self):
+        self.requests = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.retries = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "total_wait": self.total_wait,
+            "max_wait": self.max_wait,
+            "mean_wait": self.total_wait / self.requests if self.requests else 0.0,
+            "retries": self.retries,
+        }
+
+
+class RequestScheduler:
+    """Bound the number of OSB requests in flight.
+
+    A request first waits for a slot of its endpoint family, if that family
+    has a limit, then for one of the global slots. Families without a limit
+    only share the global limit.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        family_limits: dict[str, int] | None = None,
+        base_url: str | None = None,
+    ):
+        self.max_in_flight = max_in_flight
+        self.base_url = base_url
+        self.family_limits = dict(family_limits or {})
+        self._global = asyncio.Semaphore(max_in_flight)
+        self._families = {
+            family: asyncio.Semaphore(limit)
+            for family, limit in self.family_limits.items()
+        }
+        self._stats: dict[str, FamilyStats] = {}
+
+    @classmethod
+    def from_settings(cls) -> "RequestScheduler":
+        return cls(settings.osb_max_in_flight_requests, settings.osb_endpoint_limits)
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of requests currently waiting for a slot."""
+        return sum(stats.queued for stats in self._stats.values())
+
+    def stats(self) -> dict[str, dict]:
+        """Statistics per endpoint family, busiest family first."""
+        return {
+            family: stats.as_dict()
+            for family, stats in sorted(
+                self._stats.items(), key=lambda item: -item[1].requests
+            )
+        }
+
+    def record_retry(self, request: httpx.Request):
+        """Count a retry of ``request`` for its endpoint family."""
+        family = endpoint_family(request, self.base_url)
+        self._stats.setdefault(family, FamilyStats()).retries += 1
+
+    async def run(self, family: str, send):
+        """Await ``send()`` once a slot of ``family`` and a global slot are free."""
+        stats = self._stats.setdefault(family, FamilyStats())
+        stats.requests += 1
+        family_slot = self._families.get(family)
+        queued = self._global.locked() or (
+            family_slot is not None and family_slot.locked()
+        )
+        if queued:
+            stats.queued += 1
+            stats.max_queued = max(stats.max_queued, stats.queued)
+        start = time.perf_counter()
+        try:
+            if family_slot is not None:
+                await family_slot.acquire()
+            try:
+                await self._global.acquire()
+            except BaseException:
+                if family_slot is not None:
+                    family_slot.release()
+                raise
+        finally:
+            if queued:
+                stats.queued -= 1
+
+        wait = time.perf_counter() - start
+        stats.total_wait += wait
+        stats.max_wait = max(stats.max_wait, wait)
+        stats.in_flight += 1
+        stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+        try:
+            return await send()
+        finally:
+            stats.in_flight -= 1
+            self._global.release()
+            if family_slot is not None:
+                family_slot.release()
+
+
+class SchedulingTransport(httpx.AsyncBaseTransport):
+    """Send requests through ``transport`` under a ``RequestScheduler``."""
+
+    def __init__(
+        self, transport: httpx.AsyncBaseTransport, scheduler: RequestScheduler
+    ):
+        self._transport = transport
+        self.scheduler = scheduler
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        async def send() -> httpx.Response:
+            response = await self._transport.handle_async_request(request)
+            # Keep the slot until the body is received, not just the headers
+            try:
+                await response.aread()
+            except BaseException:
+                await response.aclose()
+                raise
+            return response
+
+        family = endpoint_family(request, self.scheduler.base_url)
+        return await self.scheduler.run(family, send)
+
+    async def aclose(self):
+        await self._transport.aclose()
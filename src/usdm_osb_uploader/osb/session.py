@@ -0,0 +1,200 @@
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING
+
+import httpx
+
+from ..settings import settings
+from .ct_cache import CtCacheStore, CtCacheTransport
+from .metrics import MetricsRecorder, MetricsTransport
+from .retry import RetryPolicy, RetryTransport
+from .scheduler import RequestScheduler, SchedulingTransport
+
+if TYPE_CHECKING:
+    from .activity_library import ActivityLibraryIndex
+    from .ct_terms import CtTermIndex
+
+
+class OsbSession:
+    """Run-scoped state shared by every OSB call of an upload.
+
+    Holds a single pooled ``httpx.AsyncClient`` so that the hundreds of
+    requests made per study reuse keep-alive connections instead of paying a
+    new TCP+TLS handshake each time, plus the lookup caches that live as long
+    as the run (terminology, activity library).
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        scheduler: RequestScheduler | None = None,
+        metrics: MetricsRecorder | None = None,
+    ):
+        self.client = client
+        self.scheduler = scheduler
+        self.metrics = metrics
+        self.locks: dict[str, asyncio.Lock] = {}
+        self.ct_terms: "CtTermIndex | None" = None
+        self.activity_library: "asyncio.Future[ActivityLibraryIndex | None] | None" = (
+            None
+        )
+
+
+class RequestStats:
+    """Number of requests sent to OSB while counting with ``count_requests``."""
+
+    def __init__(self):
+        self.requests = 0
+
+
+_current_session: ContextVar[OsbSession | None] = ContextVar(
+    "osb_session", default=None
+)
+_request_stats: ContextVar[RequestStats | None] = ContextVar(
+    "osb_request_stats", default=None
+)
+
+
+class CountingTransport(httpx.AsyncBaseTransport):
+    """Count the requests sent through ``transport`` in the current context."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.requests += 1
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def build_transport() -> httpx.AsyncBaseTransport:
+    """Create the pooled network transport configured from ``Settings``."""
+    limits = httpx.Limits(
+        max_connections=settings.osb_max_connections,
+        max_keepalive_connections=settings.osb_max_keepalive_connections,
+        keepalive_expiry=settings.osb_keepalive_expiry,
+    )
+    return httpx.AsyncHTTPTransport(limits=limits)
+
+
+def build_client(
+    transport: httpx.AsyncBaseTransport | None = None,
+    ct_cache: bool | None = None,
+    scheduler: RequestScheduler | None = None,
+    metrics: MetricsRecorder | None = None,
+) -> httpx.AsyncClient:
+    """Create an ``httpx.AsyncClient`` configured from ``Settings``.
+
+    Args:
+        transport: Transport to send requests through instead of the network.
+        ct_cache: Serve terminology from the persistent snapshot; defaults to
+            ``settings.osb_ct_cache_enabled``.
+        scheduler: Scheduler limiting the requests in flight; a new one
+            configured from ``Settings`` by default.
+        metrics: Recorder of every request made through the client.
+    """
+    # Counted, scheduled and retried below the terminology snapshot, so
+    # snapshot hits are neither counted nor held back. Retries are above the
+    # scheduler so a request does not hold a slot while backing off.
+    scheduler = scheduler or RequestScheduler.from_settings()
+    transport = CountingTransport(transport or build_transport())
+    transport = SchedulingTransport(transport, scheduler)
+    transport = RetryTransport(
+        transport, RetryPolicy.from_settings(), on_retry=scheduler.record_retry
+    )
+    if settings.osb_ct_cache_enabled if ct_cache is None else ct_cache:
+        transport = CtCacheTransport(
+            transport, CtCacheStore(settings.osb_ct_cache_path)
+        )
+    if metrics is not None:
+        # Outermost, so latencies include queueing and retries
+        transport = MetricsTransport(transport, metrics)
+    timeout = httpx.Timeout(settings.osb_timeout, connect=settings.osb_connect_timeout)
+    return httpx.AsyncClient(transport=transport, timeout=timeout)
+
+
+def current_session() -> OsbSession | None:
+    """Return the session of the active upload run, if any."""
+    return _current_session.get()
+
+
+@asynccontextmanager
+async def osb_session(
+    ct_cache: bool | None = None, transport: httpx.AsyncBaseTransport | None = None
+):
+    """Open the shared OSB session for the duration of an upload run.
+
+    Nested uses reuse the already active session, so a command may wrap
+    code that itself opens a session.
+
+    Args:
+        ct_cache: Use the persistent terminology snapshot; defaults to
+            ``settings.osb_ct_cache_enabled``.
+        transport: Transport to send requests through instead of the network,
+            e.g. a ``FakeOsb``.
+    """
+    session = _current_session.get()
+    if session is not None:
+        yield session
+        return
+
+    scheduler = RequestScheduler.from_settings()
+    metrics = MetricsRecorder()
+    async with build_client(
+        transport=transport, ct_cache=ct_cache, scheduler=scheduler, metrics=metrics
+    ) as client:
+        session = OsbSession(client, scheduler, metrics)
+        token = _current_session.set(session)
+        try:
+            yield session
+        finally:
+            _current_session.reset(token)
+
+
+@asynccontextmanager
+async def osb_client():
+    """Yield the pooled client of the active session.
+
+    Outside of a session (e.g. when a step function is called directly from
+    Python) a short-lived client is opened and closed instead.
+    """
+    session = _current_session.get()
+    if session is not None:
+        yield session.client
+        return
+
+    async with build_client() as client:
+        yield client
+
+
+def session_lock(name: str) -> asyncio.Lock:
+    """Return the lock ``name`` of the active session.
+
+    Used to serialize read-then-create sequences when several studies are
+    uploaded at once. Outside of a session a new, uncontended lock is
+    returned.
+    """
+    session = _current_session.get()
+    if session is None:
+        return asyncio.Lock()
+    return session.locks.setdefault(name, asyncio.Lock())
+
+
+@contextmanager
+def count_requests():
+    """Count the OSB requests made by the current task and the tasks it starts.
+
+    Lookups shared through the session caches are counted once, for the task
+    that made them first.
+    """
+    stats = RequestStats()
+    token = _request_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _request_stats.reset(token)
@@ -1,8 +1,19 @@
+import asyncio
+
 import httpx
 from pydantic import BaseModel
 
 from ..settings import settings
-from .osb_api import create_study_activity_schedule
+from .osb_api import (
+    create_study_activity_schedule,
+    create_study_activity_schedules_batch,
+)
+from .session import osb_client
+
+# Statuses of a batch request meaning OSB has no batch endpoint for schedules.
+# A 404 is not one of them: OSB also answers it for an unknown study or visit,
+# so such a chunk is retried one by one but later chunks still use the batch
+BATCH_UNAVAILABLE_STATUSES = {405, 501}
 
 
 class StudyActivity(BaseModel):
@@ -10,8 +21,8 @@ class StudyActivity(BaseModel):
 
     study_activity_uid: str
     activity_name: str
-    activity_uid: str
-    order: int
+    activity_uid: str = ""
+    order: int = 0
 
 
 async def fetch_existing_study_activities(study_uid: str):
@@ -23,7 +34,7 @@ async def fetch_existing_study_activities(study_uid: str):
     endpoint = f"{settings.osb_base_url}/studies/{study_uid}/study-activities"
     params = {"page_size": 0, "page_number": 1}
 
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         response = await client.get(endpoint, params=params)
         response.raise_for_status()
         data = response.json()
@@ -42,68 +53,205 @@ async def fetch_existing_study_activities(study_uid: str):
     return activities
 
 
-async def create_schedule_of_activity(study_designs: list, study_uid: str):
+async def fetch_existing_schedules(study_uid: str) -> set[tuple[str, str]]:
+    """
+    Fetch the study's existing activity schedules.
+
+    Returns the (study_activity_uid, study_visit_uid) pair of every schedule.
+    """
+    endpoint = f"{settings.osb_base_url}/studies/{study_uid}/study-activity-schedules"
+
+    async with osb_client() as client:
+        response = await client.get(endpoint)
+        response.raise_for_status()
+        data = response.json()
+
+    items = data.get("items", []) if isinstance(data, dict) else data
+    return {
+        (item.get("study_activity_uid"), item.get("study_visit_uid")) for item in items
+    }
+
+
+def report_schedule_error(activity: StudyActivity, visit_uid: str, error_message: str):
+    if "400" in error_message or "422" in error_message:
+        print(
+            f"Activity schedule '{activity.activity_name}' -> '{visit_uid}' may already exist, checking status..."
+        )
+    else:
+        print(
+            f"Error creating activity schedule: '{activity.activity_name}' -> '{visit_uid}'"
+        )
+
+
+async def create_schedule_cell(study_uid: str, activity: StudyActivity, visit_uid: str):
+    try:
+        await create_study_activity_schedule(
+            study_uid=study_uid,
+            study_activity_uid=activity.study_activity_uid,
+            study_visit_uid=visit_uid,
+        )
+    except Exception as e:
+        report_schedule_error(activity, visit_uid, str(e))
+
+
+async def create_schedule_cells(study_uid: str, cells: list[tuple[StudyActivity, str]]):
+    """Create ``cells`` one request each, ``settings.osb_soa_concurrency`` at a time."""
+    remaining = iter(cells)
+
+    async def worker():
+        for activity, visit_uid in remaining:
+            await create_schedule_cell(study_uid, activity, visit_uid)
+
+    await asyncio.gather(
+        *(
+            worker()
+            for _ in range(max(min(settings.osb_soa_concurrency, len(cells)), 1))
+        )
+    )
+
+
+async def submit_schedule_cells(study_uid: str, cells: list[tuple[StudyActivity, str]]):
+    """
+    Create the schedule of activities cells in batches.
+
+    Cells are sent ``settings.osb_soa_batch_size`` at a time through the batch
+    endpoint. A chunk whose batch request fails is created with concurrent
+    single requests instead, and so is every later chunk if OSB has no batch
+    endpoint. Single requests are sent ``settings.osb_soa_concurrency`` at a
+    time. Failed cells are reported with their activity and visit.
+
+    Args:
+        study_uid: The study UID
+        cells: Study activity and study visit UID of every cell
+    """
+    batching = settings.osb_soa_batch_size > 0
+    chunk_size = settings.osb_soa_batch_size if batching else max(len(cells), 1)
+    for start in range(0, len(cells), chunk_size):
+        chunk = cells[start : start + chunk_size]
+        if batching:
+            try:
+                results = await create_study_activity_schedules_batch(
+                    study_uid,
+                    [
+                        {
+                            "study_activity_uid": activity.study_activity_uid,
+                            "study_visit_uid": visit_uid,
+                        }
+                        for activity, visit_uid in chunk
+                    ],
+                )
+            except Exception as e:
+                if (
+                    isinstance(e, httpx.HTTPStatusError)
+                    and e.response.status_code in BATCH_UNAVAILABLE_STATUSES
+                ):
+                    print("Batch endpoint unavailable, creating schedules one by one")
+                    batching = False
+                else:
+                    print(
+                        f"Batch creation of schedules failed, retrying one by one: {e}"
+                    )
+            else:
+                for (activity, visit_uid), result in zip(chunk, results):
+                    status = result.get("response_code", 0)
+                    if status >= 400:
+                        report_schedule_error(
+                            activity, visit_uid, f"{status} - {result.get('content')}"
+                        )
+                continue
+
+        await create_schedule_cells(study_uid, chunk)
+
+
+async def create_schedule_of_activity(
+    study_designs: list,
+    study_uid: str,
+    study_activity_uids: dict[str, str] | None = None,
+):
+    """Create the schedule of activities cells of the study.
+
+    ``study_activity_uids`` maps USDM activity ids to the study activities
+    added for them, as returned by ``create_study_activity``. Without it the
+    study activities are fetched from OSB and matched by name.
+    """
     design = study_designs[0]
     schedule = design.get("scheduleTimelines", [])[0]
     instances = schedule.get("instances", [])
     encounters = design.get("encounters", [])
-    activities = await fetch_existing_study_activities(study_uid=study_uid)
+    activities = (
+        await fetch_existing_study_activities(study_uid=study_uid)
+        if study_activity_uids is None
+        else []
+    )
 
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         visits_response = await client.get(
-            f"{settings.osb_base_url}/studies/{study_uid}/study-visits"
+            f"{settings.osb_base_url}/studies/{study_uid}/study-visits",
+            params={"page_size": 0, "page_number": 1},
         )
 
+    # Index everything once, keeping the first entry of duplicate keys like
+    # the scans they replace, so every SoA cell is resolved in constant time
+    encounter_descriptions: dict[str, str] = {}
+    for enc in encounters:
+        encounter_descriptions.setdefault(enc.get("id"), enc.get("description", ""))
+    visit_uids: dict[str, str] = {}
+    for item in visits_response.json().get("items", []):
+        visit_uids.setdefault(item.get("description", ""), item.get("uid", ""))
+    # Study activities by USDM activity id, from the ids the activities step
+    # returned or else by matching the activity names
+    study_activities: dict[str, StudyActivity] = {}
+    if study_activity_uids is None:
+        by_name: dict[str, StudyActivity] = {}
+        for a in activities:
+            by_name.setdefault(a.activity_name.lower(), a)
+        for act in design.get("activities", []):
+            activity = by_name.get((act.get("name") or "").lower())
+            if activity is not None:
+                study_activities.setdefault(act.get("id"), activity)
+    else:
+        for act in design.get("activities", []):
+            uid = study_activity_uids.get(act.get("id"))
+            if uid:
+                study_activities.setdefault(
+                    act.get("id"),
+                    StudyActivity(
+                        study_activity_uid=uid, activity_name=act.get("name") or ""
+                    ),
+                )
+
+    cells: list[tuple[StudyActivity, str]] = []
     for instance in instances:
-        enc_id = instance.get("encounterId")  # noqa: F841
-        for enc in encounters:
-            if enc.get("id") == enc_id:
-                visit_description = enc.get("description", "")
-                break
-        for item in visits_response.json().get("items", []):
-            if item.get("description", "") == visit_description:
-                visit_id = item.get("uid", "")
-                break
-        # visit_id = "visit_mapping_encounter.get(enc_id)"
+        enc_id = instance.get("encounterId")
+        if enc_id not in encounter_descriptions:
+            continue
+        visit_id = visit_uids.get(encounter_descriptions[enc_id])
         if not visit_id:
             continue
         for act_id in instance.get("activityIds", []):
-            activity = next(
-                (
-                    a
-                    for a in activities
-                    if a.activity_name.lower()
-                    == (
-                        next(
-                            (
-                                act
-                                for act in design.get("activities", [])
-                                if act.get("id") == act_id
-                            ),
-                            {},
-                        ).get("name")
-                        or ""
-                    ).lower()
-                ),
-                None,
-            )
+            activity = study_activities.get(act_id)
             if activity is None:
                 continue
-            try:
-                await create_study_activity_schedule(
-                    study_uid=study_uid,
-                    study_activity_uid=activity.study_activity_uid,
-                    study_visit_uid=visit_id,
-                )
-            except Exception as e:
-                error_message = str(e)
-                if "400" in error_message or "422" in error_message:
-                    print(
-                        f"Activity schedule '{activity.activity_name}' -> '{visit_id}' may already exist, checking status..."
-                    )
-                else:
-                    print(
-                        f"Error creating activity schedule: '{activity.activity_name}' -> '{visit_id}'"
-                    )
+            cells.append((activity, visit_id))
 
+    # Only cells that do not exist yet are submitted, and each cell once, so a
+    # rerun after a partial failure does not send a failing request per
+    # existing cell
+    existing = await fetch_existing_schedules(study_uid)
+    submitted: set[tuple[str, str]] = set()
+    missing = []
+    already_in_osb = 0
+    for activity, visit_id in cells:
+        key = (activity.study_activity_uid, visit_id)
+        if key in existing:
+            already_in_osb += 1
+        elif key not in submitted:
+            submitted.add(key)
+            missing.append((activity, visit_id))
+    duplicated = len(cells) - len(missing) - already_in_osb
+    if already_in_osb:
+        print(f"Skipping {already_in_osb} activity schedules already in OSB")
+    if duplicated:
+        print(f"Skipping {duplicated} activity schedules repeated in the USDM")
+    await submit_schedule_cells(study_uid, missing)
     print("Schedule of activities created successfully.")
@@ -1,10 +1,18 @@
+import asyncio
 import re
-from collections import defaultdict
+from dataclasses import dataclass
 
 import httpx
 
 from ..settings import settings
-from .osb_api import create_study_structure_study_visit
+from .ct_terms import ct_term_index
+from .osb_api import (
+    preview_study_visit,
+    study_visit_context,
+    study_visit_request_body,
+    submit_study_visit,
+)
+from .session import osb_client
 
 
 def extract_day_or_week_value_dynamic_with_anchor_flag(timings: list) -> dict:
@@ -68,34 +76,137 @@ def finalize_timing_integration(schedule: dict, encounters: list) -> dict:
     return result
 
 
-async def fetch_contact_mode_uid(code_value: str) -> str:
-    code_map = {"C175574": "On Site Visit", "C171537": "Phone Contact"}
-    for key, value in code_map.items():
-        if key.lower() == code_value.lower():
-            preferred_name = value
-            break
+async def fetch_contact_mode_uid(code_value: str) -> str | None:
+    """Term uid of the visit contact mode with the USDM code ``code_value``.
 
+    Codes are mapped to contact mode names by
+    ``settings.osb_contact_mode_codes``. The contact mode codelist is loaded
+    once per run through the terminology index.
+    """
+    code_map = {
+        code.lower(): name for code, name in settings.osb_contact_mode_codes.items()
+    }
+    preferred_name = code_map.get((code_value or "").lower())
     if not preferred_name:
         return None
-    headers = {"accept": "application/json, text/plain, */*"}
-    async with httpx.AsyncClient() as client:
-        res = await client.get(
-            (settings.osb_base_url)
-            + "/ct/codelists?filters=%7B%22*%22:%7B%22v%22:%5B%22visit+contact+mode%22%5D%7D%7D&library_name=Sponsor"
-        )
-        res.raise_for_status()
-        data = res.json()
-        contact_type_ct_uid = data.get("items", [])[0].get("codelist_uid")
 
-        response = await client.get(
-            f"{settings.osb_base_url}/ct/terms?codelist_uid={contact_type_ct_uid}&page_number=1&page_size=1000",
-            headers=headers,
+    terms = ct_term_index()
+    contact_type_ct_uid = await terms.search_codelist_uid("visit contact mode")
+    if contact_type_ct_uid is None:
+        return None
+    term = (await terms.terms(contact_type_ct_uid)).by_name(preferred_name)
+    return term.get("term_uid") if term else None
+
+
+@dataclass
+class PlannedVisit:
+    """A visit to create for an encounter, with its OSB references resolved."""
+
+    encounter: dict
+    study_epoch_uid: str
+    visit_type_uid: str
+    time_value: int | None
+    time_unit_uid: str
+    # Length of the time unit in days, if OSB knows the unit and days
+    time_unit_days: float | None = None
+
+    @property
+    def is_global_anchor_visit(self) -> bool:
+        return self.time_value == 0
+
+
+def local_visit_labels(visit: PlannedVisit) -> dict[str, str] | None:
+    """Study day and week labels of a visit, derived the way OSB does.
+
+    A visit ``n`` days after the global anchor visit is on day ``n + 1`` and
+    in week ``n // 7 + 1``; before the anchor there is no day or week 0, so
+    day ``-1`` is in week ``-1``. Returns ``None`` if the visit has no time
+    or its unit cannot be converted to days.
+    """
+    if visit.time_value is None or not visit.time_unit_days:
+        return None
+    days = int(float(visit.time_value) * visit.time_unit_days)
+    weeks = int(days / 7)
+    day_number = days + 1 if days >= 0 else days
+    week_number = weeks + 1 if days >= 0 else weeks - 1
+    return {
+        "study_day_label": f"Day {day_number}",
+        "study_week_label": f"Week {week_number}",
+    }
+
+
+def plan_study_visits(
+    encounters: list,
+    schedule: dict,
+    epochs: list,
+    encounter_timing_map: dict,
+    study_epochs: list,
+    visit_types: list,
+    time_units: list,
+) -> list[PlannedVisit]:
+    """Plan the visits of ``encounters`` in creation order.
+
+    Encounters are ordered by their time value, the global anchor visit
+    first as OSB derives the other visits' timing from it. Encounters
+    without a study epoch in OSB are left out with a warning.
+    """
+    encounter_epoch_ids: dict[str, str] = {}
+    for inst in schedule.get("instances", []):
+        encounter_epoch_ids.setdefault(inst.get("encounterId"), inst.get("epochId"))
+    epoch_names: dict[str, str] = {}
+    for epoch in epochs:
+        epoch_names.setdefault(epoch.get("id"), epoch.get("name", ""))
+    study_epochs_by_name: dict[str, dict] = {}
+    for item in study_epochs:
+        study_epochs_by_name.setdefault(item.get("epoch_name", ""), item)
+    visit_type_uids: dict[str, str] = {}
+    for item in visit_types:
+        visit_type_uids.setdefault(
+            item.get("sponsor_preferred_name", "").lower(), item.get("term_uid")
         )
-        if response.status_code == 200:
-            for item in response.json().get("items", []):
-                name = item.get("name", {}).get("sponsor_preferred_name", "")
-                if name == preferred_name:
-                    return item.get("term_uid")
+    time_units_by_name: dict[str, dict] = {}
+    for item in time_units:
+        time_units_by_name.setdefault(item.get("name"), item)
+    # Conversion factors are relative to OSB's master unit, whatever it is, so
+    # times are converted to days with the day unit's own factor
+    day_factor = time_units_by_name.get("day", {}).get("conversion_factor_to_master")
+
+    anchors: list[PlannedVisit] = []
+    others: list[PlannedVisit] = []
+    # Encounters without timing go last
+    for enc in sorted(
+        encounters,
+        key=lambda enc: encounter_timing_map.get(enc.get("id"), {}).get(
+            "value", float("inf")
+        ),
+    ):
+        enc_id = enc.get("id")
+        epoch_name = epoch_names.get(encounter_epoch_ids.get(enc_id), "")
+        study_epoch = study_epochs_by_name.get(epoch_name, {})
+        if not study_epoch.get("uid"):
+            print(
+                f"Skipping encounter '{enc.get('name', enc_id)}': no study epoch"
+                f" '{epoch_name}' in OSB"
+            )
+            continue
+        timing_data = encounter_timing_map.get(enc_id, {})
+        time_unit = time_units_by_name.get(timing_data.get("unit"), {})
+        visit = PlannedVisit(
+            encounter=enc,
+            study_epoch_uid=study_epoch["uid"],
+            visit_type_uid=visit_type_uids.get(
+                study_epoch.get("epoch_subtype_name", "").lower(), ""
+            ),
+            time_value=timing_data.get("value"),
+            time_unit_uid=time_unit.get("uid", ""),
+            time_unit_days=(
+                time_unit["conversion_factor_to_master"] / day_factor
+                if day_factor and time_unit.get("conversion_factor_to_master")
+                else None
+            ),
+        )
+        (anchors if visit.is_global_anchor_visit else others).append(visit)
+    return anchors + others
 
 
 async def create_study_visits(study_designs: list, study_uid: str):
@@ -105,7 +216,6 @@ async def create_study_visits(study_designs: list, study_uid: str):
     schedule = design.get("scheduleTimelines", [])[0]
 
     encounter_timing_map = finalize_timing_integration(schedule, encounters)
-    epoch_first_visit_flag = defaultdict(lambda: True)
     print(encounter_timing_map)
 
     first_unit = None
@@ -115,200 +225,143 @@ async def create_study_visits(study_designs: list, study_uid: str):
             break
 
     global_visit_window_unit_uid = ""
-    time_unit_response = None
-    async with httpx.AsyncClient() as client:
+    async with osb_client() as client:
         time_unit_response = await client.get(
-            "https://dev-osb.ailens.ai/api/concepts/unit-definitions?subset=Study+Time&sort_by[conversion_factor_to_master]=true&page_size=0"
+            f"{settings.osb_base_url}/concepts/unit-definitions?subset=Study+Time&sort_by[conversion_factor_to_master]=true&page_size=0"
         )
-        for item in time_unit_response.json().get("items", []):
+        time_units = time_unit_response.json().get("items", [])
+        for item in time_units:
             if item.get("name") == first_unit:
                 global_visit_window_unit_uid = item.get("uid")
                 break
 
-    # Sort encounters by time value to ensure proper chronological order
-    encounter_time_pairs = []
-    for enc in encounters:
-        enc_id = enc.get("id")
-        timing_data = encounter_timing_map.get(enc_id, {})
-        time_val = timing_data.get("value")
-        if time_val is not None:
-            encounter_time_pairs.append((time_val, enc))
-        else:
-            encounter_time_pairs.append((float("inf"), enc))
-
-    encounter_time_pairs.sort(key=lambda x: x[0])
-
-    async with httpx.AsyncClient() as client:
         epochs_response = await client.get(
-            f"{settings.osb_base_url}/studies/{study_uid}/study-epochs?page_number=1&page_size=10&total_count=true&study_uid={study_uid}"
+            f"{settings.osb_base_url}/studies/{study_uid}/study-epochs?page_number=1&page_size=0&total_count=true&study_uid={study_uid}"
         )
-
-    for time_val, enc in encounter_time_pairs:
-        enc_id = enc.get("id")
-        epoch_id = next(
-            (
-                inst.get("epochId")
-                for inst in schedule["instances"]
-                if inst.get("encounterId") == enc_id
-            ),
-            None,
+        visit_type_response = await client.get(
+            f"{settings.osb_base_url}/ct/terms/names?page_size=0&codelist_name=VisitType"
         )
 
-        epoch_name: str = ""
-        epoch_uid: str = ""
-        epoch_type_name: str = ""
-        visit_type_uid: str = ""
-
-        for epoch in epochs:
-            if epoch.get("id") == epoch_id:
-                epoch_name = epoch.get("name", "")
-                break
-
-        for item in epochs_response.json().get("items", []):
-            if item.get("epoch_name", "") == epoch_name:
-                epoch_uid = item.get("uid", "")
-                epoch_type_name = item.get("epoch_subtype_name", "")
-                break
-        async with httpx.AsyncClient() as client:
-            visit_type_response = await client.get(
-                f"{settings.osb_base_url}/ct/terms/names?page_size=0&codelist_name=VisitType"
-            )
-            for item in visit_type_response.json().get("items", []):
-                if (
-                    item.get("sponsor_preferred_name", "").lower()
-                    == epoch_type_name.lower()
-                ):
-                    visit_type_uid = item.get("term_uid")
-                    break
-        if not epoch_uid:
-            continue
+    # The time reference and epoch allocation are the same for every visit
+    try:
+        context = await study_visit_context()
+    except Exception as e:
+        print(f"Error resolving study visit reference terms: {e}")
+        return
+
+    plan = plan_study_visits(
+        encounters,
+        schedule,
+        epochs,
+        encounter_timing_map,
+        epochs_response.json().get("items", []),
+        visit_type_response.json().get("items", []),
+        time_units,
+    )
+    semaphore = asyncio.Semaphore(max(settings.osb_visit_preview_concurrency, 1))
+    # With local labels OSB is only asked for a preview if the labels cannot
+    # be derived, or to verify them for a sample of the visits
+    labels_mode = settings.osb_visit_labels
+    sample_step = max(len(plan) // max(settings.osb_visit_labels_verify_sample, 1), 1)
+    verified = (
+        {visit.encounter.get("id") for visit in plan[::sample_step]}
+        if labels_mode == "verify"
+        else set()
+    )
+    checked = mismatches = 0
 
-        timing_data = encounter_timing_map.get(enc_id, {})
-        time_val = timing_data.get("value")
-        if time_val == 0:
-            time_unit_uid = ""
-            for item in time_unit_response.json().get("items", []):
-                if item.get("name") == timing_data.get("unit"):
-                    time_unit_uid = item.get("uid")
-                    break
-
-            description = enc.get("description", "")
-            label = enc.get("label", "").lower()  # noqa: F841
-
-            contact_modes = enc.get("contactModes", [])
+    async def preview(visit: PlannedVisit) -> tuple[dict, dict]:
+        nonlocal checked, mismatches
+        async with semaphore:
+            contact_modes = visit.encounter.get("contactModes", [])
             contact_mode_code = contact_modes[0].get("code") if contact_modes else ""
-            contact_mode_uid = await fetch_contact_mode_uid(
-                code_value=contact_mode_code
-            )
-
-            is_milestone = epoch_first_visit_flag[epoch_uid]
-            epoch_first_visit_flag[epoch_uid] = False
-
-            try:
-                create_response = await create_study_structure_study_visit(
-                    study_uid=study_uid,
-                    study_epoch_uid=epoch_uid,
-                    visit_type_uid=visit_type_uid,
-                    visit_contact_mode_uid=contact_mode_uid,
-                    time_value=time_val,
-                    time_unit_uid=time_unit_uid,
-                    visit_window_unit_uid=global_visit_window_unit_uid,
-                    is_global_anchor_visit=time_val == 0,
-                    description=description,
-                )
-                # visit_mapping_encounter[enc_id] = create_response.get("uid")
-            except Exception as e:
-                if (
-                    isinstance(e, httpx.HTTPStatusError)
-                    and e.response.status_code == 409
-                ):
-                    print(f"Visit {enc.get('label', enc_id)} already exists")
-                else:
-                    print(f"Error creating visit {enc.get('label', enc_id)}: {str(e)}")
-        else:
-            continue
-
-    for time_val, enc in encounter_time_pairs:
-        enc_id = enc.get("id")
-        epoch_id = next(
-            (
-                inst.get("epochId")
-                for inst in schedule["instances"]
-                if inst.get("encounterId") == enc_id
-            ),
-            None,
-        )
-
-        epoch_name: str = ""
-        epoch_uid: str = ""
-        epoch_type_name: str = ""
-        visit_type_uid: str = ""
-
-        for epoch in epochs:
-            if epoch.get("id") == epoch_id:
-                epoch_name = epoch.get("name", "")
-                break
-        for item in epochs_response.json().get("items", []):
-            if item.get("epoch_name", "") == epoch_name:
-                epoch_uid = item.get("uid", "")
-                epoch_type_name = item.get("epoch_subtype_name", "")
-                break
-        async with httpx.AsyncClient() as client:
-            visit_type_response = await client.get(
-                f"{settings.osb_base_url}/ct/terms/names?page_size=0&codelist_name=VisitType"
+            req_body = study_visit_request_body(
+                study_epoch_uid=visit.study_epoch_uid,
+                visit_type_uid=visit.visit_type_uid,
+                visit_contact_mode_uid=await fetch_contact_mode_uid(
+                    code_value=contact_mode_code
+                ),
+                time_value=visit.time_value,
+                time_unit_uid=visit.time_unit_uid,
+                description=visit.encounter.get("description", ""),
+                context=context,
+                visit_window_unit_uid=global_visit_window_unit_uid,
             )
-            for item in visit_type_response.json().get("items", []):
-                if (
-                    item.get("sponsor_preferred_name", "").lower()
-                    == epoch_type_name.lower()
-                ):
-                    visit_type_uid = item.get("term_uid")
-                    break
-        if not epoch_uid:
-            continue
-
-        timing_data = encounter_timing_map.get(enc_id, {})
-        time_val = timing_data.get("value")
-        if time_val != 0:
-            time_unit_uid = ""
-            for item in time_unit_response.json().get("items", []):
-                if item.get("name") == timing_data.get("unit"):
-                    time_unit_uid = item.get("uid")
-                    break
-
-            description = enc.get("description", "")
-
-            contact_modes = enc.get("contactModes", [])
-            contact_mode_code = contact_modes[0].get("code") if contact_modes else ""
-            contact_mode_uid = await fetch_contact_mode_uid(
-                code_value=contact_mode_code
+            labels = local_visit_labels(visit) if labels_mode != "preview" else None
+            is_sampled = visit.encounter.get("id") in verified
+            if labels is not None and not is_sampled and not mismatches:
+                return req_body, labels
+            preview_response = await preview_study_visit(study_uid, req_body)
+            if labels is not None and is_sampled:
+                checked += 1
+                previewed_labels = {key: preview_response.get(key) for key in labels}
+                if previewed_labels != labels:
+                    # Every visit not created yet is previewed instead
+                    mismatches += 1
+                    print(
+                        f"Local labels {labels} of visit"
+                        f" {visit.encounter.get('label', visit.encounter.get('id'))}"
+                        f" differ from OSB's {previewed_labels}"
+                    )
+            return req_body, preview_response
+
+    async def submit(visit: PlannedVisit, previewed):
+        enc = visit.encounter
+        try:
+            req_body, preview_response = await previewed
+            await submit_study_visit(
+                study_uid, req_body, preview_response, visit.is_global_anchor_visit
             )
-
-            is_milestone = epoch_first_visit_flag[epoch_uid]  # noqa: F841
-            epoch_first_visit_flag[epoch_uid] = False
-
-            try:
-                create_response = await create_study_structure_study_visit(  # noqa: F841
-                    study_uid=study_uid,
-                    study_epoch_uid=epoch_uid,
-                    visit_type_uid=visit_type_uid,
-                    visit_contact_mode_uid=contact_mode_uid,
-                    time_value=time_val,
-                    time_unit_uid=time_unit_uid,
-                    visit_window_unit_uid=global_visit_window_unit_uid,
-                    is_global_anchor_visit=time_val == 0,
-                    description=description,
+        except Exception as e:
+            if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 409:
+                print(f"Visit {enc.get('label', enc.get('id'))} already exists")
+            else:
+                print(
+                    f"Error creating visit {enc.get('label', enc.get('id'))}: {str(e)}"
                 )
-                # visit_mapping_encounter[enc_id] = create_response.get("uid")
-            except Exception as e:
-                if (
-                    isinstance(e, httpx.HTTPStatusError)
-                    and e.response.status_code == 409
-                ):
-                    print(f"Visit {enc.get('label', enc_id)} already exists")
-                else:
-                    print(f"Error creating visit {enc.get('label', enc_id)}: {str(e)}")
-        else:
-            continue
 
+    # The other visits are timed relative to the global anchor visit, so it is
+    # created before anything else is previewed
+    anchors = [visit for visit in plan if visit.is_global_anchor_visit]
+    for visit in anchors:
+        await submit(visit, preview(visit))
+    others = plan[len(anchors) :]
+
+    # The sampled previews are all checked before any visit with local labels
+    # is created, so a mismatch is known before wrong labels could be sent
+    samples = {
+        visit.encounter.get("id"): asyncio.ensure_future(preview(visit))
+        for visit in others
+        if visit.encounter.get("id") in verified
+    }
+    previews = list(samples.values())
+    try:
+        await asyncio.gather(*previews, return_exceptions=True)
+
+        def previewed(visit: PlannedVisit):
+            sample = samples.get(visit.encounter.get("id"))
+            return sample if sample is not None else preview(visit)
+
+        # Without pipelining every visit is previewed right before it is
+        # created. Otherwise the remaining previews run concurrently, while
+        # the visits are created in chronological order as soon as their own
+        # preview is done
+        if settings.osb_visit_preview_concurrency > 0:
+            pipelined = [asyncio.ensure_future(previewed(visit)) for visit in others]
+            previews += pipelined
+            for visit, future in zip(others, pipelined):
+                await submit(visit, future)
+        else:
+            for visit in others:
+                await submit(visit, previewed(visit))
+    finally:
+        for future in previews:
+            future.cancel()
+        await asyncio.gather(*previews, return_exceptions=True)
+
+    if checked:
+        print(
+            f"Local visit labels matched {checked - mismatches} of {checked}"
+            " OSB previews"
+        )
     print("Visits created successfully.")
@@ -0,0 +1,271 @@
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+from rich.progress import Progress
+
+from .osb.activities import create_study_activity
+from .osb.arms import create_study_arm
+from .osb.create_study import create_study_id
+from .osb.criteria import create_study_criteria
+from .osb.download_usdm import download_usdm
+from .osb.elements import create_study_element
+from .osb.epochs import create_study_epochs
+from .osb.high_level_design import create_study_high_level_design
+from .osb.metrics import metrics_step
+from .osb.objectivies_endpoints import create_study_objective_endpoint
+from .osb.population import create_study_population
+from .osb.session import count_requests
+from .osb.soa import create_schedule_of_activity
+from .osb.visits import create_study_visits
+from .settings import settings
+
+
+@dataclass
+class Step:
+    """One step of an upload, run once every step in ``after`` has finished.
+
+    ``run`` receives the results of the finished steps by name.
+    """
+
+    name: str
+    description: str
+    run: Callable[[dict[str, Any]], Awaitable[Any] | None]
+    after: tuple[str, ...] = field(default_factory=tuple)
+
+
+def upload_steps(usdm_data: dict) -> list[Step]:
+    """The steps uploading one USDM study, with their dependencies."""
+    study_version = usdm_data.get("study", {}).get("versions", [])[0]
+    study_designs = study_version.get("studyDesigns", [])
+
+    def study_uid(results: dict) -> str:
+        return results["study"][0]
+
+    return [
+        Step("load", "Loading study data", lambda results: None),
+        Step(
+            "study",
+            "Creating study ID",
+            lambda results: create_study_id(usdm_data),
+            after=("load",),
+        ),
+        # Steps on the longest dependency chains come first, so they are not
+        # held back by the concurrency limit
+        Step(
+            "activities",
+            "Creating study activities",
+            lambda results: create_study_activity(
+                study_version, study_uid(results), results["study"][1]
+            ),
+            after=("study",),
+        ),
+        Step(
+            "epochs",
+            "Creating study epochs",
+            lambda results: create_study_epochs(study_designs, study_uid(results)),
+            after=("study",),
+        ),
+        Step(
+            "visits",
+            "Creating study visits",
+            lambda results: create_study_visits(study_designs, study_uid(results)),
+            after=("epochs",),
+        ),
+        Step(
+            "high_level_design",
+            "Creating high level design",
+            lambda results: create_study_high_level_design(
+                study_designs, study_uid(results)
+            ),
+            after=("study",),
+        ),
+        # Population and high level design both patch the study metadata, so
+        # they are not run at the same time
+        Step(
+            "population",
+            "Creating study populations",
+            lambda results: create_study_population(study_designs, study_uid(results)),
+            after=("high_level_design",),
+        ),
+        Step(
+            "arms",
+            "Creating study arms",
+            lambda results: create_study_arm(study_designs, study_uid(results)),
+            after=("study",),
+        ),
+        Step(
+            "elements",
+            "Creating study elements",
+            lambda results: create_study_element(study_designs, study_uid(results)),
+            after=("study",),
+        ),
+        Step(
+            "criteria",
+            "Creating study criteria",
+            lambda results: create_study_criteria(study_version, study_uid(results)),
+            after=("study",),
+        ),
+        Step(
+            "objectives_endpoints",
+            "Creating objectives & endpoints",
+            lambda results: create_study_objective_endpoint(
+                study_designs, study_uid(results)
+            ),
+            after=("study",),
+        ),
+        Step(
+            "schedule",
+            "Creating schedule of activities",
+            lambda results: create_schedule_of_activity(
+                study_designs, study_uid(results), results["activities"]
+            ),
+            after=("visits", "activities"),
+        ),
+        Step(
+            "download",
+            "Downloading USDM",
+            lambda results: download_usdm(study_uid(results)),
+            after=(
+                "arms",
+                "elements",
+                "population",
+                "criteria",
+                "objectives_endpoints",
+                "schedule",
+            ),
+        ),
+    ]
+
+
+async def run_steps(
+    steps: list[Step],
+    progress: Progress | None = None,
+    max_concurrency: int | None = None,
+    description: str | None = None,
+) -> dict[str, Any]:
+    """Run ``steps`` as soon as their dependencies are done.
+
+    At most ``max_concurrency`` steps run at the same time. When a step fails
+    the running steps are cancelled and its exception is raised. Returns the
+    result of every step by name.
+
+    Args:
+        steps: Steps to run.
+        progress: Progress display to add the overall and per step rows to.
+        max_concurrency: Defaults to ``settings.osb_max_parallel_steps``.
+        description: Show a single progress row with this description instead
+            of one row per step.
+    """
+    by_name = {step.name: step for step in steps}
+    for step in steps:
+        for dependency in step.after:
+            if dependency not in by_name:
+                raise ValueError(
+                    f"Step '{step.name}' depends on unknown '{dependency}'"
+                )
+
+    semaphore = asyncio.Semaphore(max_concurrency or settings.osb_max_parallel_steps)
+    overall_task = (
+        progress.add_task(description or "Overall Progress", total=len(steps))
+        if progress
+        else None
+    )
+    results: dict[str, Any] = {}
+
+    async def run(step: Step):
+        async with semaphore:
+            task = None
+            if progress and description is None:
+                task = progress.add_task(step.description, total=1)
+            with metrics_step(step.name):
+                result = step.run(results)
+                if result is not None:
+                    result = await result
+            if task is not None:
+                progress.update(task, advance=1)
+            if progress:
+                progress.update(overall_task, advance=1)
+            return result
+
+    pending = list(steps)
+    running: dict[asyncio.Task, Step] = {}
+    try:
+        while pending or running:
+            for step in list(pending):
+                if all(dependency in results for dependency in step.after):
+                    pending.remove(step)
+                    running[asyncio.create_task(run(step))] = step
+            if not running:
+                names = ", ".join(step.name for step in pending)
+                raise ValueError(f"Steps with circular dependencies: {names}")
+
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                step = running.pop(task)
+                results[step.name] = task.result()
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+    return results
+
+
+@dataclass
+class StudyUpload:
+    """Outcome of uploading one USDM file with ``upload_study``."""
+
+    path: Path
+    study_uid: str | None = None
+    study_id: str | None = None
+    error: str | None = None
+    duration: float = 0.0
+    requests: int = 0
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+async def upload_study(
+    path: Path, progress: Progress | None = None, description: str | None = None
+) -> StudyUpload:
+    """Upload one USDM file, recording a failure instead of raising it."""
+    upload = StudyUpload(path=path)
+    start = time.perf_counter()
+    with count_requests() as stats:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                usdm_data = json.load(f)
+            results = await run_steps(
+                upload_steps(usdm_data), progress=progress, description=description
+            )
+            upload.study_uid, upload.study_id = results["study"]
+        except Exception as e:
+            upload.error = str(e) or type(e).__name__
+    upload.duration = time.perf_counter() - start
+    upload.requests = stats.requests
+    return upload
+
+
+async def upload_studies(
+    paths: list[Path],
+    progress: Progress | None = None,
+    max_concurrency: int | None = None,
+) -> list[StudyUpload]:
+    """Upload several USDM files, at most ``max_concurrency`` at a time.
+
+    The files share the active OSB session, so connections and lookups are
+    reused across studies. A failing study does not stop the others.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or settings.osb_max_parallel_studies)
+
+    async def upload(path: Path) -> StudyUpload:
+        async with semaphore:
+            return await upload_study(path, progress=progress, description=path.name)
+
+    return await asyncio.gather(*(upload(path) for path in paths))
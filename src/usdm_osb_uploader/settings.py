@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Literal
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -8,6 +9,86 @@ PROJECT_ROOT = Path(".")
 class Settings(BaseSettings):
     osb_base_url: str
 
+    # HTTP session: one pooled client is shared by every call of an upload run
+    osb_timeout: float = 60.0
+    osb_connect_timeout: float = 10.0
+    osb_max_connections: int = 20
+    osb_max_keepalive_connections: int = 10
+    osb_keepalive_expiry: float = 30.0
+
+    # Request scheduler: global and per endpoint family limits on requests in
+    # flight, e.g. OSB_ENDPOINT_LIMITS='{"approvals": 2, "ct/terms": 4}'
+    osb_max_in_flight_requests: int = 16
+    osb_endpoint_limits: dict[str, int] = {
+        "approvals": 4,
+        "study-visits": 4,
+        "ct/terms": 8,
+    }
+
+    # Retries of transient failures: GETs and the POSTs matching one of the
+    # safe POST patterns are retried, other requests only when they never
+    # reached OSB
+    osb_max_retries: int = 3
+    osb_retry_backoff: float = 0.5
+    osb_retry_max_backoff: float = 30.0
+    osb_retry_statuses: set[int] = {429, 502, 503, 504}
+    osb_retry_safe_posts: list[str] = [r"/study-visits/preview$"]
+
+    # Upload steps that may run at the same time once their dependencies are done
+    osb_max_parallel_steps: int = 4
+    # Studies uploaded at the same time by batch-upload
+    osb_max_parallel_studies: int = 3
+
+    # Persistent controlled terminology snapshot, off unless asked for since
+    # terminology changed on the server is only seen once an entry expires
+    osb_ct_cache_enabled: bool = False
+    osb_ct_cache_path: Path = (
+        Path.home() / ".cache" / "usdm-osb-uploader" / "ct.sqlite3"
+    )
+    osb_ct_cache_ttl: float = 7 * 24 * 3600
+
+    # Visit previews run ahead of the visit creation; 0 previews each visit
+    # right before creating it
+    osb_visit_preview_concurrency: int = 4
+
+    # Study day and week labels of visits: "preview" asks OSB for them,
+    # "local" derives them without a preview request and "verify" derives
+    # them but also previews a sample of about osb_visit_labels_verify_sample
+    # visits, falling back to previews after the first mismatch
+    osb_visit_labels: Literal["preview", "local", "verify"] = "preview"
+    osb_visit_labels_verify_sample: int = 5
+
+    # Visit contact modes by USDM code, e.g.
+    # OSB_CONTACT_MODE_CODES='{"C175574": "On Site Visit", "C175575": "Virtual Visit"}'
+    osb_contact_mode_codes: dict[str, str] = {
+        "C175574": "On Site Visit",
+        "C171537": "Phone Contact",
+    }
+
+    # Activities resolved, created and approved at the same time
+    osb_activity_concurrency: int = 8
+    # Activities added to a study per batch request
+    osb_study_activity_batch_size: int = 50
+
+    # Schedule of activities cells created per batch request; 0 creates every
+    # cell with its own request
+    osb_soa_batch_size: int = 100
+    # Schedule of activities cells created with their own request at the same
+    # time, when they are not sent in a batch
+    osb_soa_concurrency: int = 8
+
+    # Headers replaced before a request or response is saved to a cassette
+    osb_cassette_scrub_headers: set[str] = {
+        "authorization",
+        "proxy-authorization",
+        "cookie",
+        "set-cookie",
+        "x-api-key",
+    }
+
+    # Minimum similarity (0-1) for fuzzy activity name and synonym matches
+    osb_activity_match_cutoff: float = 0.6
+
     model_config = SettingsConfigDict(
         env_file=PROJECT_ROOT / ".env",
         env_file_encoding="utf-8",